@@ -1 +1,4 @@
- 
\ No newline at end of file
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file once, before any app module reads its settings at import time
+load_dotenv()
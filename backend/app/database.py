@@ -1,10 +1,15 @@
+import logging
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from dotenv import load_dotenv
+from sqlalchemy.orm import Session, sessionmaker
 
-load_dotenv()  # Load environment variables from .env file in the backend directory
+from .utils.metrics import inc_counter
+
+logger = logging.getLogger(__name__)
 
 '''
 Purpose: Handles the connection to your PostgreSQL database using SQLAlchemy, the Object-Relational Mapper (ORM). 
@@ -15,18 +20,122 @@ The get_db function is a FastAPI dependency used to provide a database session t
 Reasoning: Centralizes database connection logic in one place, making it easier to manage and configure. 
 Using SQLAlchemy provides a Pythonic way to interact with the database instead of writing raw SQL everywhere. 
 The session management pattern ensures database connections are handled efficiently and correctly within the context of web requests.
+The engine is built on first use rather than at import, so importing the app stays cheap; warm_pool() opens
+the pool's connections ahead of traffic (called from the startup warm-up).
+
+Read/write split: when DATABASE_READ_URL is set (a streaming replica, or any second Postgres holding a copy),
+read-only endpoints take their session from get_read_db, which uses a separate read-only pool on that server,
+so search traffic does not compete with ingestion writes on the primary. The replica's replay lag is checked at
+most every READ_REPLICA_LAG_CHECK_SECONDS; while it is unreachable or more than READ_REPLICA_MAX_LAG_SECONDS
+behind, get_read_db hands out primary sessions instead. Without DATABASE_READ_URL both dependencies use the primary.
 '''
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", str(DB_POOL_SIZE)))
+DB_READ_MAX_OVERFLOW = int(os.getenv("DB_READ_MAX_OVERFLOW", str(DB_MAX_OVERFLOW)))
+READ_REPLICA_MAX_LAG_SECONDS = float(os.getenv("READ_REPLICA_MAX_LAG_SECONDS", "30"))
+READ_REPLICA_LAG_CHECK_SECONDS = float(os.getenv("READ_REPLICA_LAG_CHECK_SECONDS", "5"))
+DB_READ_CONNECT_TIMEOUT = int(os.getenv("DB_READ_CONNECT_TIMEOUT", "3")) # Seconds; an unreachable replica fails fast
+
+_engine = None
+_read_engine = None
+_engine_lock = threading.Lock()
+
+# Seconds since the last replayed transaction, or 0 when the replica has replayed everything it received
+# (an idle primary would otherwise look like lag). A server that is not in recovery is not lagging.
+_REPLICA_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END AS lag_seconds
+""")
+
+
+def get_engine() -> Engine:
+    """Returns the process-wide synchronous engine, creating it on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                if not DATABASE_URL:
+                    raise ValueError("DATABASE_URL environment variable not set.")
+                _engine = create_engine(DATABASE_URL, pool_recycle=1800, pool_pre_ping=True,
+                                        pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+    return _engine
+
+
+def get_read_engine() -> Engine:
+    """Returns the read-only engine on DATABASE_READ_URL (its own pool), or the primary engine when it is not set."""
+    global _read_engine
+    if not DATABASE_READ_URL:
+        return get_engine()
+    if _read_engine is None:
+        with _engine_lock:
+            if _read_engine is None:
+                # Read-only transactions, so a write routed here by mistake fails even on a non-replica stand-in
+                _read_engine = create_engine(DATABASE_READ_URL, pool_recycle=1800, pool_pre_ping=True,
+                                             pool_size=DB_READ_POOL_SIZE, max_overflow=DB_READ_MAX_OVERFLOW,
+                                             connect_args={"options": "-c default_transaction_read_only=on",
+                                                           "connect_timeout": DB_READ_CONNECT_TIMEOUT})
+    return _read_engine
 
-if not DATABASE_URL:
-    raise ValueError("DATABASE_URL environment variable not set.")
 
-# Create synchronous engine
-engine = create_engine(DATABASE_URL, pool_recycle=1800, pool_pre_ping=True)
+class _LazySessionFactory:
+    """Drop-in for a bound sessionmaker that binds to the engine when the first session is created."""
+
+    def __init__(self, engine_getter=get_engine):
+        self._engine_getter = engine_getter
+        self._factory = sessionmaker(autocommit=False, autoflush=False)
+
+    def __call__(self, **kwargs) -> Session:
+        if self._factory.kw.get("bind") is None:
+            self._factory.configure(bind=self._engine_getter())
+        return self._factory(**kwargs)
+
 
 # Create a session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = _LazySessionFactory()
+ReadSessionLocal = _LazySessionFactory(get_read_engine)
+
+
+class _ReplicaHealth:
+    """Whether the read replica is reachable and within READ_REPLICA_MAX_LAG_SECONDS, re-checked at most every READ_REPLICA_LAG_CHECK_SECONDS."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at = float("-inf")
+        self._usable = False
+        self.lag_seconds = None
+
+    def usable(self) -> bool:
+        if time.monotonic() - self._checked_at < READ_REPLICA_LAG_CHECK_SECONDS:
+            return self._usable
+        # One request re-checks; the others keep using the last answer instead of piling onto a slow replica
+        if not self._lock.acquire(blocking=False):
+            return self._usable
+        try:
+            try:
+                with get_read_engine().connect() as conn:
+                    self.lag_seconds = float(conn.execute(_REPLICA_LAG_SQL).scalar() or 0)
+                usable = self.lag_seconds <= READ_REPLICA_MAX_LAG_SECONDS
+                if not usable:
+                    logger.warning(f"Read replica is {self.lag_seconds:.1f}s behind (max {READ_REPLICA_MAX_LAG_SECONDS}s); reading from the primary.")
+            except Exception as e:
+                usable, self.lag_seconds = False, None
+                logger.warning(f"Read replica unavailable ({e}); reading from the primary.")
+            if usable and not self._usable and self._checked_at > float("-inf"):
+                logger.info("Read replica is back within the lag limit; routing reads to it again.")
+            self._usable, self._checked_at = usable, time.monotonic()
+            return usable
+        finally:
+            self._lock.release()
+
+
+replica_health = _ReplicaHealth()
 
 # Base class for SQLAlchemy models
 Base = declarative_base()
@@ -38,4 +147,38 @@ def get_db():
     finally:
         db.close()
 
+
+def open_read_session() -> Session:
+    """Session for read-only work: on the read replica when configured and fresh enough, else on the primary."""
+    if not DATABASE_READ_URL:
+        return SessionLocal()
+    use_replica = replica_health.usable()
+    inc_counter("app_db_read_sessions_total", 1, "Read-only sessions by the server they were routed to.",
+                target="replica" if use_replica else "primary")
+    return ReadSessionLocal() if use_replica else SessionLocal()
+
+
+def get_read_db():
+    """FastAPI dependency for read-only endpoints (see open_read_session)."""
+    db = open_read_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def warm_pool(connections: int = DB_POOL_SIZE, engine: Engine = None) -> int:
+    """Opens up to `connections` pooled connections (running SELECT 1 on each) and returns them to the pool."""
+    engine = engine or get_engine()
+    opened = []
+    try:
+        for _ in range(connections):
+            conn = engine.connect()
+            opened.append(conn)
+            conn.execute(text("SELECT 1"))
+    finally:
+        for conn in opened:
+            conn.close()
+    return len(opened)
+
 # print(f"Database URL: {DATABASE_URL[:]}...")
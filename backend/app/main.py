@@ -1,26 +1,54 @@
+import asyncio
+import logging
 import os
-from dotenv import load_dotenv
-from fastapi import FastAPI
+import time
+import uuid
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 # Import routers
-from .routers import data, pdf, retailers, products
-from . import database # Keep for SessionLocal usage if get_db_session remains here (or move get_db_session too)
+from .routers import data, pdf, retailers, products, pipeline, jobs
+from .worker import Worker, RUN_WORKER_IN_WEB
+from .database import SessionLocal
+from .services import worker_metrics
+from .utils import metrics
+from .utils.logging_config import setup_logging, shutdown_logging, request_id_var
+from .utils.warmup import warm_up, WARMUP_ON_STARTUP
+
+logger = logging.getLogger(__name__)
 
 '''
 Main FastAPI application entry point.
 Initializes the FastAPI app, configures CORS, includes API routers,
-and handles application startup tasks like creating directories.
+and handles application startup tasks (logging setup and warm-up) in the lifespan.
+Nothing connects to the database or model APIs at import time; clients are built lazily or by the warm-up,
+which runs before the server accepts requests. GET /health/ready reports whether it has finished.
+Background work is only enqueued here; worker processes (app/worker.py) run it, unless RUN_WORKER_IN_WEB is set.
+GET /metrics also includes the metrics the workers publish to Postgres.
 '''
 
-# Load environment variables
-load_dotenv()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    setup_logging()
+    app.state.ready = False
+    app.state.warmup = await warm_up() if WARMUP_ON_STARTUP else {}
+    app.state.ready = True
+    worker = Worker(publish_metrics=False) if RUN_WORKER_IN_WEB else None
+    worker_task = asyncio.create_task(worker.run(), name="embedded-worker") if worker else None
+    yield
+    if worker:
+        worker.stop()
+        await worker_task
+    shutdown_logging()
 
 # Create FastAPI app
 app = FastAPI(
     title="Grocery Budget Assistant API",
     description="API for managing weekly grocery ad data, including PDF processing.",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # Configure CORS
@@ -39,6 +67,60 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    """Collects per-stage timings for the request, exposes them as a Server-Timing header and records request latency."""
+    timings = []
+    token = metrics.request_timings.set(timings)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        metrics.request_timings.reset(token)
+    elapsed = time.perf_counter() - start
+    route = request.scope.get("route")
+    path = route.path if route else "unmatched"
+    metrics.observe("app_http_request_duration_seconds", elapsed, help_text="HTTP request latency.",
+                    method=request.method, path=path, status=response.status_code)
+    response.headers["Server-Timing"] = metrics.server_timing_header(timings + [("total", elapsed * 1000)])
+    return response
+
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    """Tags all log records of a request with its X-Request-ID (generated if the client did not send one)."""
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+@app.get("/health/live", include_in_schema=False)
+def liveness():
+    return {"status": "ok"}
+
+@app.get("/health/ready", include_in_schema=False)
+def readiness(request: Request):
+    if not getattr(request.app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    return {"status": "ready", "warmup": request.app.state.warmup}
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    # Worker processes publish their metrics to Postgres; serve this process's own even if that read fails
+    try:
+        db = SessionLocal()
+        try:
+            remote = worker_metrics.recent(db)
+        finally:
+            db.close()
+    except Exception as e:
+        logger.warning("Could not read worker metrics: %s", e)
+        remote = {}
+    return PlainTextResponse(metrics.render_prometheus(remote), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Grocery Budget Assistant API"}
@@ -48,6 +130,8 @@ app.include_router(data.router)
 app.include_router(pdf.router)
 app.include_router(retailers.router)
 app.include_router(products.router)
+app.include_router(pipeline.router)
+app.include_router(jobs.router)
 
 
 # Keep the run block
@@ -1,11 +1,24 @@
-from sqlalchemy import Column, Integer, String, Date, Numeric, Text, ForeignKey, DateTime, CheckConstraint, Index, BigInteger, text, Boolean
+from sqlalchemy import Column, Integer, String, Date, Numeric, Text, ForeignKey, DateTime, CheckConstraint, Index, BigInteger, text, Boolean, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
-from sqlalchemy.dialects.postgresql import TIMESTAMP, TSVECTOR
+from sqlalchemy.dialects.postgresql import TIMESTAMP, TSVECTOR, JSONB
 from pgvector.sqlalchemy import Vector
 
+import logging
+import os
+
 from .database import Base
 
+# Matryoshka-truncated copy of the 768-dim embedding, used for the coarse ANN pass in similarity search
+COMPACT_EMBEDDING_DIM = 256
+
+# Which embedding columns are stored and searched:
+# "full" = embedding only, "both" = embedding + embedding_compact, "compact" = embedding_compact only
+EMBEDDING_STORAGE_MODE = os.getenv("EMBEDDING_STORAGE_MODE", "both").lower()
+if EMBEDDING_STORAGE_MODE not in ("full", "both", "compact"):
+    logging.getLogger(__name__).warning(f"Unknown EMBEDDING_STORAGE_MODE '{EMBEDDING_STORAGE_MODE}'. Falling back to 'both'.")
+    EMBEDDING_STORAGE_MODE = "both"
+
 
 '''
 Purpose: Defines Python classes (Retailer, WeeklyAd, Product) that
@@ -13,6 +26,7 @@ map directly to your database tables (retailers, weekly_ads, products).
 These are SQLAlchemy ORM models. Each class attribute corresponds to a table column. 
 It also defines the relationships between tables (e.g., a WeeklyAd belongs to a Retailer and has many Products).
 Product table includes a field specifically for full-text search (TSVECTOR).
+The products table is range-partitioned by ad_week, one partition per week (see services/product_partitions.py).
 '''
 
 
@@ -65,9 +79,17 @@ class Product(Base):
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
     fts_vector = Column(TSVECTOR) # For full-text search
     embedding = Column(Vector(768), nullable=True)
+    embedding_compact = Column(Vector(COMPACT_EMBEDDING_DIM), nullable=True) # Truncated + re-normalised copy of embedding
     retailer_id = Column(BigInteger, ForeignKey("retailers.id", ondelete="CASCADE"), nullable=False)
+    canonical_product_id = Column(BigInteger, ForeignKey("canonical_products.id", ondelete="SET NULL"), nullable=True) # Same item across weeks/retailers
+    # Monday of the weekly ad's valid_from week; partition key (see product_partitions), so part of the primary key
+    # (id, ad_week): updates by id must also match ad_week to touch one partition
+    ad_week = Column(Date, primary_key=True, nullable=False)
     is_frontpage = Column(Boolean, default=False)
     emoji = Column(String(10), nullable=True)
+    unit_price = Column(Numeric(12, 4), nullable=True) # price normalised to unit_price_basis, computed at load
+    unit_price_basis = Column(String(20), nullable=True) # "lb", "gal", "each" or the package unit
+    discount_pct = Column(Numeric(5, 2), nullable=True) # (original_price - price) / original_price * 100
     retailer = relationship("Retailer")
 
     weekly_ad = relationship("WeeklyAd", back_populates="products")
@@ -77,4 +99,132 @@ class Product(Base):
         Index('idx_products_name', 'name'),
         Index('idx_products_category', 'category'),
         Index('idx_products_fts', 'fts_vector', postgresql_using='gin'),
-    ) 
\ No newline at end of file
+        # Sort indexes lead with the partition key, so each week's top N is an index-ordered scan
+        Index('idx_products_week_price', 'ad_week', 'price'),
+        Index('idx_products_week_unit_price', 'ad_week', 'unit_price_basis', 'unit_price'),
+        Index('idx_products_week_discount_pct', 'ad_week', text('discount_pct DESC NULLS LAST')),
+        Index('idx_products_uncanonical', 'id', postgresql_where=text('canonical_product_id IS NULL')),
+        {'postgresql_partition_by': 'RANGE (ad_week)'},
+    ) 
+
+
+class CanonicalProduct(Base):
+    """One real-world item; weekly product rows from every retailer and week are linked to it (see canonical_products service)."""
+    __tablename__ = "canonical_products"
+
+    id = Column(BigInteger, primary_key=True, server_default=text("nextval('canonical_products_id_seq'::regclass)"))
+    normalised_name = Column(String(255), nullable=False, unique=True)
+    display_name = Column(String(255), nullable=False)
+    category = Column(String(100))
+    embedding = Column(Vector(COMPACT_EMBEDDING_DIM), nullable=True) # Compact embedding of the first product seen
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+
+    prices = relationship("ProductPrice", back_populates="canonical_product")
+
+    __table_args__ = (
+        Index('idx_canonical_products_embedding', 'embedding', postgresql_using='hnsw', postgresql_ops={'embedding': 'vector_cosine_ops'}),
+    )
+
+
+class ProductPrice(Base):
+    """Compact price series: one row per weekly product row of a canonical product. Survives product archival."""
+    __tablename__ = "product_prices"
+
+    id = Column(BigInteger, primary_key=True, server_default=text("nextval('product_prices_id_seq'::regclass)"))
+    canonical_product_id = Column(BigInteger, ForeignKey("canonical_products.id", ondelete="CASCADE"), nullable=False)
+    product_id = Column(BigInteger, nullable=False, unique=True) # No FK: products rows are archived/dropped, the series stays
+    retailer_id = Column(BigInteger, ForeignKey("retailers.id", ondelete="CASCADE"), nullable=False)
+    weekly_ad_id = Column(BigInteger, ForeignKey("weekly_ads.id", ondelete="CASCADE"), nullable=False)
+    valid_from = Column(Date, nullable=False)
+    valid_to = Column(Date, nullable=False)
+    name = Column(String(255), nullable=False)
+    price = Column(Numeric(10, 2), nullable=False)
+    original_price = Column(Numeric(10, 2), nullable=True)
+    unit = Column(String(50))
+    unit_price = Column(Numeric(12, 4), nullable=True)
+    unit_price_basis = Column(String(20), nullable=True)
+
+    canonical_product = relationship("CanonicalProduct", back_populates="prices")
+
+    __table_args__ = (
+        Index('idx_product_prices_canonical_valid_from', 'canonical_product_id', 'valid_from'),
+    )
+
+
+class Job(Base):
+    """Durable background job, consumed by worker processes with FOR UPDATE SKIP LOCKED (see services/job_queue.py)."""
+    __tablename__ = "jobs"
+
+    id = Column(BigInteger, primary_key=True, server_default=text("nextval('jobs_id_seq'::regclass)"))
+    kind = Column(String(50), nullable=False) # Handler name, e.g. "pdf_extraction"
+    key = Column(String(255), nullable=False) # Work item, e.g. the PDF filename; one active job per (kind, key)
+    status = Column(String(20), nullable=False, server_default="queued")
+    payload = Column(JSONB, nullable=False, server_default=text("'{}'::jsonb"))
+    result = Column(JSONB, nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, server_default="0")
+    max_attempts = Column(Integer, nullable=False, server_default="3")
+    run_after = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+    locked_by = Column(String(100), nullable=True)
+    locked_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index('idx_jobs_queued', 'run_after', 'id', postgresql_where=text("status = 'queued'")),
+        Index('idx_jobs_active_key', 'kind', 'key', unique=True, postgresql_where=text("status IN ('queued', 'running')")),
+        Index('idx_jobs_kind_created_at', 'kind', 'created_at'),
+    )
+
+
+class WorkerMetrics(Base):
+    """Latest metrics snapshot of a worker process, rendered by the web process's /metrics (see services/worker_metrics.py)."""
+    __tablename__ = "worker_metrics"
+
+    worker_id = Column(String(100), primary_key=True)
+    snapshot = Column(JSONB, nullable=False)
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+
+
+class StageFile(Base):
+    """Ingestion stage input or output file, shared by all workers (see services/stage_files.py)."""
+    __tablename__ = "stage_files"
+
+    name = Column(String(255), primary_key=True) # "<directory>/<filename>", e.g. "uploads/ad.pdf"
+    content = Column(LargeBinary, nullable=False)
+    modified_at = Column(TIMESTAMP(timezone=True), nullable=False) # Modification time of the source file
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+
+
+class ExtractionCacheEntry(Base):
+    """Cached PDF extraction shared by all workers (see services/extraction_cache.py)."""
+    __tablename__ = "extraction_cache"
+
+    content_key = Column(String(100), primary_key=True) # PDF SHA-256, or "<sha256>-p1-10" for a page chunk
+    prompt_version = Column(String(16), primary_key=True)
+    source_filename = Column(String(255))
+    usage = Column(JSONB, nullable=False) # Token usage of the original Gemini call
+    data = Column(JSONB, nullable=False) # Validated ExtractedPDFData
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+
+
+class GeminiUpload(Base):
+    """File uploaded to the Gemini Files API, reusable by any worker until it expires (see services/gemini_upload_registry.py)."""
+    __tablename__ = "gemini_uploads"
+
+    upload_key = Column(String(100), primary_key=True) # PDF SHA-256, or "<sha256>-p1-10" for a page chunk
+    name = Column(String(255), nullable=False) # Remote file name, e.g. "files/abc123"
+    uri = Column(Text)
+    display_name = Column(String(255))
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=False)
+
+
+class GenTermsCacheEntry(Base):
+    """Generated gen_terms and emoji of a recurring product, shared by all workers (see services/gen_terms_cache.py)."""
+    __tablename__ = "gen_terms_cache"
+
+    fingerprint = Column(String(40), primary_key=True) # SHA-1 of the normalised name, category and promotion details
+    prompt_version = Column(String(16), primary_key=True)
+    gen_terms = Column(Text, nullable=False)
+    emoji = Column(Text)
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
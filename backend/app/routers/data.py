@@ -1,20 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from typing import Dict, Any, List, Optional
 from pydantic import BaseModel
+from datetime import date
 
 from .. import models
-from ..database import get_db 
-from ..services import json_to_db_service
-from ..services import json_enhancement_service
-from ..services import batch_embedding_service
+from ..database import get_db, get_read_db
+from ..services import job_queue
+from ..services.ingestion_pipeline import ENHANCE_JOB, LOAD_JOB, EMBED_JOB, ARCHIVE_JOB, LINK_JOB, BACKFILL_PRICING_JOB
+from ..services import product_partitions
 from ..services import similarity_query
 from ..services.similarity_query import DEFAULT_SEARCH_LIMIT, DEFAULT_SIMILARITY_THRESHOLD
 from ..schemas.data_schemas import ProductWithDetails
 
+logger = logging.getLogger(__name__)
+
 '''
 Defines API endpoints for retrieving data (Retailers, Weekly Ads, Products),
 Creation/Update operations via PDF upload happen through a different process.
+Heavy batch work (enhancement, loading, embedding) is queued as jobs for the worker processes (see app/worker.py).
 Uses FastAPI's APIRouter to group these data-related routes.
 Handles database operations using SQLAlchemy sessions.
 Validates and formats data using Pydantic schemas.
@@ -27,42 +32,121 @@ router = APIRouter(
 
 # Keeping get retailers/weekly ads here for now. Products endpoints moved to products.py + product_service.py
 @router.get("/retailers/")
-def list_retailers(db: Session = Depends(get_db)):
-    print("Listing retailers")
+def list_retailers(db: Session = Depends(get_read_db)):
+    logger.debug("Listing retailers")
     return db.query(models.Retailer).all()
 
 @router.get("/weekly_ads/")
-async def list_weekly_ads(db: Session = Depends(get_db)):
-    print("Listing weekly ads")
+async def list_weekly_ads(db: Session = Depends(get_read_db)):
+    logger.debug("Listing weekly ads")
     return db.query(models.WeeklyAd).all()
 
-@router.post("/json_to_db/")
+@router.post("/json_to_db/", status_code=202)
 async def upload_jsons_to_db(db: Session = Depends(get_db)):
-    print("uploading JSONs to DB")
-    return json_to_db_service.process_json_extractions(db)
+    """Queues a job that loads every enhanced JSON file into the DB. Poll /jobs/{job_id} for its status."""
+    logger.info("Queuing JSON to DB load job")
+    job = job_queue.enqueue(db, LOAD_JOB, "all")
+    return {"message": "JSON to DB load job accepted.", "job": job}
+
+@router.post("/backfill_pricing/", status_code=202)
+async def backfill_pricing(db: Session = Depends(get_db)):
+    """
+    Queues a job that computes unit price and discount columns for products loaded before they were set at
+    ingestion. Poll /jobs/{job_id} for the number of rows updated.
+    """
+    logger.info("Queuing product pricing backfill job")
+    job = job_queue.enqueue(db, BACKFILL_PRICING_JOB, "all")
+    return {"message": "Pricing backfill job accepted.", "job": job}
+
+@router.post("/archive_ads/", status_code=202)
+async def archive_ads_endpoint(
+    limit: int = Query(None, ge=1, description="Max weekly ads to archive in this run."),
+    db: Session = Depends(get_db)
+):
+    """
+    Queues a job that moves 'archived' weekly ads' products to compressed cold-storage files and removes them
+    from Postgres. Poll /jobs/{job_id} for its result; it fails at once when ARCHIVE_DIR is not set up.
+    """
+    logger.info("Queuing weekly ad archive job")
+    job = job_queue.enqueue(db, ARCHIVE_JOB, "all", {"limit": limit} if limit else None)
+    return {"message": "Weekly ad archive job accepted.", "job": job}
+
+@router.get("/partitions/")
+def list_product_partitions():
+    """Lists the products table's weekly partitions."""
+    return product_partitions.list_partitions()
+
+@router.post("/partitions/maintain/")
+def maintain_product_partitions(
+    retention_weeks: int = Query(product_partitions.PARTITION_RETENTION_WEEKS, ge=1, description="Weeks of products to keep attached."),
+    drop: bool = Query(False, description="Drop detached weeks instead of keeping them as standalone tables.")
+):
+    """
+    Creates upcoming week partitions and detaches (optionally drops) weeks past retention whose ads are all exported
+    to cold storage. Run weekly, e.g. from cron, after /data/archive_ads/.
+    """
+    logger.info(f"Maintaining product partitions: retention {retention_weeks} weeks, drop={drop}")
+    try:
+        return product_partitions.maintain_partitions(retention_weeks=retention_weeks, drop=drop)
+    except Exception as e:
+        logger.error(f"Error maintaining product partitions: {e}")
+        raise HTTPException(status_code=500, detail=f"An error occurred maintaining partitions: {str(e)}")
 
-@router.post("/enhance_json/")
-async def enhance_json_files_endpoint(): # ensure this is async def
-    print("Async Enhancing JSON files via API endpoint...")
+@router.post("/partitions/attach/{week}")
+def attach_product_partition(week: date):
+    """Re-attaches a detached week of products (any date in the week)."""
+    try:
+        return {"attached": product_partitions.attach_week_partition(week)}
+    except Exception as e:
+        logger.error(f"Error attaching partition for week {week}: {e}")
+        raise HTTPException(status_code=500, detail=f"An error occurred attaching the partition: {str(e)}")
+
+@router.post("/enhance_json/", status_code=202)
+async def enhance_json_files_endpoint(db: Session = Depends(get_db)):
+    """
+    Queues JSON enhancement as a background job and returns its job record immediately
+    (the active job if one is already queued or running). Poll /data/enhance_json/{job_id} for progress.
+    """
+    logger.info("Queuing JSON enhancement job via API endpoint...")
     try:
-        await json_enhancement_service.enhance_all_json_files() # await the async function
-        return {"message": "JSON enhancement process started successfully and has completed."} # Or reflect ongoing status
+        job = job_queue.enqueue(db, ENHANCE_JOB, "all")
+        return {"message": "JSON enhancement job accepted.", "job": job}
     except Exception as e:
-        print(f"Error during JSON enhancement process: {e}")
-        raise HTTPException(status_code=500, detail=f"An error occurred during JSON enhancement: {str(e)}")
-   
+        logger.error(f"Error queuing JSON enhancement job: {e}")
+        raise HTTPException(status_code=500, detail=f"An error occurred starting JSON enhancement: {str(e)}")
 
-@router.post("/embed_products", response_model=Dict[str, Any]) # response_model is used to specify the expected return type of the endpoint (the message) (not required)
+@router.get("/enhance_json/{job_id}")
+async def enhance_json_job_status(job_id: int, db: Session = Depends(get_db)):
+    """Returns the enhancement job record, including per-file progress counts in 'result'."""
+    job = job_queue.get(db, job_id)
+    if not job or job["kind"] != ENHANCE_JOB:
+        raise HTTPException(status_code=404, detail=f"Enhancement job '{job_id}' not found.")
+    return job
+
+
+@router.post("/embed_products", response_model=Dict[str, Any], status_code=202) # response_model is used to specify the expected return type of the endpoint (the message) (not required)
 async def trigger_batch_embedding( db: Session = Depends(get_db)):
     """
-    Endpoint to trigger the batch embedding process for products.
+    Endpoint to queue the batch embedding process for products (followed by canonical product linking).
+    Poll /jobs/{job_id} for its result.
     """
-    print("Embedding products began...")
-    await batch_embedding_service.batch_embed_products(db)
+    logger.info("Queuing product embedding job")
+    job = job_queue.enqueue(db, EMBED_JOB, "all")
     return {
-        "message": "Batch product embedding process finished."
+        "message": "Batch product embedding job accepted.",
+        "job": job
     }
 
+@router.post("/canonical_products/link/", status_code=202)
+async def link_canonical_products_endpoint(db: Session = Depends(get_db)):
+    """
+    Queues a job that links embedded products with no canonical product yet (e.g. rows loaded before linking
+    existed) and records their prices. Poll /jobs/{job_id} for the link counts.
+    """
+    logger.info("Queuing canonical product linking job")
+    job = job_queue.enqueue(db, LINK_JOB, "all")
+    return {"message": "Canonical product linking job accepted.", "job": job}
+
 # Pydantic model for similarity query request body
 class SimilarityQueryRequest(BaseModel):
     query: str
@@ -80,19 +164,15 @@ class SimilarityQueryResponse(BaseModel):
     products: List[ProductWithDetails]
 
 @router.post("/test_similarity_query", response_model=SimilarityQueryResponse)
-async def test_similarity_query(
-    request: SimilarityQueryRequest,
-    db: Session = Depends(get_db)
-):
+async def test_similarity_query(request: SimilarityQueryRequest):
     """
     Test endpoint for similarity-based product search using vector embeddings.
     Returns the top matching products based on semantic similarity.
     """
-    print(f"Similarity query request: {request.query}")
+    logger.info("Similarity query request: %s", request.query)
     
     try:
         results_dict = await similarity_query.similarity_search_products(
-            db=db,
             query=request.query,
             chat_history=request.chat_history,
             ad_period=request.ad_period,
@@ -102,11 +182,11 @@ async def test_similarity_query(
         
         response = SimilarityQueryResponse(**results_dict)
         
-        print(f"Similarity query completed. Found {results_dict['results_count']} results.")
+        logger.info("Similarity query completed. Found %s results.", results_dict['results_count'])
         return response
         
     except Exception as e:
-        print(f"Error during similarity query: {e}")
+        logger.error("Error during similarity query: %s", e)
         raise HTTPException(
             status_code=500, 
             detail=f"An error occurred during similarity search: {str(e)}"
@@ -0,0 +1,41 @@
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import Optional
+
+from ..database import get_db
+from ..services import job_queue
+
+logger = logging.getLogger(__name__)
+
+'''
+Read-only view of the background job queue (the Postgres jobs table run by worker processes).
+
+GET /jobs/: Most recent jobs, optionally filtered by kind and status, with counts per kind and status.
+GET /jobs/{job_id}: One job record (status, attempts, progress or result, last error).
+'''
+
+router = APIRouter(
+    prefix="/jobs",
+    tags=["Background Jobs"]
+)
+
+@router.get("/")
+async def list_jobs(
+    kind: Optional[str] = Query(None, description="Only jobs of this kind, e.g. pdf_extraction."),
+    status: Optional[str] = Query(None, description="Only jobs with this status: queued, running, succeeded or failed."),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    kinds = [kind] if kind else None
+    return {
+        "counts": job_queue.counts(db, kinds),
+        "jobs": job_queue.list_jobs(db, kinds, status=status, limit=limit),
+    }
+
+@router.get("/{job_id}")
+async def get_job(job_id: int, db: Session = Depends(get_db)):
+    job = job_queue.get(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found.")
+    return job
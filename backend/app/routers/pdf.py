@@ -1,20 +1,27 @@
+import logging
 import os
 import uuid
 import asyncio
 import shutil
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from fastapi.responses import JSONResponse
 from pathlib import Path
+from sqlalchemy.orm import Session
 
 # Import necessary components from parent directories or app modules
-from ..services.pdf_processor import GroceryAdProcessor
+from ..database import get_db
+from ..services import job_queue
+from ..services.ingestion_pipeline import EXTRACT_JOB, enqueue_extraction
+
+logger = logging.getLogger(__name__)
 
 '''
 Defines API endpoints specifically for handling PDF files.
 Manages temporary file cleanup and provides a basic status check.
 
-POST /pdf/process-uploads/: Queues background processing for all PDF files found in the uploads directory.
-GET /pdf/processing-status/: Provides a basic status check of PDF processing based on file counts.
+POST /pdf/process-uploads/: Queues an extraction job for every PDF file found in the uploads directory; worker processes run them.
+GET /pdf/processing-status/: Counts PDFs by the status of their latest extraction job.
+GET /pdf/jobs/: Lists the PDF extraction job records.
 '''
 
 # Define paths relative to project root using utils.find_project_root()
@@ -27,27 +34,13 @@ router = APIRouter(
     tags=["PDF Processing"] # Tag for Swagger UI
 )
 
-# --- Helper function for background task ---
-async def run_processor_for_file(pdf_path: Path):
-    """Wraps the processor call for a single file."""
-    # Create a new processor instance for each task
-    processor = GroceryAdProcessor()
-    if not processor.model:
-        print(f"Skipping {pdf_path.name} due to processor initialization failure.")
-        return
-
-    # print(f"Background task started for: {pdf_path.name}")
-    result_path = await processor.process_pdf_to_json(pdf_path)
-    if result_path:
-        print(f"Background task SUCCESS for {pdf_path.name}. Output: {result_path}")
-    else:
-        print(f"Background task FAILED for {pdf_path.name}")
-
 # --- API Endpoint ---
 @router.post("/process-uploads/", status_code=202)
-async def process_all_uploaded_pdfs(background_tasks: BackgroundTasks):
+def process_all_uploaded_pdfs(db: Session = Depends(get_db)):
     """
-    Scans the UPLOADS_DIR for PDF files and queues background tasks to process each one using Gemini API.
+    Scans the UPLOADS_DIR for PDF files and queues an extraction job for each one (processed with the Gemini API).
+    Each PDF is stored in Postgres for the workers first, so this is a plain def run in FastAPI's threadpool.
+    Worker processes run the jobs; their concurrency and the pdf_extraction model call limit bound how many PDFs are processed at once.
     Outputs results as JSON files in the EXTRACTIONS_DIR.
     Returns 202 Accepted immediately, processing happens in the background.
     """
@@ -58,41 +51,41 @@ async def process_all_uploaded_pdfs(background_tasks: BackgroundTasks):
             status_code=404,
             detail=f"No PDF files found in the upload directory: {UPLOADS_DIR}"
         )
-    print(f"Found {len(pdf_files)} PDF files in {UPLOADS_DIR}. Queuing for processing...")
+    logger.info(f"Found {len(pdf_files)} PDF files in {UPLOADS_DIR}. Queuing for processing...")
 
-    # Add each file processing task to the background
-    for pdf_path in pdf_files:
-        background_tasks.add_task(run_processor_for_file, pdf_path)
+    # Add each file to the job queue (already queued/running files return their existing job)
+    jobs = [enqueue_extraction(db, pdf_path) for pdf_path in pdf_files]
 
     return { # a response to the client
         "message": f"Accepted: Queued {len(pdf_files)} PDF files for processing.",
         "upload_directory": str(UPLOADS_DIR),
         "output_directory": str(EXTRACTIONS_DIR),
-        "files_queued": [f.name for f in pdf_files]
+        "files_queued": [f.name for f in pdf_files],
+        "job_ids": [job["id"] for job in jobs]
     }
 
 # --- Endpoint to check status --
 @router.get("/processing-status/")
-async def check_processing_status():
-    """Basic check for number of extracted JSON files vs uploaded PDFs."""
+async def check_processing_status(db: Session = Depends(get_db)):
+    """
+    Processing status per PDF, from the extraction job records (extractions are written on worker dynos, so the
+    files on this process's disk say nothing about them). Each PDF counts once, by its latest job.
+    """
     try:
-        pdf_files = list(UPLOADS_DIR.glob("*.pdf"))
-        json_files = list(EXTRACTIONS_DIR.glob("*.json"))
-        # Basic check: compare stems (filenames without extension)
-        pdf_stems = {p.stem for p in pdf_files}
-        json_stems = {j.stem for j in json_files}
-
-        processed_count = len(pdf_stems.intersection(json_stems))
-        pending_count = len(pdf_stems - json_stems)
-        total_pdfs = len(pdf_stems)
-
+        by_status = job_queue.key_status_counts(db, EXTRACT_JOB)
         return {
-            "total_pdfs_found": total_pdfs,
-            "json_outputs_found": len(json_stems),
-            "successfully_processed": processed_count,
-            "pending_or_not_processed": pending_count,
-            "upload_directory": str(UPLOADS_DIR),
-            "output_directory": str(EXTRACTIONS_DIR),
+            "total_pdfs_submitted": sum(by_status.values()),
+            "successfully_processed": by_status.get(job_queue.SUCCEEDED, 0),
+            "pending": by_status.get(job_queue.QUEUED, 0) + by_status.get(job_queue.RUNNING, 0),
+            "failed": by_status.get(job_queue.FAILED, 0),
+            "pdfs_by_status": by_status,
+            "jobs_by_status": job_queue.counts(db, [EXTRACT_JOB]).get(EXTRACT_JOB, {}),
         }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error checking status: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error checking status: {e}")
+
+# --- Endpoint to list job records --
+@router.get("/jobs/")
+async def list_pdf_jobs(db: Session = Depends(get_db)):
+    """Returns the PDF extraction job records (status, attempts, last error, output path), most recent first."""
+    return job_queue.list_jobs(db, [EXTRACT_JOB])
\ No newline at end of file
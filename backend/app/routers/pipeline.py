@@ -0,0 +1,46 @@
+import logging
+from fastapi import APIRouter, HTTPException
+
+from ..services import ingestion_pipeline
+from ..services.pdf_processor import UPLOADS_DIR
+
+logger = logging.getLogger(__name__)
+
+'''
+Defines API endpoints for the end-to-end ingestion pipeline (PDF -> extract -> enhance -> load -> embed).
+
+Every stage runs as a job on the Postgres job queue, executed by worker processes (python -m app.worker).
+
+POST /pipeline/run/: Queues a pipeline run for every PDF in the uploads directory.
+GET /pipeline/status/: Single status view of the pipeline's stage jobs (counts per stage and status, recent jobs with timings and errors).
+'''
+
+router = APIRouter(
+    prefix="/pipeline",
+    tags=["Ingestion Pipeline"]
+)
+
+@router.post("/run/", status_code=202)
+def run_pipeline():
+    """
+    Queues each uploaded PDF's extraction job; each stage queues the ad's next one when it finishes.
+    A plain def, run in FastAPI's threadpool: storing the PDFs for the workers reads and writes whole files.
+    Returns 202 Accepted immediately with the extraction job records.
+    """
+    pdf_files = list(UPLOADS_DIR.glob("*.pdf"))
+    if not pdf_files:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No PDF files found in the upload directory: {UPLOADS_DIR}"
+        )
+    jobs = ingestion_pipeline.submit_uploads()
+    logger.info(f"Queued ingestion pipeline for {len(jobs)} PDF files.")
+    return {
+        "message": f"Accepted: Queued ingestion pipeline for {len(jobs)} PDF files.",
+        "jobs": jobs
+    }
+
+@router.get("/status/")
+def pipeline_status():
+    """Returns job counts per stage and status, plus the most recent stage jobs."""
+    return ingestion_pipeline.status()
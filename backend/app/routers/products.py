@@ -1,14 +1,18 @@
+import logging
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from typing import List
+from datetime import date
 
 # Import necessary components
-from ..database import get_db
-from ..services import product_service
+from ..database import get_read_db
+from ..services import product_service, shopping_list_service, suggest_service, archive_service, canonical_products
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
 # Ensure ProductWithDetails is available
-from ..schemas.data_schemas import ProductWithDetails
+from ..schemas.data_schemas import ProductWithDetails, ProductFacets, ShoppingListRequest, ShoppingListResponse, SuggestResponse, PriceHistoryResponse, PriceTrendResponse
+
+logger = logging.getLogger(__name__)
 
 
 router = APIRouter(
@@ -22,20 +26,25 @@ async def search_products_endpoint(
     q: str = Query(..., min_length=1, description="Search term for products."),
     ad_period: str = Query(
         "current", description="Ad period (e.g., 'current', 'previous')."),
-    db: Session = Depends(get_db),
     limit: int = Query(200, ge=1, le=200, description="Max results."),
-    offset: int = Query(0, ge=0, description="Offset for pagination.")
+    offset: int = Query(0, ge=0, description="Offset for pagination."),
+    sort: str = Query(
+        None, description="Optional sort: 'discount' (largest first), 'unit_price' or 'price' (lowest first). "
+                          "Unit prices are only comparable within one basis, so 'unit_price' groups results by "
+                          "unit_price_basis (e.g. 'each', 'gal', 'lb') and sorts each group cheapest first."),
+    unit_basis: str = Query(
+        None, description="Only products priced per this unit_price_basis, e.g. 'lb'. Use with sort=unit_price "
+                          "for one comparable ranking.")
 ):
     """
     Endpoint to search for products using Full-Text Search.
     Delegates the search logic to product_service.search_products.
     """
-    print(
-        f"Searching products with query: '{q}', ad_period: '{ad_period}', limit: {limit}, offset: {offset}")
+    logger.info("Searching products with query: '%s', ad_period: '%s', limit: %s, offset: %s", q, ad_period, limit, offset)
     try:
         # Call the service function to perform the search
         search_results = await product_service.search_products(
-            db=db, q=q, ad_period=ad_period, limit=limit, offset=offset
+            q=q, ad_period=ad_period, limit=limit, offset=offset, sort=sort, unit_basis=unit_basis
         )
         return search_results
     except HTTPException as http_exc:
@@ -43,17 +52,39 @@ async def search_products_endpoint(
         raise http_exc
     except Exception as e:
         # Catch any other unexpected errors
-        print(f"Unexpected error in search_products_endpoint: {e}")
+        logger.error("Unexpected error in search_products_endpoint: %s", e)
         raise HTTPException(
             status_code=500, detail="Internal server error during product search.")
 
 
+@router.get("/suggest/", response_model=SuggestResponse)
+async def suggest_products_endpoint(
+    q: str = Query(..., min_length=1, description="Prefix typed in the search box."),
+    ad_period: str = Query(
+        "current", description="Ad period (e.g., 'current', 'previous')."),
+    limit: int = Query(10, ge=1, le=suggest_service.SUGGEST_MAX_LIMIT, description="Max suggestions."),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Typeahead endpoint: product names, categories and search terms starting with the prefix,
+    served from an in-memory index (pg_trgm fallback for misspellings).
+    """
+    try:
+        return await suggest_service.suggest(db=db, q=q, ad_period=ad_period, limit=limit)
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception as e:
+        logger.error("Unexpected error in suggest_products_endpoint: %s", e)
+        raise HTTPException(
+            status_code=500, detail="Internal server error while building suggestions.")
+
+
 @router.get("/retailer/{retailer_id}")
 async def get_products_by_retailer_manual_json(
     retailer_id: int,
     ad_period: str = Query(
         "current", description="Ad period (e.g., 'current', 'upcoming')."),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     limit: int = Query(200, ge=1, le=500),
     offset: int = Query(0, ge=0)
 ):
@@ -76,8 +107,7 @@ async def get_products_by_retailer_manual_json(
         # Re-raise known HTTP exceptions
         raise http_exc
     except Exception as e:
-        print(
-            f"Error fetching products for retailer {retailer_id}, ad period '{ad_period}': {e}")
+        logger.error("Error fetching products for retailer %s, ad period '%s': %s", retailer_id, ad_period, e)
         raise HTTPException(
             status_code=500, detail="Error fetching products for specified retailer and ad period.")
 
@@ -92,10 +122,17 @@ async def get_filtered_products_endpoint(
     ad_period: str = Query(
         "current", description="Ad period (e.g., 'current', 'upcoming')."),
     is_frontpage_only: bool = Query(False, description="Filter for front page items only. If true, categories are ignored."),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     limit: int = Query(200, ge=1, le=500,
                        description="Maximum number of products to return."),
-    offset: int = Query(0, ge=0, description="Offset for pagination.")
+    offset: int = Query(0, ge=0, description="Offset for pagination."),
+    sort: str = Query(
+        None, description="Optional sort: 'discount' (largest first), 'unit_price' or 'price' (lowest first). "
+                          "Unit prices are only comparable within one basis, so 'unit_price' groups results by "
+                          "unit_price_basis (e.g. 'each', 'gal', 'lb') and sorts each group cheapest first."),
+    unit_basis: str = Query(
+        None, description="Only products priced per this unit_price_basis, e.g. 'lb'. Use with sort=unit_price "
+                          "for one comparable ranking.")
 ):
     """
     Endpoint to get products based on selected store IDs and/or categories.
@@ -112,7 +149,9 @@ async def get_filtered_products_endpoint(
             ad_period=ad_period,
             is_frontpage_only=is_frontpage_only,
             limit=limit,
-            offset=offset
+            offset=offset,
+            sort=sort,
+            unit_basis=unit_basis
         )
         # FastAPI will automatically handle serialization with response_model
         return filtered_products
@@ -122,6 +161,90 @@ async def get_filtered_products_endpoint(
         # Specific error for invalid integer conversion from service layer
         raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
-        print(f"Unexpected error in get_filtered_products_endpoint: {e}")
+        logger.error("Unexpected error in get_filtered_products_endpoint: %s", e)
         raise HTTPException(
             status_code=500, detail="Internal server error while filtering products.")
+
+
+@router.get("/facets/", response_model=ProductFacets)
+async def get_product_facets_endpoint(
+    ad_period: str = Query(
+        "current", description="Ad period (e.g., 'current', 'upcoming')."),
+    store_ids: str = Query(
+        None, description="Optional comma-separated list of store IDs to count within. E.g., '1,2,3'"),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Endpoint returning per-category and per-retailer counts, frontpage counts and price ranges for an ad period,
+    so filter chips can be rendered without fetching products. Cached until the catalog changes.
+    """
+    parsed_store_ids = store_ids.split(',') if store_ids else []
+    try:
+        return await product_service.get_product_facets(db=db, ad_period=ad_period, store_ids=parsed_store_ids)
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception as e:
+        logger.error("Unexpected error in get_product_facets_endpoint: %s", e)
+        raise HTTPException(
+            status_code=500, detail="Internal server error while computing product facets.")
+
+
+@router.post("/shopping_list/", response_model=ShoppingListResponse)
+async def optimise_shopping_list_endpoint(
+    request: ShoppingListRequest,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Endpoint resolving a whole shopping list in one request: the cheapest matching product per item
+    across retailers, and every retailer's single-store basket (best_single_store covers the most items, cheapest first).
+    """
+    try:
+        return await shopping_list_service.optimise_shopping_list(
+            db=db, items=request.items, ad_period=request.ad_period, store_ids=request.store_ids
+        )
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception as e:
+        logger.error("Unexpected error in optimise_shopping_list_endpoint: %s", e)
+        raise HTTPException(
+            status_code=500, detail="Internal server error while optimising the shopping list.")
+
+
+@router.get("/price_history/", response_model=PriceHistoryResponse)
+async def price_history_endpoint(
+    q: str = Query(..., min_length=2, description="Words that must all appear in the product name."),
+    retailer_id: int = Query(None, description="Optional retailer to restrict the history to."),
+    since: date = Query(None, description="Only ads valid from this date on."),
+    limit: int = Query(500, ge=1, le=5000, description="Max price points (most recent kept)."),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Read-only endpoint returning a product's price points over time, from Postgres and the cold archive files.
+    """
+    try:
+        return await archive_service.price_history(db=db, q=q, retailer_id=retailer_id, since=since, limit=limit)
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception as e:
+        logger.error("Unexpected error in price_history_endpoint: %s", e)
+        raise HTTPException(
+            status_code=500, detail="Internal server error while reading price history.")
+
+
+@router.get("/{product_id}/price_trend/", response_model=PriceTrendResponse)
+async def price_trend_endpoint(
+    product_id: int,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Endpoint returning the price series of the product's canonical product across weeks and retailers,
+    with its lowest and average price and whether the current price is the lowest on record.
+    """
+    try:
+        return await canonical_products.get_price_trend(db=db, product_id=product_id)
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception as e:
+        logger.error("Unexpected error in price_trend_endpoint for product %s: %s", product_id, e)
+        raise HTTPException(
+            status_code=500, detail="Internal server error while reading the price trend.")
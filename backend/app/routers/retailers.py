@@ -2,7 +2,7 @@ from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
 from typing import List
 
-from ..database import get_db
+from ..database import get_read_db
 from ..services import retailer_service # Make sure retailer_service.py is created
 from ..schemas.data_schemas import Retailer as RetailerSchema
 
@@ -12,6 +12,6 @@ router = APIRouter(
 )
 
 @router.get("/") # Changed path to "/" as prefix is "/retailers"
-async def read_all_retailers(db: Session = Depends(get_db)):
+async def read_all_retailers(db: Session = Depends(get_read_db)):
     retailers = retailer_service.get_all_retailers(db=db)
     return retailers 
\ No newline at end of file
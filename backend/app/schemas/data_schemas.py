@@ -29,6 +29,9 @@ class ProductWithDetails(Product): # New schema for search results
     weekly_ad_valid_from: date
     weekly_ad_valid_to: date
     weekly_ad_ad_period: str
+    unit_price: float | None = None
+    unit_price_basis: str | None = None
+    discount_pct: float | None = None
 
 # --- WeeklyAd Schemas ---
 class WeeklyAdBase(WeeklyAdBaseSchema): # Inherits from WeeklyAdBaseSchema
@@ -58,4 +61,112 @@ class Retailer(RetailerBase):
     weekly_ads: list[WeeklyAd] = [] # Include related weekly ads when reading
 
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True 
+# --- Facet Schemas ---
+class FacetCount(BaseModel):
+    count: int
+    frontpage_count: int
+    min_price: float | None = None
+    max_price: float | None = None
+
+class CategoryFacet(FacetCount):
+    category: str | None = None
+
+class RetailerFacet(FacetCount):
+    retailer_id: int
+    retailer_name: str
+
+class ProductFacets(BaseModel): # Response of /products/facets
+    ad_period: str
+    catalog_version: str
+    total: FacetCount
+    categories: list[CategoryFacet] = []
+    retailers: list[RetailerFacet] = []
+
+# --- Shopping List Schemas ---
+class ShoppingListRequest(BaseModel):
+    items: list[str]
+    ad_period: str = "current"
+    store_ids: list[int] | None = None # Limit the search to these retailers
+
+class ShoppingListMatch(BaseModel):
+    product_id: int
+    name: str
+    price: float
+    unit: str | None = None
+    unit_price: float | None = None
+    unit_price_basis: str | None = None
+    retailer_id: int
+    retailer_name: str
+    similarity: float | None = None
+
+class ShoppingListItem(BaseModel):
+    item: str
+    cheapest: ShoppingListMatch | None = None # Cheapest matching product across all retailers
+
+class StoreBasket(BaseModel):
+    retailer_id: int
+    retailer_name: str
+    total: float
+    items_found: int
+    missing_items: list[str] = []
+    products: list[ShoppingListMatch] = []
+
+class ShoppingListResponse(BaseModel):
+    ad_period: str
+    items: list[ShoppingListItem]
+    split_total: float # Sum of the cheapest price of every found item, shopping across retailers
+    best_single_store: StoreBasket | None = None
+    stores: list[StoreBasket] = [] # Every retailer's basket, most items found first, then cheapest
+
+# --- Suggest Schemas ---
+class Suggestion(BaseModel):
+    text: str
+    kind: str # "product", "category" or "term"
+    count: int # Number of products in the ad period carrying it
+
+class SuggestResponse(BaseModel):
+    query: str
+    source: str # "index" (in-memory prefix index) or "trigram" (pg_trgm fallback)
+    suggestions: list[Suggestion] = []
+
+# --- Price History Schemas ---
+class PriceHistoryPoint(BaseModel):
+    valid_from: date
+    valid_to: date
+    retailer_id: int
+    retailer_name: str
+    name: str
+    price: float
+    original_price: float | None = None
+    unit: str | None = None
+    unit_price: float | None = None
+    unit_price_basis: str | None = None
+    source: str # "database" or "archive"
+
+class PriceHistoryResponse(BaseModel):
+    query: str
+    points: list[PriceHistoryPoint] = []
+
+# --- Price Trend Schemas ---
+class PricePoint(BaseModel):
+    product_id: int
+    valid_from: date
+    valid_to: date
+    retailer_id: int
+    retailer_name: str
+    name: str
+    price: float
+    original_price: float | None = None
+    unit: str | None = None
+    unit_price: float | None = None
+    unit_price_basis: str | None = None
+
+class PriceTrendResponse(BaseModel):
+    canonical_product_id: int
+    canonical_name: str
+    points: list[PricePoint] = []
+    lowest_price: float | None = None
+    average_price: float | None = None
+    current_price: float | None = None
+    is_lowest_ever: bool = False
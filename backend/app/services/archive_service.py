@@ -0,0 +1,341 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import select, delete
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..schemas.data_schemas import PriceHistoryPoint, PriceHistoryResponse
+from .catalog_cache import catalog_cache
+from .product_partitions import ad_week, attach_week_partition, is_week_attached
+
+try:
+    import pyarrow as pa # Optional: only needed for ARCHIVE_FORMAT=parquet
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+'''
+Cold storage for archived weekly ads.
+- archive_ads streams the products of ads with ad_period 'archived' through a server-side cursor into one
+  compressed file per retailer-week (gzip NDJSON, or Parquet when ARCHIVE_FORMAT=parquet and pyarrow is
+  installed), deletes them from products and marks the ad 'cold'. Embeddings and tsvectors are not exported,
+  so the hot tables and their vector/GIN indexes only hold live weeks.
+- The archive file becomes the only copy of the rows, so archiving requires ARCHIVE_DIR to be set explicitly and to exist:
+  a durable volume shared by every process that archives or serves price history (never a dyno's ephemeral
+  disk). A week partition that maintain_partitions detached is re-attached first, so its ads are exported like any
+  other. Ads whose export came out empty are skipped and left as they are.
+- manifest.json lists every file with its retailer, ad dates and row count; price_history reads it to open
+  only the relevant files and combines them with the products still in Postgres.
+'''
+
+SERVICE_FILE_DIR = Path(__file__).resolve().parent
+ARCHIVE_DIR: Optional[Path] = Path(os.environ["ARCHIVE_DIR"]) if os.getenv("ARCHIVE_DIR") else None
+ARCHIVE_FORMAT = os.getenv("ARCHIVE_FORMAT", "ndjson").lower()
+ARCHIVE_STREAM_BATCH = 1000 # Rows fetched per round trip from the server-side cursor
+COLD_AD_PERIOD = "cold"
+
+if ARCHIVE_FORMAT == "parquet" and pa is None:
+    logger.warning("ARCHIVE_FORMAT is 'parquet' but pyarrow is not installed. Archiving to gzip NDJSON.")
+    ARCHIVE_FORMAT = "ndjson"
+
+# Exported columns: everything needed to answer price questions later, no vectors
+ARCHIVE_COLUMNS = [
+    "id", "weekly_ad_id", "retailer_id", "name", "price", "original_price", "unit", "description", "category",
+    "promotion_details", "promotion_from", "promotion_to", "gen_terms", "is_frontpage", "emoji",
+    "unit_price", "unit_price_basis", "discount_pct",
+]
+HISTORY_COLUMNS = ["name", "price", "original_price", "unit", "unit_price", "unit_price_basis", "category"]
+
+_SLUG = re.compile(r"[^a-z0-9]+")
+_manifest_lock = threading.Lock()
+
+
+class ArchiveUnavailable(RuntimeError):
+    """ARCHIVE_DIR is not configured or not mounted, so archiving would lose data."""
+
+
+def _require_archive_dir() -> Path:
+    if ARCHIVE_DIR is None:
+        raise ArchiveUnavailable(
+            "ARCHIVE_DIR is not set. Point it at a durable volume shared by the API and workers before archiving.")
+    if not ARCHIVE_DIR.is_dir():
+        raise ArchiveUnavailable(f"ARCHIVE_DIR {ARCHIVE_DIR} does not exist. Is the archive volume mounted?")
+    return ARCHIVE_DIR
+
+
+def _slug(value: str) -> str:
+    return _SLUG.sub("-", value.lower()).strip("-") or "retailer"
+
+
+def _json_value(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _manifest_path() -> Path:
+    return ARCHIVE_DIR / "manifest.json"
+
+
+def load_manifest() -> List[Dict[str, Any]]:
+    if ARCHIVE_DIR is None:
+        return []
+    path = _manifest_path()
+    if not path.exists():
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f).get("files", [])
+
+
+def _save_manifest(files: List[Dict[str, Any]]):
+    tmp_path = _manifest_path().with_suffix(".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"files": files}, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, _manifest_path())
+
+
+def _fsync(path: Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _stream_products(db: Session, weekly_ad: models.WeeklyAd) -> Iterator[List[Dict[str, Any]]]:
+    """Yields the ad's products in batches from a server-side cursor, so memory stays flat for any ad size."""
+    columns = [getattr(models.Product, name) for name in ARCHIVE_COLUMNS]
+    result = db.execute(
+        select(*columns)
+        .where(models.Product.weekly_ad_id == weekly_ad.id)
+        .order_by(models.Product.id)
+        .execution_options(stream_results=True, yield_per=ARCHIVE_STREAM_BATCH)
+    )
+    for batch in result.partitions():
+        yield [{name: _json_value(value) for name, value in zip(ARCHIVE_COLUMNS, row)} for row in batch]
+
+
+def _write_ndjson(path: Path, batches: Iterator[List[Dict[str, Any]]]) -> int:
+    rows = 0
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        for batch in batches:
+            for row in batch:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            rows += len(batch)
+    return rows
+
+
+def _write_parquet(path: Path, batches: Iterator[List[Dict[str, Any]]]) -> int:
+    rows = 0
+    writer = None
+    try:
+        for batch in batches:
+            table = pa.Table.from_pylist(batch)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression="zstd")
+            writer.write_table(table.cast(writer.schema))
+            rows += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def archive_weekly_ad(db: Session, weekly_ad: models.WeeklyAd) -> Optional[Dict[str, Any]]:
+    """
+    Exports one archived ad's products to its cold file, then deletes them and marks the ad cold.
+    Returns None, changing nothing, when the export has no rows (e.g. the rows are not readable).
+    """
+    retailer_name = weekly_ad.retailer.name if weekly_ad.retailer else str(weekly_ad.retailer_id)
+    suffix = ".parquet" if ARCHIVE_FORMAT == "parquet" else ".ndjson.gz"
+    relative = Path(_slug(retailer_name)) / f"{weekly_ad.valid_from.isoformat()}_{weekly_ad.id}{suffix}"
+    path = ARCHIVE_DIR / relative
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    writer = _write_parquet if ARCHIVE_FORMAT == "parquet" else _write_ndjson
+    rows = writer(tmp_path, _stream_products(db, weekly_ad))
+    if rows == 0:
+        tmp_path.unlink(missing_ok=True)
+        db.rollback()
+        return None
+    _fsync(tmp_path) # Durable before the rows it replaces are deleted
+    os.replace(tmp_path, path)
+    _fsync(path.parent)
+
+    # The file is complete before the rows go; a failure here leaves the ad 'archived' and it is exported again
+    db.execute(delete(models.Product).where(
+        models.Product.weekly_ad_id == weekly_ad.id,
+        models.Product.ad_week == ad_week(weekly_ad.valid_from) # Prunes the delete to the ad's partition
+    ))
+    weekly_ad.ad_period = COLD_AD_PERIOD
+    db.commit()
+    return {
+        "file": relative.as_posix(),
+        "weekly_ad_id": weekly_ad.id,
+        "retailer_id": weekly_ad.retailer_id,
+        "retailer_name": retailer_name,
+        "valid_from": weekly_ad.valid_from.isoformat(),
+        "valid_to": weekly_ad.valid_to.isoformat(),
+        "rows": rows,
+        "archived_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def archive_ads(db: Session, limit: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Moves every 'archived' weekly ad (up to `limit`) to cold storage. Returns counts and the files written.
+    Raises ArchiveUnavailable when ARCHIVE_DIR is not configured or not mounted.
+    """
+    _require_archive_dir()
+    query = (
+        db.query(models.WeeklyAd)
+        .filter(models.WeeklyAd.ad_period == 'archived')
+        .order_by(models.WeeklyAd.valid_from, models.WeeklyAd.id)
+    )
+    if limit:
+        query = query.limit(limit)
+    ads = query.all()
+
+    written: List[Dict[str, Any]] = []
+    failed = skipped = 0
+    # Rows in a detached partition are not readable through products: attach those weeks again before exporting
+    detached = sorted({week for week in (ad_week(ad.valid_from) for ad in ads) if not is_week_attached(db, week)})
+    unreadable = set()
+    if detached:
+        db.commit() # End the catalog read before the partition DDL
+        for week in detached:
+            try:
+                attach_week_partition(week)
+            except Exception as e:
+                unreadable.add(week)
+                logger.error(f"Cannot export the archived ads of week {week}: re-attaching its partition failed: {e}")
+    with _manifest_lock:
+        manifest = load_manifest()
+        for weekly_ad in ads:
+            if ad_week(weekly_ad.valid_from) in unreadable:
+                failed += 1
+                continue
+            try:
+                entry = archive_weekly_ad(db, weekly_ad)
+            except Exception as e:
+                db.rollback()
+                failed += 1
+                logger.error(f"Failed to archive weekly ad {weekly_ad.id}: {e}")
+                continue
+            if entry is None:
+                skipped += 1
+                logger.warning(f"Skipping weekly ad {weekly_ad.id}: no products to export; left as '{weekly_ad.ad_period}'.")
+                continue
+            manifest = [f for f in manifest if f["weekly_ad_id"] != entry["weekly_ad_id"]] + [entry]
+            # Saved after every ad, so the manifest never misses a file whose rows are already deleted
+            _save_manifest(manifest)
+            written.append(entry)
+    if written:
+        catalog_cache.invalidate()
+    logger.info(f"Archived {len(written)} weekly ads ({sum(e['rows'] for e in written)} products) to {ARCHIVE_DIR}; "
+                f"{skipped} skipped, {failed} failed.")
+    return {"archived_ads": len(written), "archived_products": sum(e["rows"] for e in written),
+            "skipped": skipped, "failed": failed, "files": written}
+
+
+@lru_cache(maxsize=64)
+def _read_history_columns(path: str, mtime: float) -> List[Dict[str, Any]]:
+    """Price-relevant columns of one archive file; cached per file version (mtime) since archives are immutable."""
+    if path.endswith(".parquet"):
+        if pq is None:
+            logger.warning(f"Cannot read {path}: pyarrow is not installed.")
+            return []
+        return pq.read_table(path, columns=HISTORY_COLUMNS).to_pylist()
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return [{name: row.get(name) for name in HISTORY_COLUMNS} for row in map(json.loads, f)]
+
+
+def _matches(name: str, terms: List[str]) -> bool:
+    name = (name or "").lower()
+    return all(term in name for term in terms)
+
+
+def _like_pattern(term: str) -> str:
+    """ILIKE pattern matching `term` anywhere, with its own % and _ taken literally (escape character \\)."""
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _archive_points(terms: List[str], retailer_id: Optional[int], since: Optional[date]) -> List[PriceHistoryPoint]:
+    """Price points from the cold archive files; blocking file I/O and decompression, run in a worker thread."""
+    points: List[PriceHistoryPoint] = []
+    for entry in load_manifest():
+        if retailer_id and entry["retailer_id"] != retailer_id:
+            continue
+        if since and date.fromisoformat(entry["valid_from"]) < since:
+            continue
+        path = ARCHIVE_DIR / entry["file"]
+        if not path.exists():
+            logger.warning(f"Archive file listed in the manifest is missing: {path}")
+            continue
+        for row in _read_history_columns(str(path), path.stat().st_mtime):
+            if row.get("price") is None or not _matches(row.get("name"), terms):
+                continue
+            points.append(PriceHistoryPoint(
+                valid_from=entry["valid_from"], valid_to=entry["valid_to"], retailer_id=entry["retailer_id"],
+                retailer_name=entry["retailer_name"], name=row["name"], price=row["price"],
+                original_price=row.get("original_price"), unit=row.get("unit"), unit_price=row.get("unit_price"),
+                unit_price_basis=row.get("unit_price_basis"), source="archive",
+            ))
+    return points
+
+
+async def price_history(
+    db: Session,
+    q: str,
+    retailer_id: Optional[int] = None,
+    since: Optional[date] = None,
+    limit: int = 500
+) -> PriceHistoryResponse:
+    '''
+    Price points for products whose name contains every word of `q`, oldest first: products still in
+    Postgres (any ad period) plus the cold archive files, filtered by retailer and start date via the manifest.
+    '''
+    terms = [term for term in q.lower().split() if term]
+    points: List[PriceHistoryPoint] = []
+
+    query = (
+        db.query(models.Product, models.WeeklyAd.valid_from, models.WeeklyAd.valid_to, models.Retailer.name)
+        .join(models.WeeklyAd, models.Product.weekly_ad_id == models.WeeklyAd.id)
+        .join(models.Retailer, models.Product.retailer_id == models.Retailer.id)
+    )
+    for term in terms:
+        query = query.filter(models.Product.name.ilike(_like_pattern(term), escape="\\"))
+    if retailer_id:
+        query = query.filter(models.Product.retailer_id == retailer_id)
+    if since:
+        query = query.filter(models.WeeklyAd.valid_from >= since)
+    for product, valid_from, valid_to, retailer_name in query.order_by(models.WeeklyAd.valid_from.desc()).limit(limit).all():
+        points.append(PriceHistoryPoint(
+            valid_from=valid_from, valid_to=valid_to, retailer_id=product.retailer_id, retailer_name=retailer_name,
+            name=product.name, price=product.price, original_price=product.original_price, unit=product.unit,
+            unit_price=product.unit_price, unit_price_basis=product.unit_price_basis, source="database",
+        ))
+
+    points.extend(await asyncio.to_thread(_archive_points, terms, retailer_id, since))
+
+    points.sort(key=lambda point: (point.valid_from, point.retailer_name, point.name))
+    return PriceHistoryResponse(query=q, points=points[-limit:])
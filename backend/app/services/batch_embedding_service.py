@@ -1,38 +1,26 @@
 import logging
-import os
 from sqlalchemy.orm import Session
-from sqlalchemy import update
+from sqlalchemy import update, or_
 from typing import List, Dict, Any, Optional
 
-import google.generativeai as genai
-from dotenv import load_dotenv
 from .. import models
+from ..models import EMBEDDING_STORAGE_MODE
+from ..utils.utils import truncate_embedding
+from .model_providers import get_embedding_provider
+from .model_clients import model_clients
+from .product_partitions import ad_week_filter
 
 '''
 Database Integration: It queries the database for products needing embeddings and then updates their records with the newly generated vectors using SQLAlchemy's ORM.
 Product Text Preparation: It constructs a combined text string for each product, drawing from its name, category, and promotional details, which is crucial for generating relevant embeddings.
-Batch Embedding with Gemini: It efficiently sends these prepared product texts in batches to the Google Gemini API to generate high-dimensional numerical embeddings.
+Batch Embedding: It efficiently sends these prepared product texts in batches to the configured embedding provider (Gemini by default, see model_providers.py) to generate high-dimensional numerical embeddings.
 Progressive Updates & Logging: The process updates products iteratively, commits changes to the database in batches, and logs its progress and outcomes for monitoring.
 Robust Error Handling: The service includes robust error handling for API calls, gracefully managing situations where embedding generation might fail for individual texts or entire batches.
+Compact Storage: Depending on EMBEDDING_STORAGE_MODE, the full 768-dim vector, a truncated COMPACT_EMBEDDING_DIM copy (embedding_compact), or both are stored.
 '''
 
-load_dotenv() 
-
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configuration for Gemini API
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-GEMINI_EMBEDDINGS_MODEL = os.getenv("GEMINI_EMBEDDINGS_MODEL")
-
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-else:
-    logger.warning("GEMINI_API_KEY not found in environment variables. Embedding generation will fail.")
-
-if not GEMINI_EMBEDDINGS_MODEL:
-    logger.warning("GEMINI_EMBEDDINGS_MODEL not found in environment variables. Embedding generation will fail.")
-
 BATCH_SIZE = 100  # Number of products to process from DB at a time (gemini API limit is often 100)
 TEST_ROUND_LIMIT = 5
 
@@ -55,32 +43,153 @@ def construct_text_for_embedding(product: models.Product) -> str:
     # print(f"Constructed text for embedding: {parts}")
     return "\n".join(parts)
 
+def _missing_embedding_filter():
+    """
+    Returns the filter selecting products that still need vectors for the configured storage mode.
+    """
+    if EMBEDDING_STORAGE_MODE == "full":
+        return models.Product.embedding == None
+    if EMBEDDING_STORAGE_MODE == "compact":
+        return models.Product.embedding_compact == None
+    return or_(models.Product.embedding == None, models.Product.embedding_compact == None)
+
+def _embedding_update_values(embedding_vector: List[float]) -> Dict[str, Any]:
+    """
+    Builds the column values to store for one generated embedding, based on EMBEDDING_STORAGE_MODE.
+    """
+    values: Dict[str, Any] = {}
+    if EMBEDDING_STORAGE_MODE in ("full", "both"):
+        values["embedding"] = embedding_vector
+    if EMBEDDING_STORAGE_MODE in ("compact", "both"):
+        values["embedding_compact"] = truncate_embedding(embedding_vector, models.COMPACT_EMBEDDING_DIM)
+    return values
+
+def _backfill_compact_embeddings(db: Session) -> int:
+    """
+    Fills embedding_compact for products that already have a full embedding, by truncating locally.
+    Avoids re-calling the embeddings API for rows embedded before compact storage was enabled.
+    """
+    backfilled = 0
+    while True:
+        rows = db.query(models.Product.id, models.Product.ad_week, models.Product.embedding).filter(
+            models.Product.embedding != None,
+            models.Product.embedding_compact == None
+        ).limit(BATCH_SIZE).all()
+        if not rows:
+            break
+        for product_id, product_week, embedding_vector in rows:
+            compact_vector = truncate_embedding(embedding_vector, models.COMPACT_EMBEDDING_DIM)
+            db.execute(update(models.Product)
+                       .where(models.Product.id == product_id, models.Product.ad_week == product_week)
+                       .values(embedding_compact=compact_vector))
+        db.commit()
+        backfilled += len(rows)
+    if backfilled:
+        logger.info(f"Backfilled compact embeddings for {backfilled} products from their stored full embeddings.")
+    return backfilled
+
 def _generate_embeddings_batch(texts: List[str]) -> List[Optional[List[float]]]: # optional b/c LLM may not return embeddings for some texts
     """
-    Generates embeddings for a batch of texts using Gemini API.
+    Generates embeddings for a batch of texts using the embedding provider.
     Returns a list of embeddings or None for each text if an error occurs for that text or the batch.
     """
     if not texts:
         return []
     try:
-        result = genai.embed_content(
-            model=GEMINI_EMBEDDINGS_MODEL,
-            content=texts,  # API expects a list of strings for batching
-            task_type="RETRIEVAL_QUERY" 
-        )
-        return result.get('embedding', [None] * len(texts))  # result['embedding'] will be a list of lists (embeddings)
+        return model_clients.embed("embedding", texts, task_type="RETRIEVAL_QUERY")
     except Exception as e:
         logger.error(f"Error generating batch embeddings for {len(texts)} texts: {e}")
         return [None] * len(texts)
 
 
-async def batch_embed_products(db: Session) -> Dict[str, Any]:
+def _embed_and_store(db: Session, product_text_pairs: List[Dict[str, Any]], batch_label: str) -> int:
+    """
+    Generates embeddings for prepared {"product", "text"} pairs in one API call, updates the products
+    and commits. Returns the number of products whose embeddings were committed.
+    """
+    texts_for_api_batch = [pair["text"] for pair in product_text_pairs]
+
+    logger.info(f"Sending {len(texts_for_api_batch)} texts to the embedding provider ({batch_label}).")
+    embedding_vectors = _generate_embeddings_batch(texts_for_api_batch)
+
+    updates_in_db_batch = 0
+    for idx, pair in enumerate(product_text_pairs): # Iterate over product_text_pairs directly
+        product_to_update = pair["product"]
+        embedding_vector = embedding_vectors[idx] if idx < len(embedding_vectors) else None
+
+        if embedding_vector:
+            try:
+                stmt = (update(models.Product)
+                        .where(models.Product.id == product_to_update.id, models.Product.ad_week == product_to_update.ad_week)
+                        .values(**_embedding_update_values(embedding_vector)))
+                db.execute(stmt)
+                updates_in_db_batch += 1
+            except Exception as e:
+                logger.error(f"Error updating embedding for product ID {product_to_update.id} ('{product_to_update.name}'): {e}")
+        else:
+            logger.warning(f"Failed to generate embedding for product ID {product_to_update.id} ('{product_to_update.name}'). Skipping update.")
+    
+    if updates_in_db_batch > 0:
+        try:
+            db.commit()
+            logger.info(f"Committed {updates_in_db_batch} product embedding updates for {batch_label}.")
+            return updates_in_db_batch
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error committing updates for {batch_label}: {e}. Rolled back.")
+            return 0
+    logger.info(f"No embeddings were successfully generated or updated in {batch_label}. No commit needed.")
+    return 0
+
+
+def _text_pairs(products: List[models.Product]) -> List[Dict[str, Any]]:
+    """Pairs each product with its embedding text, skipping products with nothing to embed."""
+    product_text_pairs = []
+    for product in products:
+        text_to_embed = construct_text_for_embedding(product)
+        if text_to_embed.strip():
+            product_text_pairs.append({"product": product, "text": text_to_embed})
+        else:
+            logger.warning(f"Product ID {product.id} ('{product.name}') has no content to embed. Skipping.")
+    return product_text_pairs
+
+
+def embed_products_for_weekly_ad(db: Session, weekly_ad_id: int) -> int:
+    """
+    Embeds the products of a single weekly ad that still need vectors (used by the ingestion pipeline,
+    so a freshly loaded ad is embedded without waiting for a full batch run). Returns products embedded.
+    """
+    if not get_embedding_provider().can_embed():
+        raise RuntimeError("Embedding service is not configured (API key or model missing).")
+    if EMBEDDING_STORAGE_MODE in ("compact", "both"):
+        _backfill_compact_embeddings(db)
+
+    embedded = 0
+    last_id = 0
+    while True:
+        products = db.query(models.Product).filter(
+            models.Product.weekly_ad_id == weekly_ad_id,
+            models.Product.id > last_id,
+            _missing_embedding_filter()
+        ).order_by(models.Product.id).limit(BATCH_SIZE).all()
+        if not products:
+            break
+        last_id = products[-1].id
+        product_text_pairs = _text_pairs(products)
+        if product_text_pairs:
+            embedded += _embed_and_store(db, product_text_pairs, f"weekly ad {weekly_ad_id}")
+    logger.info(f"Embedded {embedded} products for weekly ad {weekly_ad_id}.")
+    return embedded
+
+
+def batch_embed_products(db: Session) -> Dict[str, Any]:
     """
     Fetches products, generates embeddings in batches, and updates them.
+    Synchronous like embed_products_for_weekly_ad (every call it makes blocks); run it in a worker thread.
     """
-    logger.info(f"Starting batch embedding process. DB Batch size: {BATCH_SIZE}. Model: {GEMINI_EMBEDDINGS_MODEL or 'Not Configured'}")
+    logger.info(f"Starting batch embedding process. DB Batch size: {BATCH_SIZE}. Provider: {get_embedding_provider().name}. Storage mode: {EMBEDDING_STORAGE_MODE}")
 
-    if not GEMINI_API_KEY or not GEMINI_EMBEDDINGS_MODEL:
+    if not get_embedding_provider().can_embed():
         logger.error("Embedding service is not configured (API key or model missing). Aborting.")
         return {"status": "Error: Embedding service not configured.", "batches_processed": 0, "total_products_queried": 0, "total_products_updated": 0}
 
@@ -88,10 +197,14 @@ async def batch_embed_products(db: Session) -> Dict[str, Any]:
     total_products_successfully_embedded = 0
     db_batches_processed = 0
 
+    if EMBEDDING_STORAGE_MODE in ("compact", "both"):
+        _backfill_compact_embeddings(db)
+
     while True:
         products_for_this_db_batch = db.query(models.Product).join(models.WeeklyAd).filter(
             models.WeeklyAd.ad_period == 'current',
-            models.Product.embedding == None
+            ad_week_filter(db, 'current'),
+            _missing_embedding_filter()
         ).limit(BATCH_SIZE).all()
 
         if not products_for_this_db_batch:
@@ -99,20 +212,14 @@ async def batch_embed_products(db: Session) -> Dict[str, Any]:
             break
         
         if db_batches_processed >= TEST_ROUND_LIMIT:
-            print(f"====TEST ROUND LIMIT REACHED====. Exiting after {db_batches_processed} DB batches.")
+            logger.info(f"====TEST ROUND LIMIT REACHED====. Exiting after {db_batches_processed} DB batches.")
             return
         db_batches_processed += 1
         logger.info(f"Processing DB batch {db_batches_processed}. Products in this DB batch: {len(products_for_this_db_batch)}")
         total_products_queried_from_db += len(products_for_this_db_batch)
 
         # Prepare texts and track corresponding products
-        product_text_pairs = []
-        for product in products_for_this_db_batch:
-            text_to_embed = construct_text_for_embedding(product)
-            if text_to_embed.strip():
-                product_text_pairs.append({"product": product, "text": text_to_embed})
-            else:
-                logger.warning(f"Product ID {product.id} ('{product.name}') has no content to embed. Skipping.")
+        product_text_pairs = _text_pairs(products_for_this_db_batch)
         # print(f"Product text pairs: {product_text_pairs}")
 
         if not product_text_pairs:
@@ -121,36 +228,7 @@ async def batch_embed_products(db: Session) -> Dict[str, Any]:
                  break
             continue
             
-        texts_for_api_batch = [pair["text"] for pair in product_text_pairs]
-
-        logger.info(f"Sending {len(texts_for_api_batch)} texts to Gemini API for embedding (DB Batch {db_batches_processed}).")
-        embedding_vectors = _generate_embeddings_batch(texts_for_api_batch)
-
-        updates_in_db_batch = 0 # Renamed from updates_in_api_batch for clarity
-        for idx, pair in enumerate(product_text_pairs): # Iterate over product_text_pairs directly
-            product_to_update = pair["product"]
-            embedding_vector = embedding_vectors[idx] if idx < len(embedding_vectors) else None
-
-            if embedding_vector:
-                try:
-                    stmt = update(models.Product).where(models.Product.id == product_to_update.id).values(embedding=embedding_vector)
-                    db.execute(stmt)
-                    updates_in_db_batch += 1
-                except Exception as e:
-                    logger.error(f"Error updating embedding for product ID {product_to_update.id} ('{product_to_update.name}'): {e}")
-            else:
-                logger.warning(f"Failed to generate embedding for product ID {product_to_update.id} ('{product_to_update.name}'). Skipping update.")
-        
-        if updates_in_db_batch > 0:
-            try:
-                db.commit()
-                logger.info(f"Committed {updates_in_db_batch} product embedding updates for DB batch {db_batches_processed}.")
-                total_products_successfully_embedded += updates_in_db_batch
-            except Exception as e:
-                db.rollback()
-                logger.error(f"Error committing updates for DB batch {db_batches_processed}: {e}. Rolled back.")
-        else:
-            logger.info(f"No embeddings were successfully generated or updated in DB batch {db_batches_processed}. No commit needed.")
+        total_products_successfully_embedded += _embed_and_store(db, product_text_pairs, f"DB Batch {db_batches_processed}")
 
         if len(products_for_this_db_batch) < BATCH_SIZE: # Last DB batch was processed
             logger.info("Processed the last potential DB batch of products.")
@@ -0,0 +1,251 @@
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..models import COMPACT_EMBEDDING_DIM, EMBEDDING_STORAGE_MODE
+from ..schemas.data_schemas import PricePoint, PriceTrendResponse
+from ..utils.utils import truncate_embedding
+from ..utils.metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+'''
+Canonical product identity and price series.
+Weekly product rows are independent, so each embedded row is linked to a canonical product:
+1. Name normalisation (lowercase, sizes and punctuation stripped) finds exact matches with one indexed lookup.
+2. Rows with no exact match are matched by nearest neighbour on the canonical products' compact embeddings,
+   all rows of a batch in one LATERAL query, accepted above CANONICAL_MATCH_THRESHOLD (same category when known).
+3. Anything left becomes a new canonical product. New names within one batch are first matched against each
+   other the same way, so near-duplicates arriving together ("coke 12 pack", "coca cola 12pk") share one.
+Every linked row appends a point to product_prices, so "has this been cheaper before?" is one indexed read on
+(canonical_product_id, valid_from), and the series outlives the products rows once they are archived.
+'''
+
+CANONICAL_MATCH_THRESHOLD = float(os.getenv("CANONICAL_MATCH_THRESHOLD", "0.92"))
+CANONICAL_BATCH_SIZE = int(os.getenv("CANONICAL_BATCH_SIZE", "500"))
+
+_SIZE_TOKENS = re.compile(
+    r"\b\d+(?:\.\d+)?\s*-?\s*(?:fl\.?\s*oz|oz|ounce|lbs?|pound|kg|g|gram|ml|l|liter|litre|gal|gallon|qt|pt|ct|count|pk|pack)\b\.?",
+    re.IGNORECASE,
+)
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+_NEAREST_SQL = text("""
+    SELECT q.idx, c.id, 1 - (c.embedding <=> q.vec::vector) AS similarity
+    FROM unnest(CAST(:idx AS int[]), CAST(:vectors AS text[]), CAST(:categories AS text[])) AS q(idx, vec, category)
+    CROSS JOIN LATERAL (
+        SELECT c.id, c.embedding
+        FROM canonical_products c
+        WHERE c.embedding IS NOT NULL
+          AND (q.category IS NULL OR c.category IS NULL OR c.category = q.category)
+        ORDER BY c.embedding <=> q.vec::vector
+        LIMIT 1
+    ) c
+""")
+
+
+def normalise_name(name: str) -> str:
+    """Identity key for a product name: lowercase, package sizes and punctuation removed."""
+    without_sizes = _SIZE_TOKENS.sub(" ", (name or "").lower())
+    return " ".join(_NON_ALNUM.sub(" ", without_sizes).split())[:255]
+
+
+def _compact_vector(row) -> Optional[List[float]]:
+    if EMBEDDING_STORAGE_MODE == "full":
+        return truncate_embedding(row.embedding, COMPACT_EMBEDDING_DIM) if row.embedding is not None else None
+    return [float(v) for v in row.embedding_compact] if row.embedding_compact is not None else None
+
+
+def _unlinked_products(db: Session, weekly_ad_id: Optional[int], after_id: int, batch_size: int):
+    embedding_column = models.Product.embedding if EMBEDDING_STORAGE_MODE == "full" else models.Product.embedding_compact
+    query = (
+        db.query(
+            models.Product.id, models.Product.ad_week, models.Product.name, models.Product.category, models.Product.retailer_id,
+            models.Product.weekly_ad_id, models.Product.price, models.Product.original_price, models.Product.unit,
+            models.Product.unit_price, models.Product.unit_price_basis, embedding_column,
+            models.WeeklyAd.valid_from, models.WeeklyAd.valid_to,
+        )
+        .join(models.WeeklyAd, models.Product.weekly_ad_id == models.WeeklyAd.id)
+        .filter(models.Product.canonical_product_id.is_(None), embedding_column.isnot(None), models.Product.price.isnot(None),
+                models.Product.id > after_id)
+    )
+    if weekly_ad_id is not None:
+        query = query.filter(models.Product.weekly_ad_id == weekly_ad_id)
+    return query.order_by(models.Product.id).limit(batch_size).all()
+
+
+def _nearest_canonical(db: Session, rows, vectors: List[List[float]]) -> Dict[int, int]:
+    """{row index: canonical id} for rows whose nearest canonical product is similar enough."""
+    params = {
+        "idx": list(range(len(rows))),
+        "vectors": ['[' + ','.join(map(str, vector)) + ']' for vector in vectors],
+        "categories": [row.category for row in rows],
+    }
+    return {
+        match.idx: match.id
+        for match in db.execute(_NEAREST_SQL, params)
+        if match.similarity is not None and match.similarity >= CANONICAL_MATCH_THRESHOLD
+    }
+
+
+def _group_new_names(pending: List[Tuple[str, Any, List[float]]]) -> Dict[str, str]:
+    """
+    {key: representative key} for a batch's new names: each name joins the first earlier name of a compatible
+    category whose vector is at least CANONICAL_MATCH_THRESHOLD similar, otherwise it represents itself.
+    """
+    vectors = np.asarray([vector for _, _, vector in pending], dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    representative: Dict[str, str] = {}
+    heads: List[int] = []
+    for i, (key, row, _) in enumerate(pending):
+        match = None
+        if heads:
+            similarities = vectors[heads] @ vectors[i]
+            for j in np.argsort(-similarities):
+                if similarities[j] < CANONICAL_MATCH_THRESHOLD:
+                    break
+                head_category = pending[heads[j]][1].category
+                if row.category is None or head_category is None or head_category == row.category:
+                    match = pending[heads[j]][0]
+                    break
+        if match is None:
+            heads.append(i)
+            match = key
+        representative[key] = match
+    return representative
+
+
+def _link_batch(db: Session, rows) -> Dict[str, int]:
+    keys = [normalise_name(row.name) for row in rows]
+    canonical_by_key: Dict[str, int] = dict(
+        db.query(models.CanonicalProduct.normalised_name, models.CanonicalProduct.id)
+        .filter(models.CanonicalProduct.normalised_name.in_(set(keys)))
+        .all()
+    )
+    matched_by_name = sum(1 for key in keys if key in canonical_by_key)
+
+    # One representative per unknown key goes to the nearest-neighbour pass
+    representatives: Dict[str, int] = {}
+    for i, key in enumerate(keys):
+        if key not in canonical_by_key and key not in representatives:
+            representatives[key] = i
+    pending = [(key, rows[i], _compact_vector(rows[i])) for key, i in representatives.items()]
+    pending = [(key, row, vector) for key, row, vector in pending if vector]
+
+    matched_by_embedding = 0
+    if pending:
+        nearest = _nearest_canonical(db, [row for _, row, _ in pending], [vector for _, _, vector in pending])
+        unmatched = []
+        for i, (key, row, vector) in enumerate(pending):
+            if i in nearest:
+                canonical_by_key[key] = nearest[i]
+                matched_by_embedding += 1
+            else:
+                unmatched.append((key, row, vector))
+        representative = _group_new_names(unmatched) if unmatched else {}
+        new_canonicals = [
+            {"normalised_name": key, "display_name": row.name, "category": row.category, "embedding": vector}
+            for key, row, vector in unmatched if representative[key] == key
+        ]
+        if new_canonicals:
+            # ON CONFLICT keeps concurrent loaders from creating the same canonical product twice
+            statement = pg_insert(models.CanonicalProduct).values(new_canonicals)
+            statement = statement.on_conflict_do_update(
+                index_elements=["normalised_name"], set_={"normalised_name": statement.excluded.normalised_name}
+            ).returning(models.CanonicalProduct.normalised_name, models.CanonicalProduct.id)
+            canonical_by_key.update(dict(db.execute(statement).all()))
+        for key, head in representative.items():
+            if key != head and head in canonical_by_key:
+                canonical_by_key[key] = canonical_by_key[head]
+                matched_by_embedding += 1
+
+    links = [(row, canonical_by_key[key]) for row, key in zip(rows, keys) if key in canonical_by_key]
+    db.bulk_update_mappings(models.Product, [
+        {"id": row.id, "ad_week": row.ad_week, "canonical_product_id": canonical_id} for row, canonical_id in links
+    ])
+    if links:
+        db.execute(pg_insert(models.ProductPrice).values([
+            {
+                "canonical_product_id": canonical_id, "product_id": row.id, "retailer_id": row.retailer_id,
+                "weekly_ad_id": row.weekly_ad_id, "valid_from": row.valid_from, "valid_to": row.valid_to,
+                "name": row.name, "price": row.price, "original_price": row.original_price, "unit": row.unit,
+                "unit_price": row.unit_price, "unit_price_basis": row.unit_price_basis,
+            }
+            for row, canonical_id in links
+        ]).on_conflict_do_nothing(index_elements=["product_id"]))
+    db.commit()
+    return {"linked": len(links), "by_name": matched_by_name, "by_embedding": matched_by_embedding,
+            "new": len(links) - matched_by_name - matched_by_embedding, "unlinked": len(rows) - len(links)}
+
+
+def link_canonical_products(db: Session, weekly_ad_id: Optional[int] = None, batch_size: int = CANONICAL_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Links embedded products without a canonical product (of one weekly ad, or all) and appends their price points.
+    Returns counts of linked rows and how they were matched.
+    """
+    totals = {"linked": 0, "by_name": 0, "by_embedding": 0, "new": 0, "unlinked": 0}
+    last_id = 0
+    while True:
+        # Keyset paging: rows left unlinked are never re-read, and a batch that links nothing does not stop the scan
+        rows = _unlinked_products(db, weekly_ad_id, last_id, batch_size)
+        if not rows:
+            break
+        last_id = rows[-1].id
+        batch = _link_batch(db, rows)
+        for name, count in batch.items():
+            totals[name] += count
+        if len(rows) < batch_size:
+            break
+    logger.info(f"Canonical products: linked {totals['linked']} products ({totals['by_name']} by name, "
+                f"{totals['by_embedding']} by embedding, {totals['new']} new canonical products).")
+    return totals
+
+
+async def get_price_trend(db: Session, product_id: int) -> PriceTrendResponse:
+    '''
+    Price series of the product's canonical product across weeks and retailers (one indexed read),
+    with the lowest and average price seen and whether the product's price is the lowest on record.
+    '''
+    product = db.query(models.Product.price, models.Product.canonical_product_id).filter(models.Product.id == product_id).first()
+    if not product:
+        raise HTTPException(status_code=404, detail=f"Product {product_id} not found.")
+    if product.canonical_product_id is None:
+        raise HTTPException(status_code=404, detail=f"Product {product_id} has no price history yet.")
+
+    canonical = db.get(models.CanonicalProduct, product.canonical_product_id)
+    with stage_timer("db_query"):
+        rows = (
+            db.query(models.ProductPrice, models.Retailer.name)
+            .join(models.Retailer, models.ProductPrice.retailer_id == models.Retailer.id)
+            .filter(models.ProductPrice.canonical_product_id == product.canonical_product_id)
+            .order_by(models.ProductPrice.valid_from)
+            .all()
+        )
+    points = [
+        PricePoint(
+            product_id=point.product_id, valid_from=point.valid_from, valid_to=point.valid_to,
+            retailer_id=point.retailer_id, retailer_name=retailer_name, name=point.name, price=point.price,
+            original_price=point.original_price, unit=point.unit, unit_price=point.unit_price,
+            unit_price_basis=point.unit_price_basis,
+        )
+        for point, retailer_name in rows
+    ]
+    prices = [point.price for point in points]
+    current_price = float(product.price) if product.price is not None else None
+    return PriceTrendResponse(
+        canonical_product_id=canonical.id,
+        canonical_name=canonical.display_name,
+        points=points,
+        lowest_price=min(prices) if prices else None,
+        average_price=round(sum(prices) / len(prices), 2) if prices else None,
+        current_price=current_price,
+        is_lowest_ever=current_price is not None and bool(prices) and current_price <= min(prices),
+    )
@@ -0,0 +1,103 @@
+import logging
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .. import database
+from ..utils.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+'''
+In-process cache for derived views of the catalog (facet counts and similar), keyed by catalog version.
+The catalog only changes when a weekly ad is loaded and ad periods roll over, so the version is a fingerprint
+of weekly_ads (count and max id per ad_period): one aggregate over a small table. The version is re-read at
+most every CATALOG_VERSION_TTL_SECONDS; invalidate() forces a re-read after a load in this process, and other
+processes pick the change up within the TTL. Entries built for an older version are dropped when the version moves.
+The version is always read on the primary: callers may hold read-replica sessions, and mixing the two would make it
+flip between old and new while the replica lags. A view is only cached when the session that builds it already
+sees the current version, so a lagging replica never stores stale data under the new version.
+'''
+
+CATALOG_VERSION_TTL_SECONDS = float(os.getenv("CATALOG_VERSION_TTL_SECONDS", "5"))
+
+_VERSION_SQL = text("""
+    SELECT ad_period, count(*) AS ads, coalesce(max(id), 0) AS max_id
+    FROM weekly_ads
+    GROUP BY ad_period
+    ORDER BY ad_period
+""")
+
+
+def _read_version(db: Session) -> str:
+    rows = db.execute(_VERSION_SQL).fetchall()
+    fingerprint = ";".join(f"{row.ad_period}:{row.ads}:{row.max_id}" for row in rows)
+    return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:12]
+
+
+def _read_primary_version() -> str:
+    db = database.SessionLocal()
+    try:
+        return _read_version(db)
+    finally:
+        db.close()
+
+
+class CatalogCache:
+    def __init__(self, version_ttl: float):
+        self.version_ttl = version_ttl
+        self._version: Optional[str] = None
+        self._version_read_at = 0.0
+        self._entries: Dict[Tuple[str, Hashable], Any] = {}
+        self._lock = threading.Lock()
+
+    def version(self) -> str:
+        """Current catalog version; reads weekly_ads on the primary at most once per TTL."""
+        with self._lock:
+            if self._version is not None and time.monotonic() - self._version_read_at < self.version_ttl:
+                return self._version
+        version = _read_primary_version()
+        with self._lock:
+            if version != self._version:
+                if self._version is not None:
+                    logger.info("Catalog version changed %s -> %s. Dropping %s cached views.", self._version, version, len(self._entries))
+                self._entries.clear()
+                self._version = version
+            self._version_read_at = time.monotonic()
+        return version
+
+    def invalidate(self):
+        """Forces the next lookup to re-read the version (call after loading ads in this process)."""
+        with self._lock:
+            self._version_read_at = 0.0
+
+    def get_or_build(self, db: Session, name: str, key: Hashable, builder: Callable[[str], Any]) -> Any:
+        """
+        Returns the cached `name` view for `key`, building it with builder(version) on a miss.
+        The builder reads through `db`; when that session is behind the primary (a lagging replica), the view is
+        returned but not cached.
+        """
+        version = self.version()
+        with self._lock:
+            entry = self._entries.get((name, key))
+        record_cache(f"catalog_{name}", entry is not None)
+        if entry is not None:
+            return entry
+        # Checked before building: the session only moves forward, so it cannot build from older data than this
+        current = db.get_bind() is database.get_engine() or _read_version(db) == version
+        value = builder(version)
+        with self._lock:
+            # Only keep it if the session saw this version and no newer version was seen while building
+            if current and self._version == version:
+                self._entries[(name, key)] = value
+        if not current:
+            logger.info("Catalog %s view for %s built on a session behind version %s; not cached.", name, key, version)
+        return value
+
+
+catalog_cache = CatalogCache(CATALOG_VERSION_TTL_SECONDS)
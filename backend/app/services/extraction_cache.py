@@ -0,0 +1,95 @@
+import logging
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import text
+
+from .. import database
+from ..schemas.pdf_schema import ExtractedPDFData
+from ..utils.metrics import record_cache
+from .pdf_prompts import GENERAL_PROMPT_TEMPLATE, PRODUCT_CATEGORIES, KNOWN_RETAILERS, PRODUCT_UNITS
+
+logger = logging.getLogger(__name__)
+
+'''
+Content-addressed cache for PDF extractions.
+Entries are keyed by the SHA-256 of the PDF bytes plus a prompt version (hash of the extraction prompt
+template and the category/unit/retailer lists), and store the validated ExtractedPDFData with the token
+usage of the original Gemini call. A renamed or re-uploaded identical PDF is served from the cache,
+a changed PDF with the same name misses, and prompt changes invalidate every entry made with the old prompt.
+Page chunks of a chunked extraction are cached under the PDF hash plus their page range ("<sha256>-p1-10"),
+so a retried extraction only sends the chunks that failed.
+Entries live in the Postgres extraction_cache table rather than on a dyno's disk, so every worker shares them and
+they survive restarts: a repeat upload or a retried job hits the cache whichever worker claims it.
+'''
+
+_LOAD_SQL = text("SELECT usage, data FROM extraction_cache WHERE content_key = :content_key AND prompt_version = :prompt_version")
+
+_SAVE_SQL = text("""
+    INSERT INTO extraction_cache (content_key, prompt_version, source_filename, usage, data, created_at)
+    VALUES (:content_key, :prompt_version, :source_filename, CAST(:usage AS jsonb), CAST(:data AS jsonb), now())
+    ON CONFLICT (content_key, prompt_version) DO UPDATE
+    SET source_filename = EXCLUDED.source_filename, usage = EXCLUDED.usage, data = EXCLUDED.data, created_at = now()
+""")
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: Path) -> str:
+    """Streams the file through SHA-256 so large PDFs aren't read into memory at once."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compute_prompt_version() -> str:
+    """Short hash of everything that shapes the extraction output (template + allowed values)."""
+    digest = hashlib.sha256()
+    digest.update(GENERAL_PROMPT_TEMPLATE.encode('utf-8'))
+    for values in (PRODUCT_CATEGORIES, PRODUCT_UNITS, KNOWN_RETAILERS):
+        digest.update(b"\0" + "\x1f".join(values).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+PROMPT_VERSION = compute_prompt_version()
+
+
+def load(pdf_sha256: str, prompt_version: str = PROMPT_VERSION) -> Optional[Tuple[ExtractedPDFData, Dict[str, Any]]]:
+    """Returns (validated data, token usage) for a cached extraction, or None on a miss/corrupt entry."""
+    with database.SessionLocal() as db:
+        row = db.execute(_LOAD_SQL, {"content_key": pdf_sha256, "prompt_version": prompt_version}).first()
+    if row is None:
+        record_cache("pdf_extraction", False)
+        return None
+    try:
+        data = ExtractedPDFData.model_validate(row.data)
+    except ValidationError as e:
+        logger.warning(f"Ignoring unreadable extraction cache entry {pdf_sha256}-{prompt_version}: {e}")
+        record_cache("pdf_extraction", False)
+        return None
+    record_cache("pdf_extraction", True)
+    return data, row.usage or {}
+
+
+def save(
+    pdf_sha256: str,
+    data: ExtractedPDFData,
+    usage: Dict[str, Any],
+    source_filename: str,
+    prompt_version: str = PROMPT_VERSION
+) -> None:
+    """Stores (or replaces) a validated extraction and commits."""
+    with database.SessionLocal() as db:
+        db.execute(_SAVE_SQL, {
+            "content_key": pdf_sha256,
+            "prompt_version": prompt_version,
+            "source_filename": source_filename,
+            "usage": json.dumps(usage),
+            "data": json.dumps(data.model_dump(mode='json'), ensure_ascii=False),
+        })
+        db.commit()
@@ -0,0 +1,220 @@
+import logging
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from google.api_core import exceptions as google_exceptions # type: ignore
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .. import database
+from .model_providers import ProviderError, get_provider
+
+logger = logging.getLogger(__name__)
+
+'''
+Registry of files uploaded to the Gemini Files API.
+Maps an upload key (PDF SHA-256, or SHA-256 + page range for chunks) to the remote file name and its expiry,
+kept in the Postgres gemini_uploads table so live handles are reused across retries, re-extractions, process
+restarts and workers instead of re-uploading the same bytes. Once an extraction is done, or its last attempt
+failed, the remote file is deleted in the background.
+
+Every change is a single statement, so workers never overwrite each other's entries. Uploads run outside any
+lock: when two workers upload the same key at once, the first registration wins and the other deletes its
+duplicate. Expired entries are deleted by prune, which workers run with the job queue's.
+
+`files_api` is anything exposing upload_file/get_file/delete_file; by default the configured model
+provider (model_providers.get_provider), so local and replay providers replace the real Files API offline.
+`session_factory` opens the sessions the registry uses (database.SessionLocal by default).
+'''
+
+# Gemini keeps uploaded files for 48 hours. Handles closer than the margin to expiry are not reused.
+GEMINI_FILE_TTL = timedelta(hours=48)
+REUSE_MARGIN = timedelta(minutes=int(os.getenv("GEMINI_UPLOAD_REUSE_MARGIN_MINUTES", "60")))
+
+_COLUMNS = "upload_key, name, uri, display_name, expires_at"
+
+_ENTRIES_SQL = text(f"SELECT {_COLUMNS} FROM gemini_uploads ORDER BY upload_key")
+
+_ENTRY_SQL = text(f"SELECT {_COLUMNS} FROM gemini_uploads WHERE upload_key = :upload_key")
+
+# Stores the entry unless a different, still reusable upload is registered for the key (and not :replace)
+_REGISTER_SQL = text("""
+    INSERT INTO gemini_uploads (upload_key, name, uri, display_name, expires_at)
+    VALUES (:upload_key, :name, :uri, :display_name, :expires_at)
+    ON CONFLICT (upload_key) DO UPDATE
+    SET name = EXCLUDED.name, uri = EXCLUDED.uri, display_name = EXCLUDED.display_name, expires_at = EXCLUDED.expires_at
+    WHERE :replace OR gemini_uploads.name = EXCLUDED.name
+       OR gemini_uploads.expires_at - make_interval(secs => :reuse_margin) <= now()
+    RETURNING upload_key
+""")
+
+_UNREGISTER_SQL = text(f"DELETE FROM gemini_uploads WHERE upload_key = ANY(:upload_keys) RETURNING {_COLUMNS}")
+
+_UNREGISTER_PREFIX_SQL = text(f"""
+    DELETE FROM gemini_uploads WHERE left(upload_key, length(:prefix)) = :prefix RETURNING {_COLUMNS}
+""")
+
+_PRUNE_SQL = text("DELETE FROM gemini_uploads WHERE expires_at <= now()")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _entry(row) -> Dict[str, Any]:
+    return {"name": row.name, "uri": row.uri, "display_name": row.display_name, "expires_at": row.expires_at}
+
+
+def prune(db: Session) -> int:
+    """Deletes the entries of uploads Gemini has already expired. Returns the number deleted."""
+    deleted = db.execute(_PRUNE_SQL).rowcount
+    db.commit()
+    return deleted
+
+
+class UploadRegistry:
+    def __init__(self, files_api: Any = None, session_factory: Optional[Callable[[], Session]] = None):
+        self._files_api = files_api
+        self._session_factory = session_factory
+        self._handles: Dict[str, Any] = {} # In-memory handles for entries uploaded by this process
+        self._key_locks: Dict[str, Tuple[asyncio.Lock, int]] = {} # key -> (lock, acquirers holding or waiting)
+        self._background_tasks: Set[asyncio.Task] = set()
+
+    @property
+    def files_api(self) -> Any:
+        return self._files_api or get_provider()
+
+    def _session(self) -> Session:
+        return (self._session_factory or database.SessionLocal)()
+
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        """Current registry contents, as stored in the database."""
+        with self._session() as db:
+            return {row.upload_key: _entry(row) for row in db.execute(_ENTRIES_SQL)}
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._session() as db:
+            row = db.execute(_ENTRY_SQL, {"upload_key": key}).first()
+        return _entry(row) if row else None
+
+    def _is_live(self, entry: Dict[str, Any]) -> bool:
+        return entry["expires_at"] - REUSE_MARGIN > _now()
+
+    def _register(self, key: str, entry: Dict[str, Any], replace: bool = False) -> Optional[Dict[str, Any]]:
+        """Stores `entry` unless another process registered a live upload for `key` first (and not `replace`);
+        returns that upload's entry then."""
+        with self._session() as db:
+            stored = db.execute(_REGISTER_SQL, {
+                "upload_key": key, **entry, "replace": replace, "reuse_margin": REUSE_MARGIN.total_seconds(),
+            }).first()
+            db.commit()
+            if stored is not None:
+                return None
+            row = db.execute(_ENTRY_SQL, {"upload_key": key}).first()
+        return _entry(row) if row else None
+
+    def _unregister(self, keys: List[str]) -> List[Dict[str, Any]]:
+        if not keys:
+            return []
+        with self._session() as db:
+            removed = [_entry(row) for row in db.execute(_UNREGISTER_SQL, {"upload_keys": keys})]
+            db.commit()
+        return removed
+
+    def _unregister_prefix(self, prefix: str) -> Tuple[List[str], List[Dict[str, Any]]]:
+        with self._session() as db:
+            rows = db.execute(_UNREGISTER_PREFIX_SQL, {"prefix": prefix}).fetchall()
+            db.commit()
+        return [row.upload_key for row in rows], [_entry(row) for row in rows]
+
+    async def acquire(self, key: str, file_path: Path, display_name: str) -> Any:
+        """
+        Returns a live Gemini file handle for `key`, uploading `file_path` only if no reusable upload exists.
+        Raises google_exceptions.GoogleAPIError if the upload itself fails.
+        """
+        lock, users = self._key_locks.get(key, (None, 0))
+        lock = lock or asyncio.Lock()
+        self._key_locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                return await self._acquire(key, file_path, display_name)
+        finally:
+            lock, users = self._key_locks[key]
+            if users <= 1:
+                del self._key_locks[key]
+            else:
+                self._key_locks[key] = (lock, users - 1)
+
+    async def _acquire(self, key: str, file_path: Path, display_name: str) -> Any:
+        entry = await asyncio.to_thread(self._get, key)
+        if entry and self._is_live(entry):
+            handle = await self._reuse(key, entry, display_name)
+            if handle is not None:
+                return handle
+
+        handle = await asyncio.to_thread(self.files_api.upload_file, path=file_path, display_name=display_name)
+        expires_at = getattr(handle, "expiration_time", None) or (_now() + GEMINI_FILE_TTL)
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        entry = {
+            "name": handle.name,
+            "uri": getattr(handle, "uri", ""),
+            "display_name": display_name,
+            "expires_at": expires_at,
+        }
+        winner = await asyncio.to_thread(self._register, key, entry)
+        if winner is not None: # Another process uploaded the same key meanwhile: use its file, drop ours
+            reused = await self._reuse(key, winner, display_name)
+            if reused is not None:
+                self._delete_in_background(handle.name)
+                return reused
+            await asyncio.to_thread(self._register, key, entry, True) # Its file is already gone
+        self._handles[key] = handle
+        return handle
+
+    async def _reuse(self, key: str, entry: Dict[str, Any], display_name: str) -> Any:
+        handle = self._handles.get(key)
+        if handle is None or handle.name != entry["name"]:
+            try:
+                handle = await asyncio.to_thread(self.files_api.get_file, entry["name"])
+            except (google_exceptions.NotFound, ProviderError):
+                return None
+        self._handles[key] = handle
+        logger.info(f"Reusing uploaded file {entry['name']} for {display_name}.")
+        return handle
+
+    async def release(self, key: str):
+        """Forgets the upload for `key` and deletes the remote file in the background."""
+        self._release_entries(await asyncio.to_thread(self._unregister, [key]), [key])
+
+    async def release_prefix(self, prefix: str):
+        """Releases every upload whose key starts with `prefix` (e.g. a PDF's hash: the whole file and its chunks)."""
+        keys, removed = await asyncio.to_thread(self._unregister_prefix, prefix)
+        self._release_entries(removed, keys)
+
+    def _release_entries(self, removed: List[Dict[str, Any]], keys: List[str]):
+        for key in keys:
+            self._handles.pop(key, None)
+        for entry in removed:
+            self._delete_in_background(entry["name"])
+
+    def _delete_in_background(self, name: str):
+        task = asyncio.create_task(self._delete_remote(name))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _delete_remote(self, name: str):
+        try:
+            await asyncio.to_thread(self.files_api.delete_file, name)
+            logger.info(f"Deleted uploaded file {name} from Gemini Files API.")
+        except google_exceptions.NotFound:
+            pass
+        except Exception as e:
+            logger.warning(f"Could not delete uploaded file {name}: {e}")
+
+
+# Process-wide registry used by GroceryAdProcessor
+upload_registry = UploadRegistry()
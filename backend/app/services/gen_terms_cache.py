@@ -0,0 +1,86 @@
+import logging
+import hashlib
+import re
+import threading
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import text
+
+from .. import database
+from ..utils.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+'''
+Persistent cache of LLM-generated gen_terms (and emoji) for recurring products.
+Weekly ads repeat the same items, so enhancement results are stored under a fingerprint of the
+normalised (name, category, promotion_details) and reused across weeks and retailers. Only cache
+misses are sent to the LLM. Entries are kept in the Postgres gen_terms_cache table under the enhancement
+prompt version they were made with, so every worker shares them and a prompt change starts from an empty cache.
+'''
+
+_GET_SQL = text("""
+    SELECT fingerprint, gen_terms, emoji FROM gen_terms_cache
+    WHERE prompt_version = :prompt_version AND fingerprint = ANY(:fingerprints)
+""")
+
+_PUT_SQL = text("""
+    INSERT INTO gen_terms_cache (fingerprint, prompt_version, gen_terms, emoji, updated_at)
+    VALUES (:fingerprint, :prompt_version, :gen_terms, :emoji, now())
+    ON CONFLICT (fingerprint, prompt_version) DO UPDATE
+    SET gen_terms = EXCLUDED.gen_terms, emoji = EXCLUDED.emoji, updated_at = now()
+""")
+
+_COUNT_SQL = text("SELECT count(*) FROM gen_terms_cache WHERE prompt_version = :prompt_version")
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def _normalise(value: Optional[str]) -> str:
+    return _NON_ALNUM.sub(" ", (value or "").lower()).strip()
+
+
+def fingerprint(name: str, category: Optional[str], promotion_details: Optional[str]) -> str:
+    """Stable key for a product's enhancement inputs; ignores case, punctuation and spacing differences."""
+    key = "|".join(_normalise(v) for v in (name, category, promotion_details))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class GenTermsCache:
+    def __init__(self, prompt_version: str):
+        self.prompt_version = prompt_version
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock() # Guards the counters; lookups run on worker threads
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict[str, Optional[str]]]:
+        """{fingerprint: {"gen_terms", "emoji"}} of the cached entries among `keys` (one query)."""
+        keys = list(keys)
+        if not keys:
+            return {}
+        with database.SessionLocal() as db:
+            rows = db.execute(_GET_SQL, {"prompt_version": self.prompt_version, "fingerprints": list(set(keys))}).fetchall()
+        entries = {row.fingerprint: {"gen_terms": row.gen_terms, "emoji": row.emoji} for row in rows if row.gen_terms}
+        hits = sum(1 for key in keys if key in entries)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(keys) - hits
+        for key in keys:
+            record_cache("gen_terms", key in entries)
+        return entries
+
+    def put_many(self, entries: Dict[str, Dict[str, Optional[str]]]):
+        """Stores (or replaces) {fingerprint: {"gen_terms", "emoji"}} and commits."""
+        if not entries:
+            return
+        with database.SessionLocal() as db:
+            db.execute(_PUT_SQL, [
+                {"fingerprint": key, "prompt_version": self.prompt_version, "gen_terms": entry["gen_terms"], "emoji": entry["emoji"]}
+                for key, entry in entries.items()
+            ])
+            db.commit()
+
+    def count(self) -> int:
+        """Number of entries stored for this prompt version."""
+        with database.SessionLocal() as db:
+            return db.execute(_COUNT_SQL, {"prompt_version": self.prompt_version}).scalar()
@@ -0,0 +1,281 @@
+import logging
+import asyncio
+import os
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from google.api_core import exceptions as google_exceptions # type: ignore
+from sqlalchemy import exc as sa_exc, text
+from sqlalchemy.orm import Session
+
+from ..database import SessionLocal, get_engine
+from . import job_queue
+from . import stage_files
+from .pdf_processor import GroceryAdProcessor, UPLOADS_DIR
+from . import json_enhancement_service
+from . import json_to_db_service
+from . import batch_embedding_service
+from . import canonical_products
+from . import archive_service
+
+logger = logging.getLogger(__name__)
+
+'''
+End-to-end ingestion pipeline: PDF -> extract -> enhance -> load -> embed, run as jobs on the Postgres
+job queue (job_queue.py) by worker processes (python -m app.worker), never inside the web process.
+Every stage is a job kind with a handler below. A pipeline run enqueues one pdf_extraction job per PDF, and each
+stage job enqueues the ad's next stage as soon as it finishes, so ads flow through independently and the stages
+of different ads run on whichever workers are free. The same kinds also serve the standalone endpoints
+(/pdf/process-uploads/, /data/enhance_json/, /data/json_to_db/, /data/embed_products) without chaining; the
+directory-wide enhance and load jobs work on every file stored in stage_files, not on one dyno's disk.
+Loads are serialised across all workers with a Postgres advisory lock, because they rotate ad periods per retailer.
+Stages hand files to each other through the stage_files table, not the local disk: each stage stores its output
+there and the next stage, possibly on another dyno, fetches it back to the same local path before reading it.
+Catalog maintenance that scans whole tables runs as job kinds here too, off the web process: archive_ads
+(/data/archive_ads/), link_canonical_products (/data/canonical_products/link/) and backfill_pricing
+(/data/backfill_pricing/).
+'''
+
+EXTRACT_JOB = "pdf_extraction"
+ENHANCE_JOB = "json_enhancement"
+LOAD_JOB = "json_to_db"
+EMBED_JOB = "embed_products"
+ARCHIVE_JOB = "archive_ads"
+LINK_JOB = "link_canonical_products"
+BACKFILL_PRICING_JOB = "backfill_pricing"
+STAGES = (EXTRACT_JOB, ENHANCE_JOB, LOAD_JOB, EMBED_JOB)
+NEXT_STAGE = dict(zip(STAGES, STAGES[1:]))
+
+# Extraction jobs get more attempts than other kinds: Gemini rate limits and outages are retried only by the
+# job queue's backoff (no in-process retry on top), and each retry re-sends only the chunks not yet cached
+PDF_JOB_MAX_ATTEMPTS = int(os.getenv("PDF_JOB_MAX_ATTEMPTS", "4"))
+
+_LOAD_LOCK_ID = 7305231 # Arbitrary pg_advisory_lock key shared by every loader
+
+Progress = Callable[[Any], None]
+
+
+class StageError(Exception):
+    """A stage finished without producing its output (details are in the logs)."""
+
+
+# Failures a later attempt can fix: Gemini API errors (rate limits, outages), lost DB connections, network timeouts
+# and stages that came out empty. Anything else (bad input, bugs, PermanentJobError) fails the job at once.
+RETRYABLE_ERRORS = (
+    google_exceptions.GoogleAPIError, sa_exc.OperationalError, sa_exc.InterfaceError,
+    ConnectionError, TimeoutError, asyncio.TimeoutError, StageError,
+)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether the job queue should retry a job that raised `error` (with backoff) instead of failing it."""
+    return isinstance(error, RETRYABLE_ERRORS) and not isinstance(error, job_queue.PermanentJobError)
+
+
+_processor: Optional[GroceryAdProcessor] = None
+
+
+def _get_processor() -> GroceryAdProcessor:
+    """One shared processor per worker process, created on first use."""
+    global _processor
+    if _processor is None:
+        _processor = GroceryAdProcessor()
+    return _processor
+
+
+def _db_call(func: Callable, *args) -> Any:
+    """Runs func(db, *args) in a short-lived session."""
+    db = SessionLocal()
+    try:
+        return func(db, *args)
+    finally:
+        db.close()
+
+
+async def _fetch_input(path: Path):
+    """Makes a stage's input file available locally, from the stage_files table if it was written on another dyno."""
+    if not await asyncio.to_thread(_db_call, stage_files.fetch, path):
+        raise job_queue.PermanentJobError(f"File not found: {path}")
+
+
+def enqueue_extraction(db: Session, pdf_path: Path, pipeline: bool = False) -> Dict[str, Any]:
+    """Stores the PDF for the workers and queues its extraction job; with pipeline, it chains into the later stages."""
+    stage_files.save(db, pdf_path)
+    payload = {"pdf_path": str(pdf_path), "pipeline": True} if pipeline else {"pdf_path": str(pdf_path)}
+    return job_queue.enqueue(db, EXTRACT_JOB, pdf_path.name, payload, max_attempts=PDF_JOB_MAX_ATTEMPTS)
+
+
+def submit_uploads() -> List[Dict[str, Any]]:
+    """Queues a pipeline run (its extraction job) for every PDF in the uploads directory. Active runs are returned as they are."""
+    db = SessionLocal()
+    try:
+        return [enqueue_extraction(db, pdf_path, pipeline=True) for pdf_path in sorted(UPLOADS_DIR.glob("*.pdf"))]
+    finally:
+        db.close()
+
+
+def status(limit: int = 200) -> Dict[str, Any]:
+    """Single view of the weekly refresh: job counts per stage and status, plus the most recent stage jobs."""
+    db = SessionLocal()
+    try:
+        return {
+            "by_stage": job_queue.counts(db, STAGES),
+            "jobs": job_queue.list_jobs(db, STAGES, limit=limit),
+        }
+    finally:
+        db.close()
+
+
+def _enqueue_next(stage: str, job: Dict[str, Any], artifact: Any, **payload):
+    """Chains a pipeline run to the ad's next stage; standalone jobs stop here."""
+    if not job["payload"].get("pipeline") or stage not in NEXT_STAGE:
+        return
+    db = SessionLocal()
+    try:
+        payload = dict(job["payload"], **payload)
+        payload["stage_seconds"] = dict(job["payload"].get("stage_seconds", {}), **{stage: artifact["seconds"]})
+        job_queue.enqueue(db, NEXT_STAGE[stage], job["key"], payload)
+    finally:
+        db.close()
+
+
+async def run_extract(job: Dict[str, Any], progress: Progress) -> Dict[str, Any]:
+    started = time.perf_counter()
+    pdf_path = Path(job["payload"]["pdf_path"])
+    await _fetch_input(pdf_path)
+    processor = _get_processor()
+    if not processor.provider.can_generate():
+        raise StageError("Gemini model not initialized.")
+
+    # Gemini API errors propagate: the job queue retries the job with backoff, up to PDF_JOB_MAX_ATTEMPTS
+    result_path = await processor.process_pdf_to_json(pdf_path, final_attempt=job["attempts"] >= job["max_attempts"])
+    if not result_path:
+        raise StageError("Extraction produced no output (see logs).")
+    await asyncio.to_thread(_db_call, stage_files.save, Path(result_path))
+    artifact = {"extraction_path": result_path, "seconds": round(time.perf_counter() - started, 2)}
+    _enqueue_next(EXTRACT_JOB, job, artifact, extraction_path=result_path)
+    return artifact
+
+
+async def run_enhance(job: Dict[str, Any], progress: Progress) -> Dict[str, Any]:
+    started = time.perf_counter()
+    if "extraction_path" not in job["payload"]: # Standalone run over every stored extraction
+        # Enhanced files are fetched too, so extractions enhanced on another dyno are skipped rather than redone
+        await asyncio.to_thread(_db_call, stage_files.fetch_directory, json_enhancement_service.EXTRACTIONS_DIR)
+        await asyncio.to_thread(_db_call, stage_files.fetch_directory, json_enhancement_service.ENHANCED_JSON_DIR)
+        summary = await json_enhancement_service.enhance_all_json_files(progress_callback=progress)
+        if summary.get("error"):
+            raise StageError(summary["error"])
+        saved = await asyncio.to_thread(_db_call, stage_files.save_directory, json_enhancement_service.ENHANCED_JSON_DIR, "*.json")
+        summary["stored_files"] = len(saved)
+        return summary
+
+    extraction_path = Path(job["payload"]["extraction_path"])
+    enhanced_path = json_enhancement_service.enhanced_path_for(extraction_path)
+    await _fetch_input(extraction_path)
+    json_enhancement_service.ENHANCED_JSON_DIR.mkdir(parents=True, exist_ok=True)
+    # Re-enhance only if the extraction changed since the enhanced file was written (here or by an earlier attempt)
+    enhanced = await asyncio.to_thread(_db_call, stage_files.fetch, enhanced_path)
+    if not enhanced or enhanced_path.stat().st_mtime < extraction_path.stat().st_mtime:
+        await json_enhancement_service.enhance_and_save_file(extraction_path, enhanced_path)
+    await asyncio.to_thread(_db_call, stage_files.save, enhanced_path)
+    artifact = {"enhanced_path": str(enhanced_path), "seconds": round(time.perf_counter() - started, 2)}
+    _enqueue_next(ENHANCE_JOB, job, artifact, enhanced_path=str(enhanced_path))
+    return artifact
+
+
+def _load(enhanced_path: Optional[Path]) -> Optional[int]:
+    # Session-level advisory lock on its own connection: the loader's session commits (and may switch
+    # connections) mid-file, which would release a transaction-level lock early
+    with get_engine().connect() as lock_conn:
+        lock_conn.execute(text("SELECT pg_advisory_lock(:lock_id)"), {"lock_id": _LOAD_LOCK_ID})
+        db = SessionLocal()
+        try:
+            if enhanced_path is None:
+                json_to_db_service.process_json_extractions(db)
+                return None
+            return json_to_db_service.process_single_json_file(db, enhanced_path)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:lock_id)"), {"lock_id": _LOAD_LOCK_ID})
+
+
+async def run_load(job: Dict[str, Any], progress: Progress) -> Optional[Dict[str, Any]]:
+    started = time.perf_counter()
+    if "enhanced_path" not in job["payload"]: # Standalone run over every stored enhanced file
+        await asyncio.to_thread(_db_call, stage_files.fetch_directory, json_to_db_service.SOURCE_JSON_DIR)
+        await asyncio.to_thread(_load, None)
+        return None
+
+    enhanced_path = Path(job["payload"]["enhanced_path"])
+    await _fetch_input(enhanced_path)
+    weekly_ad_id = await asyncio.to_thread(_load, enhanced_path)
+    if weekly_ad_id is None:
+        raise StageError(f"{enhanced_path.name} was not loaded (see logs).")
+    if job["payload"].get("pipeline"): # The ad is in the DB: its stage files are no longer needed
+        stage_paths = [Path(job["payload"][name]) for name in ("pdf_path", "extraction_path", "enhanced_path")]
+        await asyncio.to_thread(_db_call, stage_files.delete, stage_paths)
+    artifact = {"weekly_ad_id": weekly_ad_id, "seconds": round(time.perf_counter() - started, 2)}
+    _enqueue_next(LOAD_JOB, job, artifact, weekly_ad_id=weekly_ad_id)
+    return artifact
+
+
+async def run_embed(job: Dict[str, Any], progress: Progress) -> Dict[str, Any]:
+    started = time.perf_counter()
+    weekly_ad_id = job["payload"].get("weekly_ad_id")
+
+    def embed() -> Dict[str, Any]:
+        db = SessionLocal()
+        try:
+            if weekly_ad_id is None: # Standalone run over every current product still missing vectors
+                result = batch_embedding_service.batch_embed_products(db) or {}
+            else:
+                result = {"embedded": batch_embedding_service.embed_products_for_weekly_ad(db, weekly_ad_id)}
+            # Link the new rows to their canonical products and extend the price series
+            result["canonical_products"] = canonical_products.link_canonical_products(db, weekly_ad_id)
+            return result
+        finally:
+            db.close()
+
+    artifact = await asyncio.to_thread(embed)
+    artifact["seconds"] = round(time.perf_counter() - started, 2)
+    return artifact
+
+
+async def run_archive(job: Dict[str, Any], progress: Progress) -> Dict[str, Any]:
+    started = time.perf_counter()
+    try:
+        result = await asyncio.to_thread(_db_call, archive_service.archive_ads, job["payload"].get("limit"))
+    except archive_service.ArchiveUnavailable as e: # Configuration, not a transient failure
+        raise job_queue.PermanentJobError(str(e)) from e
+    result["seconds"] = round(time.perf_counter() - started, 2)
+    return result
+
+
+async def run_link(job: Dict[str, Any], progress: Progress) -> Dict[str, Any]:
+    started = time.perf_counter()
+    result = await asyncio.to_thread(_db_call, canonical_products.link_canonical_products)
+    result["seconds"] = round(time.perf_counter() - started, 2)
+    return result
+
+
+async def run_backfill_pricing(job: Dict[str, Any], progress: Progress) -> Dict[str, Any]:
+    started = time.perf_counter()
+    updated = await asyncio.to_thread(_db_call, json_to_db_service.backfill_product_pricing)
+    return {"updated": updated, "seconds": round(time.perf_counter() - started, 2)}
+
+
+# Job kind -> handler, run by app.worker
+HANDLERS: Dict[str, Callable[[Dict[str, Any], Progress], Awaitable[Any]]] = {
+    EXTRACT_JOB: run_extract,
+    ENHANCE_JOB: run_enhance,
+    LOAD_JOB: run_load,
+    EMBED_JOB: run_embed,
+    ARCHIVE_JOB: run_archive,
+    LINK_JOB: run_link,
+    BACKFILL_PRICING_JOB: run_backfill_pricing,
+}
@@ -0,0 +1,279 @@
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+'''
+Durable job queue in the Postgres jobs table, shared by the web process (which only enqueues) and any number of
+worker processes (python -m app.worker, the Procfile's worker type) that run the jobs.
+- Workers claim the oldest due job with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers never block on
+  or double-claim a row, and ingestion throughput scales by adding worker processes.
+- One active (queued or running) job per (kind, key): enqueuing the same work item again returns the active job.
+- Failed attempts are re-queued with jittered exponential backoff (run_after) until max_attempts, then marked failed.
+  Only failures the worker classifies as transient are retried (see ingestion_pipeline.is_retryable).
+- Running jobs carry the worker's heartbeat (locked_at). Jobs whose worker stopped heartbeating (crash, killed
+  dyno) are re-queued by requeue_stale, which every worker runs at startup and then periodically. A starting
+  worker also re-queues at once the jobs of earlier processes on its own host that are no longer alive
+  (requeue_worker), instead of waiting for their heartbeat to go stale.
+- Finished (succeeded or failed) jobs are deleted after JOB_RETENTION_DAYS by prune.
+- Handlers raise PermanentJobError for failures a retry cannot fix; those fail the job without retrying.
+'''
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "30"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "1800"))
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", "30"))
+
+
+class PermanentJobError(Exception):
+    """A job failure that retrying cannot fix (e.g. its input is gone); the worker fails the job at once."""
+
+_JOB_COLUMNS = "id, kind, key, status, payload, result, error, attempts, max_attempts, run_after, locked_by, locked_at, created_at, updated_at"
+
+_ENQUEUE_SQL = text(f"""
+    INSERT INTO jobs (kind, key, payload, max_attempts, run_after)
+    VALUES (:kind, :key, CAST(:payload AS jsonb), :max_attempts, now() + make_interval(secs => :delay))
+    ON CONFLICT (kind, key) WHERE status IN ('queued', 'running') DO NOTHING
+    RETURNING {_JOB_COLUMNS}
+""")
+
+_ACTIVE_SQL = text(f"""
+    SELECT {_JOB_COLUMNS} FROM jobs
+    WHERE kind = :kind AND key = :key AND status IN ('queued', 'running')
+""")
+
+# The inner SELECT skips rows other workers have locked, so each worker takes a different job without waiting
+_CLAIM_SQL = text(f"""
+    UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_by = :worker_id,
+                    locked_at = now(), updated_at = now()
+    WHERE id = (
+        SELECT id FROM jobs
+        WHERE status = 'queued' AND run_after <= now() AND (CAST(:kinds AS text[]) IS NULL OR kind = ANY(CAST(:kinds AS text[])))
+        ORDER BY run_after, id
+        FOR UPDATE SKIP LOCKED
+        LIMIT 1
+    )
+    RETURNING {_JOB_COLUMNS}
+""")
+
+_COMPLETE_SQL = text("""
+    UPDATE jobs SET status = 'succeeded', result = CAST(:result AS jsonb), error = NULL,
+                    locked_by = NULL, locked_at = NULL, updated_at = now()
+    WHERE id = :job_id AND locked_by = :worker_id
+""")
+
+# Retries wait base * 2^(attempts - 1) seconds scaled by a random factor in [0.5, 1.5), capped; the last attempt
+# (or retry=false) fails the job. The jitter spreads out jobs that failed together (e.g. a rate limit), which
+# would otherwise all be due again at the same instant
+_FAIL_SQL = text("""
+    UPDATE jobs SET
+        status = CASE WHEN :retry AND attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+        run_after = CASE WHEN :retry AND attempts < max_attempts
+                         THEN now() + make_interval(secs => least(:max_delay, :base_delay * power(2, attempts - 1) * (0.5 + random())))
+                         ELSE run_after END,
+        error = :error, locked_by = NULL, locked_at = NULL, updated_at = now()
+    WHERE id = :job_id AND locked_by = :worker_id
+    RETURNING status
+""")
+
+# Hands a job back without using up an attempt (worker shutting down mid-job)
+_RELEASE_SQL = text("""
+    UPDATE jobs SET status = 'queued', attempts = greatest(attempts - 1, 0), run_after = now(),
+                    locked_by = NULL, locked_at = NULL, updated_at = now()
+    WHERE id = :job_id AND locked_by = :worker_id
+""")
+
+_HEARTBEAT_SQL = text("""
+    UPDATE jobs SET locked_at = now() WHERE id = ANY(CAST(:job_ids AS bigint[])) AND locked_by = :worker_id
+""")
+
+_PROGRESS_SQL = text("""
+    UPDATE jobs SET result = CAST(:result AS jsonb), locked_at = now(), updated_at = now()
+    WHERE id = :job_id AND locked_by = :worker_id
+""")
+
+_REQUEUE_STALE_SQL = text("""
+    UPDATE jobs SET
+        status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+        run_after = now(),
+        error = 'Worker ' || coalesce(locked_by, '?') || ' stopped responding.',
+        locked_by = NULL, locked_at = NULL, updated_at = now()
+    WHERE status = 'running' AND locked_at < now() - make_interval(secs => :stale_seconds)
+    RETURNING id, kind, key, status
+""")
+
+_REQUEUE_WORKER_SQL = text("""
+    UPDATE jobs SET
+        status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+        run_after = now(),
+        error = 'Worker ' || locked_by || ' exited while running the job.',
+        locked_by = NULL, locked_at = NULL, updated_at = now()
+    WHERE status = 'running' AND locked_by = :worker_id
+    RETURNING id, kind, key, status
+""")
+
+_RUNNING_WORKERS_SQL = text("""
+    SELECT DISTINCT locked_by FROM jobs WHERE status = 'running' AND locked_by LIKE :prefix
+""")
+
+_PRUNE_SQL = text("""
+    DELETE FROM jobs
+    WHERE status IN ('succeeded', 'failed') AND updated_at < now() - make_interval(secs => :older_than_seconds)
+""")
+
+_LIST_SQL = text(f"""
+    SELECT {_JOB_COLUMNS} FROM jobs
+    WHERE (CAST(:kinds AS text[]) IS NULL OR kind = ANY(CAST(:kinds AS text[])))
+      AND (CAST(:status AS text) IS NULL OR status = :status)
+    ORDER BY created_at DESC, id DESC
+    LIMIT :limit
+""")
+
+_COUNTS_SQL = text("""
+    SELECT kind, status, count(*) AS jobs FROM jobs
+    WHERE CAST(:kinds AS text[]) IS NULL OR kind = ANY(CAST(:kinds AS text[]))
+    GROUP BY kind, status
+""")
+
+
+# Status of the latest job per key: what happened to each work item (e.g. each PDF), not to each attempt
+_KEY_STATUS_COUNTS_SQL = text("""
+    SELECT status, count(*) AS keys FROM (
+        SELECT DISTINCT ON (key) status FROM jobs WHERE kind = :kind ORDER BY key, id DESC
+    ) latest
+    GROUP BY status
+""")
+
+
+def _job(row) -> Optional[Dict[str, Any]]:
+    return dict(row._mapping) if row is not None else None
+
+
+def _kinds(kinds: Optional[Sequence[str]]) -> Optional[List[str]]:
+    return list(kinds) if kinds else None
+
+
+def enqueue(
+    db: Session,
+    kind: str,
+    key: str,
+    payload: Optional[Dict[str, Any]] = None,
+    max_attempts: int = JOB_MAX_ATTEMPTS,
+    delay_seconds: float = 0
+) -> Dict[str, Any]:
+    """Queues a job and commits. Returns the active job for (kind, key) instead when one is already queued or running."""
+    job = _job(db.execute(_ENQUEUE_SQL, {
+        "kind": kind, "key": key, "payload": json.dumps(payload or {}, default=str),
+        "max_attempts": max_attempts, "delay": delay_seconds,
+    }).first())
+    if job is None:
+        job = _job(db.execute(_ACTIVE_SQL, {"kind": kind, "key": key}).first())
+    db.commit()
+    if job is None: # The active job finished between the insert and the lookup
+        return enqueue(db, kind, key, payload, max_attempts, delay_seconds)
+    return job
+
+
+def claim(db: Session, worker_id: str, kinds: Optional[Sequence[str]] = None) -> Optional[Dict[str, Any]]:
+    """Marks the oldest due queued job (of `kinds`, if given) as running for this worker and returns it, or None."""
+    job = _job(db.execute(_CLAIM_SQL, {"worker_id": worker_id, "kinds": _kinds(kinds)}).first())
+    db.commit()
+    return job
+
+
+def complete(db: Session, job_id: int, worker_id: str, result: Any = None) -> None:
+    db.execute(_COMPLETE_SQL, {"job_id": job_id, "worker_id": worker_id, "result": json.dumps(result, default=str)})
+    db.commit()
+
+
+def fail(db: Session, job_id: int, worker_id: str, error: str, retry: bool = True) -> Optional[str]:
+    """Records a failed attempt. Returns the job's new status: 'queued' (will be retried) or 'failed'."""
+    row = db.execute(_FAIL_SQL, {
+        "job_id": job_id, "worker_id": worker_id, "error": error[:4000], "retry": retry,
+        "base_delay": JOB_RETRY_BASE_SECONDS, "max_delay": JOB_RETRY_MAX_SECONDS,
+    }).first()
+    db.commit()
+    return row.status if row else None
+
+
+def release(db: Session, job_id: int, worker_id: str) -> None:
+    db.execute(_RELEASE_SQL, {"job_id": job_id, "worker_id": worker_id})
+    db.commit()
+
+
+def heartbeat(db: Session, worker_id: str, job_ids: Sequence[int]) -> None:
+    if job_ids:
+        db.execute(_HEARTBEAT_SQL, {"worker_id": worker_id, "job_ids": list(job_ids)})
+        db.commit()
+
+
+def set_progress(db: Session, job_id: int, worker_id: str, result: Any) -> None:
+    """Stores intermediate results of a running job (shown by GET /jobs/{id})."""
+    db.execute(_PROGRESS_SQL, {"job_id": job_id, "worker_id": worker_id, "result": json.dumps(result, default=str)})
+    db.commit()
+
+
+def requeue_stale(db: Session, stale_seconds: float) -> List[Dict[str, Any]]:
+    """Re-queues (or fails, when out of attempts) running jobs whose worker has not heartbeated for stale_seconds."""
+    jobs = [_job(row) for row in db.execute(_REQUEUE_STALE_SQL, {"stale_seconds": stale_seconds})]
+    db.commit()
+    for job in jobs:
+        logger.warning(f"Job {job['id']} ({job['kind']} {job['key']}) lost its worker; now {job['status']}.")
+    return jobs
+
+
+def running_workers(db: Session, host: str) -> List[str]:
+    """Ids of the workers on `host` that hold running jobs."""
+    prefix = host.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + ":%"
+    return [row.locked_by for row in db.execute(_RUNNING_WORKERS_SQL, {"prefix": prefix})]
+
+
+def requeue_worker(db: Session, worker_id: str) -> List[Dict[str, Any]]:
+    """Re-queues (or fails, when out of attempts) the running jobs of a worker known to have exited."""
+    jobs = [_job(row) for row in db.execute(_REQUEUE_WORKER_SQL, {"worker_id": worker_id})]
+    db.commit()
+    for job in jobs:
+        logger.warning(f"Job {job['id']} ({job['kind']} {job['key']}) was interrupted by its worker exiting; now {job['status']}.")
+    return jobs
+
+
+def prune(db: Session, older_than_days: float = JOB_RETENTION_DAYS) -> int:
+    """Deletes succeeded and failed jobs last updated more than older_than_days ago. Returns the number deleted."""
+    deleted = db.execute(_PRUNE_SQL, {"older_than_seconds": older_than_days * 86400}).rowcount
+    db.commit()
+    if deleted:
+        logger.info(f"Pruned {deleted} finished jobs older than {older_than_days:g} days.")
+    return deleted
+
+
+def get(db: Session, job_id: int) -> Optional[Dict[str, Any]]:
+    return _job(db.execute(text(f"SELECT {_JOB_COLUMNS} FROM jobs WHERE id = :job_id"), {"job_id": job_id}).first())
+
+
+def list_jobs(db: Session, kinds: Optional[Sequence[str]] = None, status: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+    """Most recent jobs first."""
+    return [_job(row) for row in db.execute(_LIST_SQL, {"kinds": _kinds(kinds), "status": status, "limit": limit})]
+
+
+def counts(db: Session, kinds: Optional[Sequence[str]] = None) -> Dict[str, Dict[str, int]]:
+    """{kind: {status: jobs}}"""
+    result: Dict[str, Dict[str, int]] = {}
+    for row in db.execute(_COUNTS_SQL, {"kinds": _kinds(kinds)}):
+        result.setdefault(row.kind, {})[row.status] = row.jobs
+    return result
+
+
+def key_status_counts(db: Session, kind: str) -> Dict[str, int]:
+    """{status: keys} by the status of each key's latest `kind` job."""
+    return {row.status: row.keys for row in db.execute(_KEY_STATUS_COUNTS_SQL, {"kind": kind})}
@@ -1,324 +1,318 @@
-import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions # type: ignore
 import os
 import json
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Callable, Dict, Any, Optional, List
 from ..schemas.pdf_schema import ExtractedPDFData, PDFProduct
+from ..utils.utils import retry_async
+from ..utils.metrics import record_tokens
+from .gen_terms_cache import GenTermsCache, fingerprint
+from .model_providers import get_provider
+from .model_clients import model_clients
+import hashlib
 import logging
 import asyncio
 import aiofiles
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
-# Load API key and model name from environment variables
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-MODEL_NAME = os.getenv("GEMINI_MODEL", 'gemini-pro')  # Default to 'gemini-pro' if not set
-
-if not GEMINI_API_KEY:
-    logging.warning("GEMINI_API_KEY environment variable not found. LLM calls will fail.")
-else:
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        logging.info(f"Gemini API configured successfully. Using model: {MODEL_NAME}")
-    except Exception as e:
-        logging.error(f"Error configuring Gemini API: {e}. LLM calls will likely fail.")
 
 # Define paths relative to this file's location
 SERVICE_FILE_DIR = Path(__file__).resolve().parent
 EXTRACTIONS_DIR = SERVICE_FILE_DIR.parent.parent / "pdf" / "extractions"
 ENHANCED_JSON_DIR = SERVICE_FILE_DIR.parent.parent / "pdf" / "enhanced_json"
 
+
+def enhanced_path_for(extraction_path: Path) -> Path:
+    """Where the enhanced version of an extraction file is written."""
+    return ENHANCED_JSON_DIR / f"{extraction_path.stem}-enhanced{extraction_path.suffix}"
+
+ENHANCEMENT_BATCH_SIZE = int(os.getenv("ENHANCEMENT_BATCH_SIZE", "40"))  # Products per LLM call
+ENHANCEMENT_BATCH_CONCURRENCY = int(os.getenv("ENHANCEMENT_BATCH_CONCURRENCY", "3"))  # Concurrent LLM calls per file
+ENHANCEMENT_BATCH_MAX_ATTEMPTS = int(os.getenv("ENHANCEMENT_BATCH_MAX_ATTEMPTS", "3"))
+ENHANCE_MAX_CONCURRENT_FILES = int(os.getenv("ENHANCE_MAX_CONCURRENT_FILES", "3"))  # Files enhanced at once
+ENHANCE_FILE_MAX_ATTEMPTS = int(os.getenv("ENHANCE_FILE_MAX_ATTEMPTS", "2"))
+ENHANCE_FILE_BACKOFF_BASE_SECONDS = float(os.getenv("ENHANCE_FILE_BACKOFF_BASE_SECONDS", "10"))
+
+ENHANCEMENT_INSTRUCTIONS = [
+    "You are an AI assistant that enhances grocery product data.",
+    "You receive a JSON array of products. Each item has an index 'i', a 'name', a 'category', 'promo' (promotion details) and an 'emoji'.",
+    "For EVERY item, return an object with the same 'i', a 'gen_terms' string and an 'emoji'.",
+    "'gen_terms' is a comma-separated string of 5-10 relevant keywords, concepts, or related terms based on the product's information.",
+    "Don't reuse words from the existing attributes",
+    "For food generally considered healthy (produce/fruits/meats/dairy), add 'healthy' to the attribute.",
+    "For food generally considered high in protein (meats/fish/eggs/nuts/beans), add 'high protein' to the attribute.",
+    "For food generally considered ethnic (e.g., Hispanic, Asian, Italian, Indian, Middle Eastern), add 'ethnic' and the relevant region/cuisine (e.g., 'hispanic', 'asian', 'italian') to the attribute.",
+    "For food generally considered gluten-free/vegan/vegetarian, add the relevant term to the attribute.",
+    "Return the item's emoji unchanged, unless it is a ? or 🫐 or some other non-emoji character: then find a suitable emoji, if none are suitable, use a 🛒 emoji.",
+    "Respond ONLY with the JSON array of result objects, one per input item.",
+]
+
+
+# Cross-week cache of generated terms, invalidated whenever the enhancement instructions change
+ENHANCEMENT_PROMPT_VERSION = hashlib.sha256("\n".join(ENHANCEMENT_INSTRUCTIONS).encode('utf-8')).hexdigest()[:16]
+gen_terms_cache = GenTermsCache(ENHANCEMENT_PROMPT_VERSION)
+
+
+def _compact_products(products: List[PDFProduct]) -> List[Dict[str, Any]]:
+    """The only product fields the LLM needs to generate terms, keyed by position in the file."""
+    return [
+        {"i": idx, "name": p.name, "category": p.category, "promo": p.promotion_details, "emoji": p.emoji}
+        for idx, p in enumerate(products)
+    ]
+
+
+def _build_enhancement_prompt(batch: List[Dict[str, Any]]) -> str:
+    prompt_parts = ENHANCEMENT_INSTRUCTIONS + [
+        "Here is an example input:",
+        EXAMPLE_INPUT_JSON,
+        "Here is an example output:",
+        EXAMPLE_OUTPUT_JSON,
+        "---------------------------------",
+        "Here are the REAL products to process:",
+        json.dumps(batch, ensure_ascii=False),
+    ]
+    return "\n".join(prompt_parts)
+
+
+def _parse_enhancement_response(response, expected_indexes: set) -> Dict[int, Dict[str, Any]]:
+    """
+    Parses the LLM's JSON array into {index: {"gen_terms", "emoji"}}.
+    Raises ValueError on malformed output, so the batch can be retried.
+    """
+    if not response.parts:
+        raise ValueError(f"No content generated. Prompt feedback: {getattr(response, 'prompt_feedback', None)}")
+    llm_output = "".join(part.text for part in response.parts).strip()
+    llm_output = llm_output.removeprefix("```json").removesuffix("```").strip()
+    items = json.loads(llm_output)
+    if not isinstance(items, list):
+        raise ValueError("Expected a JSON array of results.")
+    results = {}
+    for item in items:
+        if isinstance(item, dict) and item.get("i") in expected_indexes and item.get("gen_terms"):
+            results[item["i"]] = {"gen_terms": str(item["gen_terms"]), "emoji": item.get("emoji")}
+    if not results:
+        raise ValueError("No usable results in LLM output.")
+    return results
+
+
+async def _enhance_batch(batch: List[Dict[str, Any]], label: str) -> tuple[Dict[int, Dict[str, Any]], int]:
+    """Sends one batch of compact products to the LLM. Returns (results by index, total tokens used)."""
+    response = await model_clients.generate_async("json_enhancement", _build_enhancement_prompt(batch), json_output=True)
+    tokens = 0
+    if getattr(response, "usage_metadata", None):
+        record_tokens("json_enhancement", response.usage_metadata)
+        tokens = response.usage_metadata.total_token_count
+    results = _parse_enhancement_response(response, {item["i"] for item in batch})
+    logger.debug(f"{label}: {len(results)}/{len(batch)} products enhanced ({tokens} tokens).")
+    return results, tokens
+
+
 async def process_single_json_file_for_enhancement(filepath: Path) -> Optional[ExtractedPDFData]:
     """
-    Reads a JSON file, sends its entire content to the LLM for enhancement (adding 'gen_terms'),
-    and returns the enhanced ExtractedPDFData object if successful.
+    Reads an extraction JSON file and adds 'gen_terms' (and fixes emojis) for its products.
+    Products already in the cross-week gen_terms cache are filled in locally; only cache misses are sent
+    to the LLM, as compact (index, name, category, promotion_details, emoji) tuples in batches
+    of ENHANCEMENT_BATCH_SIZE that retry independently; results are merged back into the ExtractedPDFData locally.
+    Returns the enhanced ExtractedPDFData, or None if no batch could be enhanced.
     """
-    if not GEMINI_API_KEY:
-        logging.error("Gemini API key not configured. Cannot enhance file.")
-        return None
-    
-    try:
-        model = genai.GenerativeModel(MODEL_NAME)
-    except Exception as e:
-        logging.error(f"Failed to initialize GenerativeModel ('{MODEL_NAME}'): {e}. Cannot enhance file {filepath.name}")
+    provider = get_provider()
+    if not provider.can_generate():
+        logger.error("LLM provider not configured. Cannot enhance file.")
         return None
 
     try:
         async with aiofiles.open(filepath, 'r', encoding='utf-8') as f:
             raw_json_content = await f.read()
-            
-        prompt_parts = [
-            "You are an AI assistant that enhances JSON data for grocery products.",
-            "Your task is to add a new attribute called 'gen_terms' to each product object within the 'products' array in the provided JSON data.",
-            "The 'gen_terms' attribute should contain a comma-separated string of 5-10 relevant keywords, concepts, or related terms based on the product's existing information (e.g., name, category, promotional details).",
-            
-            "Don't reuse words from the existing attributes",
-            "For food generally considered healthy (produce/fruits/meats/dairy), add 'healthy' to the attribute.",
-            "For food generally considered high in protein (meats/fish/eggs/nuts/beans), add 'high protein' to the attribute.",
-            "For food generally considered ethnic (e.g., Hispanic, Asian, Italian, Indian, Middle Eastern), add 'ethnic' and the relevant region/cuisine (e.g., 'hispanic', 'asian', 'italian') to the attribute.",
-            "For food generally considered gluten-free/vegan/vegetarian, add the relevant term to the attribute.",
-            "If the emoji field is a ? or 🫐 or some other non-emoji character, find a suitable emoji, if none are suitable, replace it with a 🛒 emoji.",
-            
-            "IMPORTANT: All other parts of the JSON structure and data MUST remain unchanged. Treat the input JSON as immutable except for the addition of the 'gen_terms' attribute to each product.",
-            "Ensure the output is identical to the input JSON except for the addition of the 'gen_terms' attribute to each product.",
-            "Here is an example input JSON:",
-            "```json",
-            EXAMPLE_INPUT_JSON,
-            "```",
-            "Here is an example output JSON:",
-            "```json",
-            EXAMPLE_OUTPUT_JSON,
-            "```",
-            "---------------------------------",
-            "Here is the REAL JSON data to process:",
-            "```json",
-            raw_json_content,
-            "```",
-            "Please return the complete, modified JSON data with the 'gen_terms' added to each product."
-        ]
-        prompt = "\\n".join(prompt_parts)
-        # logging.info(f"------------------ Prompt-----------:\n{prompt}")
-        logging.info(f"Sending content of {filepath.name} to Gemini ('{MODEL_NAME}') for enhancement.")
-        
-        response = await model.generate_content_async(prompt)
-
-        if response.parts:
-            llm_output_json_string = "".join(part.text for part in response.parts).strip()
-            
-            # The LLM might return the JSON string within a code block (e.g., ```json ... ```)
-            # We need to strip that if present.
-            if llm_output_json_string.startswith("```json"):
-                llm_output_json_string = llm_output_json_string[len("```json"):].strip()
-            if llm_output_json_string.endswith("```"):
-                llm_output_json_string = llm_output_json_string[:-len("```")].strip()
-            
-            # logging.info(f"--- LLM Raw Output for {filepath.name} ---") # Log the raw LLM output
-            # logging.info(llm_output_json_string)
-            # logging.info("--- End of LLM Raw Output ---")
-            
-            logging.debug(f"Raw LLM JSON output for {filepath.name}:\\n{llm_output_json_string}")
-
-            try:
-                enhanced_json_data = json.loads(llm_output_json_string)
-                # Validate with Pydantic schema
-                validated_enhanced_data = ExtractedPDFData(**enhanced_json_data)
-                logging.info(f"Successfully parsed and validated LLM response for {filepath.name}.")
-                return validated_enhanced_data
-            except json.JSONDecodeError as je:
-                logging.error(f"Failed to decode JSON from LLM response for {filepath.name}: {je}")
-                logging.error(f"LLM Output that failed to parse: {llm_output_json_string}")
-                raise
-            except Exception as e: # Catch Pydantic validation errors or other issues
-                logging.error(f"Failed to validate or process LLM JSON response for {filepath.name}: {e}")
-                logging.error(f"LLM Output that failed validation: {llm_output_json_string}")
-                raise
-        else:
-            logging.warning(f"No content (parts) generated by LLM for file '{filepath.name}'. Response: {response}")
-            if hasattr(response, 'prompt_feedback') and response.prompt_feedback:
-                logging.warning(f"Prompt feedback for '{filepath.name}': {response.prompt_feedback}")
-            return None
-
+        extracted_data = ExtractedPDFData.model_validate_json(raw_json_content)
     except FileNotFoundError as e:
-        logging.error(f"File not found: {filepath}. Error: {e}")
+        logger.error(f"File not found: {filepath}. Error: {e}")
         raise
     except Exception as e:
-        logging.error(f"An unexpected error occurred while processing file {filepath}: {e}")
+        logger.error(f"Failed to read or validate extraction file {filepath.name}: {e}")
         raise
 
-async def enhance_all_json_files():
+    merged: Dict[int, Dict[str, Any]] = {}
+    fingerprints = [fingerprint(p.name, p.category, p.promotion_details) for p in extracted_data.products]
+    cached = await asyncio.to_thread(gen_terms_cache.get_many, fingerprints)
+    for idx, key in enumerate(fingerprints):
+        if key in cached:
+            merged[idx] = cached[key]
+
+    compact = [item for item in _compact_products(extracted_data.products) if item["i"] not in merged]
+    batches = [compact[i:i + ENHANCEMENT_BATCH_SIZE] for i in range(0, len(compact), ENHANCEMENT_BATCH_SIZE)]
+    batch_limit = asyncio.Semaphore(ENHANCEMENT_BATCH_CONCURRENCY)
+    logger.info(f"{filepath.name}: {len(merged)} products from gen_terms cache, "
+                 f"enhancing {len(compact)} in {len(batches)} batches with the '{provider.name}' provider.")
+
+    async def run_batch(batch_number: int, batch: List[Dict[str, Any]]):
+        label = f"{filepath.name} batch {batch_number}/{len(batches)}"
+        async with batch_limit:
+            try:
+                return await retry_async(
+                    _enhance_batch, batch, label,
+                    retry_on=(google_exceptions.GoogleAPIError, ValueError),
+                    max_attempts=ENHANCEMENT_BATCH_MAX_ATTEMPTS,
+                    on_retry=lambda attempt, e, delay: logger.warning(f"{label} failed (attempt {attempt}): {e}. Retrying in {delay:.1f}s."),
+                )
+            except Exception as e:
+                logger.error(f"{label} failed after {ENHANCEMENT_BATCH_MAX_ATTEMPTS} attempts: {e}")
+                return None
+
+    batch_results = await asyncio.gather(*(run_batch(n, batch) for n, batch in enumerate(batches, start=1)))
+
+    total_tokens = 0
+    generated_entries: Dict[str, Dict[str, Optional[str]]] = {}
+    for result in batch_results:
+        if result:
+            results, tokens = result
+            merged.update(results)
+            total_tokens += tokens
+            for idx, generated in results.items():
+                generated_entries[fingerprints[idx]] = {"gen_terms": generated["gen_terms"], "emoji": generated["emoji"]}
+    await asyncio.to_thread(gen_terms_cache.put_many, generated_entries)
+    if not merged:
+        logger.warning(f"No batches could be enhanced for file '{filepath.name}'.")
+        return None
+
+    enhanced_products = []
+    for idx, product in enumerate(extracted_data.products):
+        result = merged.get(idx)
+        if result:
+            product = product.model_copy(update={
+                "gen_terms": result["gen_terms"],
+                "emoji": result["emoji"] or product.emoji,
+            })
+        enhanced_products.append(product)
+
+    missing = len(enhanced_products) - len(merged)
+    logger.info(f"Enhanced {len(merged)}/{len(enhanced_products)} products in {filepath.name} ({total_tokens} tokens)."
+                 + (f" {missing} products left without gen_terms." if missing else ""))
+    return extracted_data.model_copy(update={"products": enhanced_products})
+
+async def enhance_and_save_file(filepath: Path, output_filepath: Path):
+    """
+    Enhances one file (retrying the whole file with backoff if no batch succeeded or the API fails)
+    and writes it straight away, via a temp file so a crash never leaves a partial enhanced file.
+    """
+    async def attempt() -> ExtractedPDFData:
+        result = await process_single_json_file_for_enhancement(filepath)
+        if result is None:
+            raise RuntimeError(f"No products could be enhanced in {filepath.name}.")
+        return result
+
+    enhanced_data_model = await retry_async(
+        attempt,
+        retry_on=(RuntimeError, google_exceptions.GoogleAPIError),
+        max_attempts=ENHANCE_FILE_MAX_ATTEMPTS,
+        base_delay=ENHANCE_FILE_BACKOFF_BASE_SECONDS,
+        on_retry=lambda n, e, delay: logger.warning(f"Enhancing {filepath.name} failed (attempt {n}): {e}. Retrying in {delay:.1f}s."),
+    )
+    tmp_filepath = output_filepath.with_suffix(".tmp")
+    async with aiofiles.open(tmp_filepath, 'w', encoding='utf-8') as f:
+        await f.write(enhanced_data_model.model_dump_json(indent=2))
+    os.replace(tmp_filepath, output_filepath)
+
+
+async def enhance_all_json_files(progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
     """
     Iterates through all JSON files in the extractions directory,
-    enhances them by asking the LLM to add generated terms to the whole JSON content,
+    enhances them by asking the LLM to generate terms for their products in compact batches,
     and saves them to the enhanced_json directory asynchronously.
+    At most ENHANCE_MAX_CONCURRENT_FILES files are in flight, and each file is written as soon as it
+    is enhanced, so memory stays flat and finished files survive a crash.
+    progress_callback, if given, receives the summary dict after every finished file.
+    Returns the run summary.
     """
-    if not GEMINI_API_KEY:
-        logging.error("GEMINI_API_KEY not configured. Halting enhancement process.")
-        return
+    summary: Dict[str, Any] = {"total_files": 0, "skipped": 0, "to_process": 0, "processed": 0, "failed": 0, "failed_files": []}
+    if not get_provider().can_generate():
+        logger.error("LLM provider not configured. Halting enhancement process.")
+        summary["error"] = "LLM provider not configured."
+        return summary
 
     ENHANCED_JSON_DIR.mkdir(parents=True, exist_ok=True)
-
-    processed_files_count = 0
-    failed_files_count = 0
+    cache_hits_at_start, cache_misses_at_start = gen_terms_cache.hits, gen_terms_cache.misses
 
     extraction_files = list(EXTRACTIONS_DIR.glob("*.json"))
+    summary["total_files"] = len(extraction_files)
     if not extraction_files:
-        logging.info(f"No JSON files found in {EXTRACTIONS_DIR}. Nothing to process.")
-        return
+        logger.info(f"No JSON files found in {EXTRACTIONS_DIR}. Nothing to process.")
+        return summary
 
-    logging.info(f"Found {len(extraction_files)} JSON files to process in {EXTRACTIONS_DIR} using model '{MODEL_NAME}'.")
-
-    tasks = []
-    files_to_process_paths = [] # Keep track of files we actually schedule
+    logger.info(f"Found {len(extraction_files)} JSON files to process in {EXTRACTIONS_DIR} using the '{get_provider().name}' provider.")
 
+    files_to_process = []
     for filepath in extraction_files:
-        expected_enhanced_filename = f"{filepath.stem}-enhanced{filepath.suffix}"
-        expected_enhanced_filepath = ENHANCED_JSON_DIR / expected_enhanced_filename
-
+        expected_enhanced_filepath = enhanced_path_for(filepath)
         if expected_enhanced_filepath.exists():
-            logging.info(f"Skipping '{filepath.name}, already exists.")
+            logger.info(f"Skipping '{filepath.name}, already exists.")
+            summary["skipped"] += 1
             continue # Skip to the next file
-        
-        # If not skipped, add to list of files to process and create a task
-        files_to_process_paths.append(filepath) 
-        tasks.append(asyncio.create_task(process_single_json_file_for_enhancement(filepath), name=f"Enhance-{filepath.name}"))
-    
-    if not tasks: # If all files were skipped
-        logging.info("No new files to process as all were found to be already enhanced or no files were in extractions directory.")
-        # The counts (processed_files_count, failed_files_count) will be 0 here as they are initialized before this block.
-        # The final summary outside this block will correctly reflect 0 processed/failed if this path is taken.
-        return # Early exit if no tasks were scheduled
-
-    logging.info(f"Scheduled {len(tasks)} new files for enhancement.")
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-
-    for i, result_or_exc in enumerate(results):
-        # Use the files_to_process_paths list to correctly map results to filepaths
-        # This is important because `results` will only contain results for tasks that were actually run
-        filepath_processed = files_to_process_paths[i] 
-        output_filename = f"{filepath_processed.stem}-enhanced{filepath_processed.suffix}"
-        output_filepath = ENHANCED_JSON_DIR / output_filename
-
-        if isinstance(result_or_exc, ExtractedPDFData):
-            enhanced_data_model = result_or_exc
+        files_to_process.append((filepath, expected_enhanced_filepath))
+    summary["to_process"] = len(files_to_process)
+
+    if not files_to_process: # If all files were skipped
+        logger.info("No new files to process as all were found to be already enhanced or no files were in extractions directory.")
+        return summary
+
+    logger.info(f"Scheduled {len(files_to_process)} new files for enhancement (max {ENHANCE_MAX_CONCURRENT_FILES} at a time).")
+    file_limit = asyncio.Semaphore(ENHANCE_MAX_CONCURRENT_FILES)
+
+    async def run_file(filepath: Path, output_filepath: Path):
+        async with file_limit:
             try:
-                async with aiofiles.open(output_filepath, 'w', encoding='utf-8') as f:
-                    await f.write(enhanced_data_model.model_dump_json(indent=2))
-                logging.info(f"Successfully enhanced and saved: {output_filepath.name}")
-                processed_files_count += 1
+                await enhance_and_save_file(filepath, output_filepath)
+                return filepath, None
             except Exception as e:
-                logging.error(f"Error writing enhanced data for {filepath_processed.name} to {output_filepath}: {e}")
-                failed_files_count += 1
-        elif isinstance(result_or_exc, Exception):
-            logging.warning(f"Failed to process file {filepath_processed.name}. Reason: {result_or_exc}")
-            failed_files_count += 1
+                return filepath, e
+
+    tasks = [asyncio.create_task(run_file(fp, out), name=f"Enhance-{fp.name}") for fp, out in files_to_process]
+    for next_done in asyncio.as_completed(tasks):
+        filepath, error = await next_done
+        if error is None:
+            logger.info(f"Successfully enhanced and saved: {filepath.stem}-enhanced{filepath.suffix}")
+            summary["processed"] += 1
         else:
-            logging.warning(f"File {filepath_processed.name} was not processed successfully (returned None or unexpected type).")
-            failed_files_count += 1
-            
-    logging.info("JSON Enhancement Process Summary:")
-    logging.info(f"Total files found: {len(extraction_files)}")
-    logging.info(f"Successfully processed: {processed_files_count}")
-    logging.info(f"Failed to process: {failed_files_count}")
+            logger.warning(f"Failed to process file {filepath.name}. Reason: {error}")
+            summary["failed"] += 1
+            summary["failed_files"].append(filepath.name)
+        if progress_callback:
+            progress_callback(dict(summary))
+
+    cache_hits = gen_terms_cache.hits - cache_hits_at_start
+    cache_lookups = cache_hits + gen_terms_cache.misses - cache_misses_at_start
+    summary["gen_terms_cache_hits"] = cache_hits
+    summary["gen_terms_cache_lookups"] = cache_lookups
+
+    logger.info("JSON Enhancement Process Summary:")
+    logger.info(f"Total files found: {len(extraction_files)}")
+    logger.info(f"Successfully processed: {summary['processed']}")
+    logger.info(f"Failed to process: {summary['failed']}")
+    if cache_lookups:
+        logger.info(f"gen_terms cache: {cache_hits}/{cache_lookups} products served from cache "
+                     f"({cache_hits / cache_lookups:.0%} hit rate), {await asyncio.to_thread(gen_terms_cache.count)} entries stored.")
+    return summary
+
 
 if __name__ == "__main__":
-    logging.info("Starting JSON enhancement service (async)...")
-    if not GEMINI_API_KEY:
-        logging.warning("Reminder: GEMINI_API_KEY is not set. LLM operations will not work as expected.")
+    logger.info("Starting JSON enhancement service (async)...")
+    if not get_provider().can_generate():
+        logger.warning("Reminder: the LLM provider is not configured. LLM operations will not work as expected.")
     asyncio.run(enhance_all_json_files())
-    logging.info("JSON enhancement service (async) finished.")
-
-EXAMPLE_INPUT_JSON ="""
-{
-  "retailer": "Aldi",
-  "weekly_ad": {
-    "valid_from": "2025-05-21",
-    "valid_to": "2025-05-27",
-    "date_processed": "2025-05-21",
-    "filename": "Aldi-weekly-22.pdf"
-  },
-  "products": [
-    {
-      "name": "Black Angus Patties",
-      "price": 5.49,
-      "retailer": "Aldi",
-      "description": null,
-      "unit": "Pound",
-      "category": "Meats",
-      "promotion_details": "was $5.99",
-      "original_price": 5.99,
-      "promotion_from": null,
-      "promotion_to": null,
-      "is_frontpage": true,
-      "emoji": "🍔"
-    },
-    {
-      "name": "Red Grapes",
-      "price": 1.29,
-      "retailer": "Aldi",
-      "description": null,
-      "unit": "Pound",
-      "category": "Fruits",
-      "promotion_details": "was $1.59",
-      "original_price": 1.59,
-      "promotion_from": null,
-      "promotion_to": null,
-      "is_frontpage": true,
-      "emoji": "🍇"
-    },
-    {
-      "name": "Indoor/Outdoor Rug",
-      "price": 14.99,
-      "retailer": "Aldi",
-      "description": null,
-      "unit": "Each",
-      "category": "Other",
-      "promotion_details": "5' x 7', Reversible",
-      "original_price": null,
-      "promotion_from": null,
-      "promotion_to": null,
-      "is_frontpage": false,
-      "emoji": "🛋️"
-    }
-  ]
-}
+    logger.info("JSON enhancement service (async) finished.")
+
+EXAMPLE_INPUT_JSON = """
+[
+  {"i": 0, "name": "Black Angus Patties", "category": "Meats", "promo": "was $5.99", "emoji": "🍔"},
+  {"i": 1, "name": "Red Grapes", "category": "Fruits", "promo": "was $1.59", "emoji": "🫐"},
+  {"i": 2, "name": "Indoor/Outdoor Rug", "category": "Other", "promo": "5' x 7', Reversible", "emoji": "🛋️"}
+]
 """
 
 EXAMPLE_OUTPUT_JSON = """
-{
-  "retailer": "Aldi",
-  "weekly_ad": {
-    "valid_from": "2025-05-21",
-    "valid_to": "2025-05-27",
-    "date_processed": "2025-05-21",
-    "filename": "Aldi-weekly-22.pdf"
-  },
-  "products": [
-    {
-      "name": "Black Angus Patties",
-      "price": 5.49,
-      "retailer": "Aldi",
-      "description": null,
-      "unit": "Pound",
-      "category": "Meats",
-      "promotion_details": "was $5.99",
-      "original_price": 5.99,
-      "promotion_from": null,
-      "promotion_to": null,
-      "is_frontpage": true,
-      "emoji": "🍔",
-      "gen_terms": "beef, ground beef, burgers, grilling, BBQ, frozen, protein, meat, discounted"
-    },
-    {
-      "name": "Red Grapes",
-      "price": 1.29,
-      "retailer": "Aldi",
-      "description": null,
-      "unit": "Pound",
-      "category": "Fruits",
-      "promotion_details": "was $1.59",
-      "original_price": 1.59,
-      "promotion_from": null,
-      "promotion_to": null,
-      "is_frontpage": true,
-      "emoji": "🍇",
-      "gen_terms": "fruit, produce, fresh, snack, healthy, sweet, summer, berries, discounted"
-    },
-    {
-      "name": "Indoor/Outdoor Rug",
-      "price": 14.99,
-      "retailer": "Aldi",
-      "description": null,
-      "unit": "Each",
-      "category": "Other",
-      "promotion_details": "5' x 7', Reversible",
-      "original_price": null,
-      "promotion_from": null,
-      "promotion_to": null,
-      "is_frontpage": false,
-      "emoji": "🛋️",
-      "gen_terms": "home decor, patio, garden, reversible, flooring, mat, living, furniture, household"
-    }
-  ]
-}
-"""
\ No newline at end of file
+[
+  {"i": 0, "gen_terms": "beef, ground beef, burgers, grilling, BBQ, frozen, high protein, meat, discounted", "emoji": "🍔"},
+  {"i": 1, "gen_terms": "fruit, produce, fresh, snack, healthy, sweet, summer, vegan, discounted", "emoji": "🍇"},
+  {"i": 2, "gen_terms": "home decor, patio, garden, reversible, flooring, mat, living, furniture, household", "emoji": "🛋️"}
+]
+"""
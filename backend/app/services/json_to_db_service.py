@@ -1,33 +1,86 @@
 import json
 # import os
 import logging
+import re
+from sqlalchemy import case
 from sqlalchemy.orm import Session
 from .. import models
 from ..schemas.pdf_schema import ExtractedPDFData
 from pathlib import Path
+from typing import Any, Dict, Optional
+from .catalog_cache import catalog_cache
+from .product_partitions import ad_week, ensure_week_partition
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 SOURCE_JSON_DIR = Path(__file__).resolve().parent.parent.parent / "pdf" / "enhanced_json"
 
 
 def update_ad_periods(db: Session, retailer_id: int):
+    """
+    Rolls the retailer's ads back one period (current -> previous -> archived) in a single UPDATE.
+    Only weekly_ads rows change; products stay in their week partitions. Not committed here, so the
+    rotation and the new current ad become visible together.
+    """
     logger.info(f"Updating ad periods for retailer_id: {retailer_id}")
-    # Previous -> Archived
-    db.query(models.WeeklyAd).filter(
-        models.WeeklyAd.retailer_id == retailer_id,
-        models.WeeklyAd.ad_period == 'previous'
-    ).update({"ad_period": "archived"}, synchronize_session=False)
-
-    # Current -> Previous
     db.query(models.WeeklyAd).filter(
         models.WeeklyAd.retailer_id == retailer_id,
-        models.WeeklyAd.ad_period == 'current'
-    ).update({"ad_period": "previous"}, synchronize_session=False)
-    db.commit()
+        models.WeeklyAd.ad_period.in_(('current', 'previous'))
+    ).update({"ad_period": case(
+        (models.WeeklyAd.ad_period == 'previous', 'archived'),
+        else_='previous'
+    )}, synchronize_session=False)
     logger.info("Ad periods updated.")
 
+# Units normalised to a comparable basis: weights to $/lb, volumes to $/gal, counts to $/each.
+# Pack/Box/Case/Other keep the listed price per package unless the package size can be parsed.
+UNIT_PRICE_FACTORS = {
+    "pound": ("lb", 1.0), "lb": ("lb", 1.0), "ounce": ("lb", 1 / 16), "oz": ("lb", 1 / 16),
+    "kg": ("lb", 2.20462), "gram": ("lb", 0.00220462), "g": ("lb", 0.00220462),
+    "gallon": ("gal", 1.0), "gal": ("gal", 1.0), "quart": ("gal", 0.25), "qt": ("gal", 0.25),
+    "pint": ("gal", 0.125), "pt": ("gal", 0.125), "liter": ("gal", 0.264172), "litre": ("gal", 0.264172),
+    "l": ("gal", 0.264172), "ml": ("gal", 0.000264172), "fl oz": ("gal", 1 / 128),
+    "each": ("each", 1.0), "count": ("each", 1.0), "dozen": ("each", 12.0),
+}
+PACKAGE_UNITS = {"each", "pack", "box", "case", "other"}
+# Package sizes in promotion_details, e.g. "8-oz. Pkg.", "1.5 lb bag", "64 fl oz"
+_PACKAGE_SIZE = re.compile(
+    r"(\d+(?:\.\d+)?)\s*-?\s*(fl\.?\s*oz|oz|ounce|lb|pound|kg|gram|g|ml|liter|litre|l|gallon|gal|quart|qt|pint|pt)s?\b",
+    re.IGNORECASE,
+)
+
+
+def product_pricing_values(
+    price: Optional[float], original_price: Optional[float], unit: Optional[str], promotion_details: Optional[str]
+) -> Dict[str, Any]:
+    """
+    Precomputed sort columns for a product: unit_price in its unit_price_basis ("lb", "gal", "each",
+    or the package unit) and discount_pct against original_price. Values are None when not derivable.
+    """
+    values: Dict[str, Any] = {"unit_price": None, "unit_price_basis": None, "discount_pct": None}
+    if price is None or float(price) <= 0:
+        return values
+    price = float(price)
+    if original_price is not None and float(original_price) > price:
+        values["discount_pct"] = round((float(original_price) - price) / float(original_price) * 100, 2)
+
+    unit_key = (unit or "").strip().lower()
+    match = _PACKAGE_SIZE.search(promotion_details or "") if unit_key in PACKAGE_UNITS else None
+    if match:
+        size_unit = re.sub(r"[.\s]+", " ", match.group(2).lower()).strip()
+        basis, factor = UNIT_PRICE_FACTORS[size_unit]
+        quantity = float(match.group(1)) * factor
+        if quantity > 0:
+            values.update(unit_price=round(price / quantity, 4), unit_price_basis=basis)
+            return values
+    if unit_key in UNIT_PRICE_FACTORS:
+        basis, factor = UNIT_PRICE_FACTORS[unit_key]
+        values.update(unit_price=round(price / factor, 4), unit_price_basis=basis)
+    elif unit_key:
+        values.update(unit_price=price, unit_price_basis=unit_key)
+    return values
+
+
 def validate_emoji(emoji: str) -> str:
     """
     Validates that the emoji is exactly 1 character.
@@ -38,7 +91,11 @@ def validate_emoji(emoji: str) -> str:
     # logger.warning(f"emoji: {emoji}, character count: {len(emoji)}, did not change.")
     # return emoji
 
-def process_single_json_file(db: Session, file_path: Path):
+def process_single_json_file(db: Session, file_path: Path) -> Optional[int]:
+    """
+    Loads one enhanced JSON file into the DB as a new current weekly ad with its products.
+    Returns the weekly ad id (the existing one if this ad was already loaded), or None if the file was skipped.
+    """
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
@@ -46,16 +103,16 @@ def process_single_json_file(db: Session, file_path: Path):
         parsed_data = ExtractedPDFData(**data)
     except json.JSONDecodeError:
         logger.error(f"Invalid JSON in file: {file_path.name}")
-        return
+        return None
     except Exception as e:
         logger.error(f"Error parsing Pydantic model for {file_path.name}: {e}")
-        return
+        return None
 
     # 1. Check for existing weekly ad by filename
     existing_ad = db.query(models.WeeklyAd).filter(models.WeeklyAd.filename == parsed_data.weekly_ad.filename).first()
     if existing_ad:
         logger.info(f"=== Weekly ad '{parsed_data.weekly_ad.filename}' exists. Skipping {file_path.name}.")
-        return
+        return existing_ad.id
 
     logger.info(f"Processing file: {file_path.name}")
     
@@ -65,14 +122,19 @@ def process_single_json_file(db: Session, file_path: Path):
     if not db_retailer:
         logger.error(f"Retailer '{retailer_name}' not found in database. Skipping {file_path.name}.")
         # Future: Consider creating the retailer if it doesn't exist or a different handling strategy.
-        return
+        return None
     
     # logger.info(f"Found retailer: {db_retailer.name} (ID: {db_retailer.id})")
 
-    # 3. Update ad_period for existing ads of this retailer
+    # 3. Make sure the products' week partition exists (normally created ahead by partition maintenance)
+    week = ad_week(parsed_data.weekly_ad.valid_from)
+    db.commit() # Ends this session's read transaction so it holds no locks the partition DDL would wait on
+    ensure_week_partition(week)
+
+    # 4. Update ad_period for existing ads of this retailer
     update_ad_periods(db, db_retailer.id)
 
-    # 4. Create new WeeklyAd
+    # 5. Create new WeeklyAd
     new_weekly_ad = models.WeeklyAd(
         retailer_id=db_retailer.id,
         date_processed=parsed_data.weekly_ad.date_processed,
@@ -83,7 +145,7 @@ def process_single_json_file(db: Session, file_path: Path):
     )
     db.add(new_weekly_ad)
 
-    # 5. Create new Products
+    # 6. Create new Products
     products_to_add = []
     for pdf_product in parsed_data.products:
         # Validate emoji before adding to database
@@ -92,6 +154,7 @@ def process_single_json_file(db: Session, file_path: Path):
         new_product = models.Product(
             weekly_ad=new_weekly_ad,
             retailer_id=db_retailer.id,
+            ad_week=week,
             name=pdf_product.name,
             price=pdf_product.price,
             original_price=pdf_product.original_price,
@@ -103,7 +166,8 @@ def process_single_json_file(db: Session, file_path: Path):
             promotion_to=pdf_product.promotion_to,
             is_frontpage=pdf_product.is_frontpage,
             emoji=validated_emoji,
-            gen_terms=pdf_product.gen_terms
+            gen_terms=pdf_product.gen_terms,
+            **product_pricing_values(pdf_product.price, pdf_product.original_price, pdf_product.unit, pdf_product.promotion_details)
         )
         products_to_add.append(new_product)
     
@@ -112,6 +176,7 @@ def process_single_json_file(db: Session, file_path: Path):
     try:
         db.commit()
         db.refresh(new_weekly_ad)
+        catalog_cache.invalidate()
         logger.info(f"Successfully committed Weekly Ad ID: {new_weekly_ad.id} and {len(products_to_add)} products for retailer {retailer_name} from file {file_path.name}")
     except Exception as e:
         db.rollback()
@@ -119,6 +184,7 @@ def process_single_json_file(db: Session, file_path: Path):
         raise
     
     logger.info(f"Successfully processed {file_path.name}")
+    return new_weekly_ad.id
 
 def process_json_extractions(db: Session):
     logger.info(f"Starting JSON extraction processing from directory: {SOURCE_JSON_DIR}")
@@ -140,3 +206,30 @@ def process_json_extractions(db: Session):
     finally:
         pass # Pass if no other cleanup is needed
 
+
+
+def backfill_product_pricing(db: Session, batch_size: int = 1000) -> int:
+    """Fills unit_price/unit_price_basis/discount_pct for products loaded before they were computed. Returns rows updated."""
+    updated = 0
+    last_id = 0
+    while True:
+        rows = (
+            db.query(models.Product.id, models.Product.ad_week, models.Product.price, models.Product.original_price,
+                     models.Product.unit, models.Product.promotion_details)
+            .filter(models.Product.id > last_id, models.Product.unit_price.is_(None), models.Product.price.isnot(None))
+            .order_by(models.Product.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        db.bulk_update_mappings(models.Product, [
+            {"id": row.id, "ad_week": row.ad_week, **product_pricing_values(row.price, row.original_price, row.unit, row.promotion_details)}
+            for row in rows
+        ])
+        db.commit()
+        updated += len(rows)
+        last_id = rows[-1].id
+    catalog_cache.invalidate()
+    logger.info(f"Backfilled pricing columns for {updated} products.")
+    return updated
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from ..utils.metrics import observe, inc_counter
+from .model_providers import get_provider, get_embedding_provider
+
+logger = logging.getLogger(__name__)
+
+'''
+Process-wide registry through which every service makes its model calls (embeddings, generation, uploads).
+- The providers behind it are long-lived singletons (model_providers.get_provider), so every caller shares the
+  same model objects and underlying transport: connections and TLS sessions are reused across the thousands
+  of calls of a weekly refresh instead of being rebuilt per file or per request.
+- Every call is tagged with a purpose, and each purpose has one concurrency limit for the whole process
+  (MODEL_CONCURRENCY_<PURPOSE>), shared by all callers, e.g. all extraction jobs a worker runs
+  share the pdf_extraction limit. Limits work from sync code, worker threads and any event loop, and hand
+  freed slots to waiters in arrival order.
+- Time spent waiting for a slot and call latency are recorded per purpose in the metrics.
+'''
+
+PURPOSE_LIMIT_DEFAULTS = {
+    "query_expansion": 16,
+    "query_embedding": 16,
+    "embedding": 4,
+    "json_enhancement": 6,
+    "pdf_extraction": int(os.getenv("GEMINI_MAX_CONCURRENT_REQUESTS", "2")),
+    "file_upload": 4,
+}
+DEFAULT_PURPOSE_LIMIT = 4
+
+class _Waiter:
+    """A queued acquirer: a threading.Event for sync callers, a future on its own loop for coroutines."""
+    __slots__ = ("event", "loop", "future", "granted")
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.future = loop.create_future() if loop else None
+        self.event = None if loop else threading.Event()
+        self.granted = False
+
+    def wake(self):
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class PurposeLimit:
+    """
+    Concurrency limit for one purpose. `with` for sync callers, `async with` for coroutines.
+    Shared by threads and event loops alike. Waiters queue in arrival order and a released slot is handed
+    directly to the oldest waiter (no polling), so waits are first-come first-served and end as soon as a slot frees.
+    """
+
+    def __init__(self, purpose: str, limit: int):
+        self.purpose = purpose
+        self.limit = limit
+        self._available = limit
+        self._waiters: Deque[_Waiter] = deque()
+        self._lock = threading.Lock()
+
+    def _record_wait(self, started: float):
+        observe("app_model_slot_wait_seconds", time.perf_counter() - started,
+                help_text="Time spent waiting for a model call slot, by purpose.", purpose=self.purpose)
+
+    def _try_acquire(self, waiter_loop: Optional[asyncio.AbstractEventLoop] = None) -> Optional[_Waiter]:
+        """Takes a free slot (returns None) or queues a waiter and returns it."""
+        with self._lock:
+            if self._available and not self._waiters:
+                self._available -= 1
+                return None
+            waiter = _Waiter(waiter_loop)
+            self._waiters.append(waiter)
+            return waiter
+
+    def _release(self):
+        with self._lock:
+            self._release_locked()
+
+    def _release_locked(self):
+        if self._waiters:
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            waiter.wake()
+        else:
+            self._available += 1
+
+    def __enter__(self):
+        started = time.perf_counter()
+        waiter = self._try_acquire()
+        if waiter:
+            waiter.event.wait()
+        self._record_wait(started)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._release()
+
+    async def __aenter__(self):
+        started = time.perf_counter()
+        waiter = self._try_acquire(asyncio.get_running_loop())
+        if waiter:
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                with self._lock: # Pass on a slot handed over just as we were cancelled, or leave the queue
+                    if waiter.granted:
+                        self._release_locked()
+                    else:
+                        self._waiters.remove(waiter)
+                raise
+        self._record_wait(started)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._release()
+
+
+class ModelClients:
+    def __init__(self):
+        self._limits: Dict[str, PurposeLimit] = {}
+        self._lock = threading.Lock()
+
+    def limit(self, purpose: str) -> PurposeLimit:
+        with self._lock:
+            if purpose not in self._limits:
+                default = PURPOSE_LIMIT_DEFAULTS.get(purpose, DEFAULT_PURPOSE_LIMIT)
+                self._limits[purpose] = PurposeLimit(purpose, int(os.getenv(f"MODEL_CONCURRENCY_{purpose.upper()}", str(default))))
+            return self._limits[purpose]
+
+    def _record_call(self, purpose: str, started: float, ok: bool):
+        observe("app_model_call_duration_seconds", time.perf_counter() - started,
+                help_text="Model call latency, by purpose.", purpose=purpose)
+        inc_counter("app_model_calls_total", 1, "Model calls, by purpose and outcome.", purpose=purpose, outcome="ok" if ok else "error")
+
+    def embed(self, purpose: str, texts: List[str], task_type: str = "RETRIEVAL_DOCUMENT") -> List[Optional[List[float]]]:
+        with self.limit(purpose):
+            started, ok = time.perf_counter(), False
+            try:
+                result = get_embedding_provider().embed(texts, task_type)
+                ok = True
+                return result
+            finally:
+                self._record_call(purpose, started, ok)
+
+    def generate(self, purpose: str, contents: Any, json_output: bool = False) -> Any:
+        with self.limit(purpose):
+            started, ok = time.perf_counter(), False
+            try:
+                result = get_provider().generate(contents, json_output)
+                ok = True
+                return result
+            finally:
+                self._record_call(purpose, started, ok)
+
+    async def generate_async(self, purpose: str, contents: Any, json_output: bool = False) -> Any:
+        async with self.limit(purpose):
+            started, ok = time.perf_counter(), False
+            try:
+                result = await get_provider().generate_async(contents, json_output)
+                ok = True
+                return result
+            finally:
+                self._record_call(purpose, started, ok)
+
+
+model_clients = ModelClients()
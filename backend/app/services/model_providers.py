@@ -0,0 +1,400 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+'''
+Provider interface for the embedding, generation and file-upload calls made by the services, so that
+retrieval and ingestion are not tied to the Gemini API:
+- GeminiProvider: google.generativeai, imported and configured on first use instead of at import time.
+- LocalProvider: offline hashing embedder plus canned query expansion. Needs no network or API key
+  (meant for load tests and local development; it cannot extract PDFs or enhance products).
+- ReplayProvider: serves responses recorded earlier (MODEL_REPLAY_MODE=replay), or wraps Gemini and
+  records every response it returns (MODEL_REPLAY_MODE=record).
+MODEL_PROVIDER selects the provider (gemini|local|replay); EMBEDDING_PROVIDER overrides it for embeddings only,
+e.g. to embed queries locally without the remote round trip. Embeddings from different providers live in
+different vector spaces: re-embed the catalog when switching the embedding provider.
+'''
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL")
+GEMINI_EMBEDDINGS_MODEL = os.getenv("GEMINI_EMBEDDINGS_MODEL")
+GEMINI_TRANSPORT = os.getenv("GEMINI_TRANSPORT") # Optional: "grpc" (SDK default) or "rest"
+
+MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "gemini").lower()
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", MODEL_PROVIDER).lower()
+
+SERVICE_FILE_DIR = Path(__file__).resolve().parent
+MODEL_REPLAY_DIR = Path(os.getenv("MODEL_REPLAY_DIR", str(SERVICE_FILE_DIR.parent.parent / "pdf" / "cache" / "replay")))
+MODEL_REPLAY_MODE = os.getenv("MODEL_REPLAY_MODE", "replay").lower()
+
+EMBEDDING_DIM = 768 # Must match models.Product.embedding
+
+
+class ProviderError(Exception):
+    """Raised when a provider cannot serve a request (unsupported call, missing configuration, replay miss)."""
+
+
+class GenerationResponse:
+    """Provider-neutral generation result exposing the attributes the services read from Gemini responses."""
+
+    def __init__(self, text: str, usage: Optional[Dict[str, int]] = None, block_reason: Optional[str] = None):
+        self.text = text
+        self.parts = [SimpleNamespace(text=text)] if text else []
+        self.candidates = [] if block_reason else [SimpleNamespace(content=SimpleNamespace(parts=self.parts))]
+        self.prompt_feedback = SimpleNamespace(block_reason=block_reason) if block_reason else None
+        self.usage_metadata = SimpleNamespace(**usage) if usage else None
+
+
+class ModelProvider:
+    name = "base"
+
+    def can_embed(self) -> bool:
+        return True
+
+    def can_generate(self) -> bool:
+        return True
+
+    def warm_up(self) -> None:
+        """Builds long-lived clients ahead of the first request (no network calls)."""
+
+    def embed(self, texts: List[str], task_type: str = "RETRIEVAL_DOCUMENT") -> List[Optional[List[float]]]:
+        """Returns one embedding per text (None for texts the provider could not embed)."""
+        raise NotImplementedError
+
+    def generate(self, contents: Any, json_output: bool = False) -> Any:
+        """`contents` is a prompt string or a list of prompt strings and uploaded file handles."""
+        raise NotImplementedError
+
+    async def generate_async(self, contents: Any, json_output: bool = False) -> Any:
+        return await asyncio.to_thread(self.generate, contents, json_output)
+
+    def upload_file(self, path: Path, display_name: Optional[str] = None) -> Any:
+        raise ProviderError(f"The {self.name} provider does not support file uploads.")
+
+    def get_file(self, name: str) -> Any:
+        raise ProviderError(f"The {self.name} provider does not support file uploads.")
+
+    def delete_file(self, name: str) -> None:
+        raise ProviderError(f"The {self.name} provider does not support file uploads.")
+
+
+class GeminiProvider(ModelProvider):
+    name = "gemini"
+
+    def __init__(self, api_key: Optional[str] = GEMINI_API_KEY, model_name: Optional[str] = GEMINI_MODEL,
+                 embedding_model: Optional[str] = GEMINI_EMBEDDINGS_MODEL):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.embedding_model = embedding_model
+        self._model = None
+        self._genai = None
+        self._lock = threading.Lock()
+        if not api_key:
+            logger.warning("GEMINI_API_KEY environment variable not set. Gemini calls will fail.")
+
+    def can_embed(self) -> bool:
+        return bool(self.api_key and self.embedding_model)
+
+    def can_generate(self) -> bool:
+        return bool(self.api_key and self.model_name)
+
+    def _configure(self):
+        """Imports and configures google.generativeai on first use (the SDK is slow to import). Returns the module."""
+        if not self.api_key:
+            raise ProviderError("GEMINI_API_KEY is not set.")
+        with self._lock:
+            if self._genai is None:
+                import google.generativeai as genai # type: ignore
+                # One configure per process: the SDK then keeps its clients (and their channels) for reuse
+                genai.configure(api_key=self.api_key, **({"transport": GEMINI_TRANSPORT} if GEMINI_TRANSPORT else {}))
+                self._genai = genai
+        return self._genai
+
+    def _get_model(self):
+        if self._model is None:
+            if not self.model_name:
+                raise ProviderError("GEMINI_MODEL is not set.")
+            self._model = self._configure().GenerativeModel(self.model_name)
+        return self._model
+
+    def _generation_config(self, json_output: bool):
+        return self._configure().types.GenerationConfig(response_mime_type="application/json") if json_output else None
+
+    def warm_up(self) -> None:
+        if self.can_generate():
+            self._get_model()
+        elif self.api_key:
+            self._configure()
+
+    def embed(self, texts: List[str], task_type: str = "RETRIEVAL_DOCUMENT") -> List[Optional[List[float]]]:
+        if not self.embedding_model:
+            raise ProviderError("GEMINI_EMBEDDINGS_MODEL is not set.")
+        result = self._configure().embed_content(model=self.embedding_model, content=texts, task_type=task_type)
+        return result.get('embedding', [None] * len(texts))
+
+    def generate(self, contents: Any, json_output: bool = False) -> Any:
+        return self._get_model().generate_content(contents, generation_config=self._generation_config(json_output))
+
+    async def generate_async(self, contents: Any, json_output: bool = False) -> Any:
+        return await self._get_model().generate_content_async(contents, generation_config=self._generation_config(json_output))
+
+    def upload_file(self, path: Path, display_name: Optional[str] = None) -> Any:
+        return self._configure().upload_file(path=path, display_name=display_name)
+
+    def get_file(self, name: str) -> Any:
+        return self._configure().get_file(name)
+
+    def delete_file(self, name: str) -> None:
+        self._configure().delete_file(name)
+
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_QUERY_IN_PROMPT = re.compile(r'Query: "(.*)"')
+# Decaying per-dimension scale, like a Matryoshka-trained model, so truncated (compact) embeddings stay meaningful
+_DIM_SCALE = [1.0 / (i ** 0.5) for i in range(1, EMBEDDING_DIM + 1)]
+
+
+@lru_cache(maxsize=65536)
+def _token_vector(token: str) -> tuple:
+    seed = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+    rng = random.Random(seed)
+    return tuple(rng.gauss(0.0, 1.0) * scale for scale in _DIM_SCALE)
+
+
+def hash_embedding(text: str) -> List[float]:
+    """Bag-of-words hashing embedding: each token maps to a fixed random vector; the text is their normalised sum."""
+    tokens = _TOKEN.findall(text.lower()) or [text]
+    vector = [sum(values) for values in zip(*(_token_vector(token) for token in tokens))]
+    norm = sum(value * value for value in vector) ** 0.5
+    return [value / norm for value in vector] if norm else vector
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _local_file_handle(path: Path, name: str, display_name: Optional[str]) -> SimpleNamespace:
+    return SimpleNamespace(name=name, uri=Path(path).resolve().as_uri(), display_name=display_name,
+                           state=SimpleNamespace(name="ACTIVE"), expiration_time=None)
+
+
+class LocalProvider(ModelProvider):
+    """
+    Offline provider. Embeddings are hashed bags of words (texts sharing words are close); generation only
+    answers the query-expansion prompt, with its query as the search terms. The optional latencies simulate
+    the remote round trip for load tests.
+    """
+    name = "local"
+
+    def __init__(self, embed_latency_ms: float = 0.0, generate_latency_ms: float = 0.0):
+        self.embed_latency = embed_latency_ms / 1000
+        self.generate_latency = generate_latency_ms / 1000
+        self._files: Dict[str, SimpleNamespace] = {}
+
+    def embed(self, texts: List[str], task_type: str = "RETRIEVAL_DOCUMENT") -> List[Optional[List[float]]]:
+        if self.embed_latency:
+            time.sleep(self.embed_latency)
+        return [hash_embedding(text) for text in texts]
+
+    def generate(self, contents: Any, json_output: bool = False) -> GenerationResponse:
+        if self.generate_latency:
+            time.sleep(self.generate_latency)
+        prompt = contents if isinstance(contents, str) else " ".join(part for part in contents if isinstance(part, str))
+        queries = _QUERY_IN_PROMPT.findall(prompt)
+        if not queries:
+            raise ProviderError("The local provider only answers query expansion prompts; use the replay provider for ingestion.")
+        text = f"MESSAGE: Here are some deals I found.\nTERMS: {queries[-1]}"
+        return GenerationResponse(text, usage={"prompt_token_count": len(prompt) // 4, "candidates_token_count": len(text) // 4,
+                                               "total_token_count": (len(prompt) + len(text)) // 4})
+
+    def upload_file(self, path: Path, display_name: Optional[str] = None) -> SimpleNamespace:
+        handle = _local_file_handle(path, f"local/{_file_sha256(Path(path))[:32]}", display_name)
+        self._files[handle.name] = handle
+        return handle
+
+    def get_file(self, name: str) -> SimpleNamespace:
+        if name not in self._files:
+            raise ProviderError(f"Unknown local file {name}.")
+        return self._files[name]
+
+    def delete_file(self, name: str) -> None:
+        self._files.pop(name, None)
+
+
+class ReplayProvider(ModelProvider):
+    """
+    Record/replay provider. Responses are stored as one JSON file per request key under `directory`; the key
+    hashes the call kind, options and contents, with uploaded files identified by their content hash.
+    In record mode every call goes to `inner` and its response is saved; in replay mode a missing
+    recording raises ProviderError.
+    """
+    name = "replay"
+
+    def __init__(self, directory: Path, mode: str = "replay", inner: Optional[ModelProvider] = None):
+        if mode not in ("replay", "record"):
+            raise ValueError(f"Unknown replay mode '{mode}'.")
+        if mode == "record" and inner is None:
+            raise ValueError("Record mode needs an inner provider.")
+        self.directory = directory
+        self.mode = mode
+        self.inner = inner
+        self._file_keys: Dict[str, str] = {} # uploaded file name -> content sha256
+        self._write_lock = threading.Lock()
+
+    def can_embed(self) -> bool:
+        return self.inner.can_embed() if self.mode == "record" else True
+
+    def can_generate(self) -> bool:
+        return self.inner.can_generate() if self.mode == "record" else True
+
+    def warm_up(self) -> None:
+        if self.mode == "record":
+            self.inner.warm_up()
+
+    def _key(self, kind: str, options: Any, contents: Any) -> str:
+        parts = contents if isinstance(contents, list) else [contents]
+        normalised = [part if isinstance(part, str) else f"file:{self._file_keys.get(getattr(part, 'name', ''), getattr(part, 'name', ''))}"
+                      for part in parts]
+        payload = json.dumps([kind, options, normalised], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        if not path.exists():
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save(self, key: str, record: Dict[str, Any]) -> None:
+        path = self._path(key)
+        with self._write_lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(record, f)
+            os.replace(tmp_path, path)
+
+    def embed(self, texts: List[str], task_type: str = "RETRIEVAL_DOCUMENT") -> List[Optional[List[float]]]:
+        keys = [self._key("embed", task_type, text) for text in texts]
+        records = [self._load(key) for key in keys]
+        missing = [i for i, record in enumerate(records) if record is None]
+        if missing and self.mode == "replay":
+            raise ProviderError(f"No recorded embeddings for {len(missing)} of {len(texts)} texts.")
+        if missing:
+            embeddings = self.inner.embed([texts[i] for i in missing], task_type)
+            for i, embedding in zip(missing, embeddings):
+                if embedding is not None:
+                    records[i] = {"embedding": list(embedding)}
+                    self._save(keys[i], records[i])
+        return [record["embedding"] if record else None for record in records]
+
+    def _replay_generation(self, key: str) -> GenerationResponse:
+        record = self._load(key)
+        if record is None:
+            raise ProviderError("No recorded response for this generation request.")
+        return GenerationResponse(record["text"], record.get("usage"), record.get("block_reason"))
+
+    def _record_generation(self, key: str, response: Any) -> Any:
+        candidates = getattr(response, "candidates", None)
+        text = "".join(part.text for part in candidates[0].content.parts) if candidates else ""
+        block_reason = None
+        if not candidates:
+            feedback = getattr(response, "prompt_feedback", None)
+            block_reason = str(feedback.block_reason) if feedback else "Unknown"
+        usage_metadata = getattr(response, "usage_metadata", None)
+        usage = {field: getattr(usage_metadata, field, 0) or 0
+                 for field in ("prompt_token_count", "candidates_token_count", "total_token_count")} if usage_metadata else None
+        self._save(key, {"text": text, "usage": usage, "block_reason": block_reason})
+        return response
+
+    def generate(self, contents: Any, json_output: bool = False) -> Any:
+        key = self._key("generate", json_output, contents)
+        if self.mode == "replay":
+            return self._replay_generation(key)
+        return self._record_generation(key, self.inner.generate(contents, json_output))
+
+    async def generate_async(self, contents: Any, json_output: bool = False) -> Any:
+        key = self._key("generate", json_output, contents)
+        if self.mode == "replay":
+            return self._replay_generation(key)
+        return self._record_generation(key, await self.inner.generate_async(contents, json_output))
+
+    def upload_file(self, path: Path, display_name: Optional[str] = None) -> Any:
+        sha256 = _file_sha256(Path(path))
+        if self.mode == "record":
+            handle = self.inner.upload_file(path, display_name)
+        else:
+            handle = _local_file_handle(path, f"replay/{sha256[:32]}", display_name)
+        self._file_keys[handle.name] = sha256
+        return handle
+
+    def get_file(self, name: str) -> Any:
+        if self.mode == "record":
+            return self.inner.get_file(name)
+        # Replayed handles only live in this process; an unknown name makes the caller upload again
+        raise ProviderError(f"Unknown replay file {name}.")
+
+    def delete_file(self, name: str) -> None:
+        self._file_keys.pop(name, None)
+        if self.mode == "record":
+            self.inner.delete_file(name)
+
+
+def create_provider(kind: str) -> ModelProvider:
+    if kind == "gemini":
+        return GeminiProvider()
+    if kind == "local":
+        return LocalProvider()
+    if kind == "replay":
+        return ReplayProvider(MODEL_REPLAY_DIR, MODEL_REPLAY_MODE, GeminiProvider() if MODEL_REPLAY_MODE == "record" else None)
+    raise ValueError(f"Unknown model provider '{kind}'. Expected gemini, local or replay.")
+
+
+_providers: Dict[str, ModelProvider] = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider() -> ModelProvider:
+    """Provider for generation and file uploads (MODEL_PROVIDER)."""
+    with _providers_lock:
+        if "generate" not in _providers:
+            _providers["generate"] = create_provider(MODEL_PROVIDER)
+        return _providers["generate"]
+
+
+def get_embedding_provider() -> ModelProvider:
+    """Provider for embeddings (EMBEDDING_PROVIDER, defaulting to MODEL_PROVIDER)."""
+    with _providers_lock:
+        if "embed" not in _providers:
+            if EMBEDDING_PROVIDER != MODEL_PROVIDER:
+                _providers["embed"] = create_provider(EMBEDDING_PROVIDER)
+            else:
+                _providers.setdefault("generate", create_provider(MODEL_PROVIDER))
+                _providers["embed"] = _providers["generate"]
+        return _providers["embed"]
+
+
+def set_provider(provider: ModelProvider, embedding_provider: Optional[ModelProvider] = None) -> None:
+    """Overrides the configured providers, e.g. with a LocalProvider for benchmarks."""
+    with _providers_lock:
+        _providers["generate"] = provider
+        _providers["embed"] = embedding_provider or provider
@@ -1,17 +1,31 @@
+import logging
 import os
 import json
-import google.generativeai as genai # type: ignore
+import tempfile
 from google.api_core import exceptions as google_exceptions # type: ignore # For specific google exceptions
 from pydantic import ValidationError
 import asyncio
 import aiofiles # For async file operations
 from pathlib import Path
 from datetime import date 
+from typing import Dict, List, Optional, Tuple
 
 
 from ..schemas.pdf_schema import ExtractedPDFData
 # from ..utils.utils import find_project_root # No longer using find_project_root for these paths
 from .pdf_prompts import GENERAL_PROMPT_TEMPLATE, PRODUCT_CATEGORIES, KNOWN_RETAILERS, PRODUCT_UNITS # 
+from . import extraction_cache
+from .gemini_upload_registry import UploadRegistry, upload_registry as default_upload_registry
+from ..utils.metrics import record_tokens
+from .model_providers import get_provider
+from .model_clients import model_clients
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pypdf import PdfReader, PdfWriter # Optional: only needed for page-chunked extraction
+except ImportError:
+    PdfReader = PdfWriter = None
 
 '''
 Configures and initializes the Google Gemini API service for handling PDF file processing tasks.
@@ -19,64 +33,109 @@ Uploads the source PDF files securely to the Gemini Files API for remote process
 Sends a specific extraction prompt along with the uploaded file reference to the Gemini API.
 Strictly validates the extracted JSON data received from the Gemini API using Pydantic schemas.
 Persists the successfully validated, structured data by saving it into local JSON files.
+Caches validated extractions by PDF content hash + prompt version, so identical PDFs never hit Gemini twice.
+Optionally splits large circulars into page ranges (PDF_CHUNK_PAGES) that are extracted concurrently,
+validated per chunk and merged, so one bad page no longer fails the whole file.
 '''
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-GEMINI_MODEL = os.getenv("GEMINI_MODEL") 
-
 # Define paths relative to this file's location
 SERVICE_FILE_DIR = Path(__file__).resolve().parent
 UPLOADS_DIR = SERVICE_FILE_DIR.parent.parent / "pdf" / "uploads"
 EXTRACTIONS_DIR = SERVICE_FILE_DIR.parent.parent / "pdf" / "extractions"
+TEMP_DIR = SERVICE_FILE_DIR.parent.parent / "pdf" / "temp"
 
+# Page-chunked extraction: pages per chunk (0 disables chunking) and chunks extracted concurrently per PDF
+PDF_CHUNK_PAGES = int(os.getenv("PDF_CHUNK_PAGES", "0"))
+PDF_CHUNK_WORKERS = int(os.getenv("PDF_CHUNK_WORKERS", "4"))
+
+if PDF_CHUNK_PAGES and PdfReader is None:
+    logger.warning("PDF_CHUNK_PAGES is set but pypdf is not installed. PDFs will be extracted whole.")
 
-# --- Initialization ---
-if not GEMINI_API_KEY:
-    print("Warning: GEMINI_API_KEY environment variable not set.")
-else:
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-    except Exception as e:
-        print(f"Error configuring Gemini API: {e}")
 
 # --- PDF Processor Service ---
 class GroceryAdProcessor:
-    def __init__(self):
-        try:
-            self.model = genai.GenerativeModel(GEMINI_MODEL)
-            # print(f"Gemini model '{GEMINI_MODEL}' initialized.")
-        except Exception as e:
-            print(f"Failed to initialize Gemini model: {e}")
-            self.model = None # Mark as unusable
+    def __init__(self, upload_registry: Optional[UploadRegistry] = None):
+        # Reuses live Files API uploads across attempts and deletes them once extraction succeeds
+        self.upload_registry = upload_registry or default_upload_registry
+        # Model calls go through the process-wide client registry, which also enforces the
+        # file_upload and pdf_extraction concurrency limits shared by every processor
+        self.provider = get_provider()
 
-    async def process_pdf_to_json(self, pdf_path: Path) -> str | None:
+    async def process_pdf_to_json(self, pdf_path: Path, final_attempt: bool = True) -> str | None:
         """
         Processes a single PDF file using the Gemini Files API, and saves it as a JSON file in the EXTRACTIONS_DIR.
+        Large PDFs are extracted in page chunks when PDF_CHUNK_PAGES is set (and pypdf is installed).
         Args:
             pdf_path: Path object pointing to the input PDF file.
+            final_attempt: False when the caller will retry a failure; the uploads of a failed extraction are then
+                kept for reuse instead of deleted.
         Returns:
             The path to the created JSON file if successful, otherwise None.
+        Raises:
+            google_exceptions.GoogleAPIError: on Gemini API errors, so callers can retry (e.g. rate limits).
         """
-        if not self.model: # failsafe in case the class has been instantiated but the model is not configured
-            print("Processor not initialized correctly. Skipping processing.")
+        if not self.provider.can_generate(): # failsafe in case the class has been instantiated but the model is not configured
+            logger.warning("Processor not initialized correctly. Skipping processing.")
             return None
 
         output_json_path = EXTRACTIONS_DIR / f"{pdf_path.stem}.json"
         # print(f"Starting processing for: {pdf_path.name}")
         
-        # Check if the output JSON file already exists
-        if output_json_path.exists():
-            print(f"=== Output JSON exists. Skipping processing for {pdf_path.name}.")
+        # Check the content-addressed cache (same bytes + same prompt version => same extraction)
+        pdf_sha256 = await asyncio.to_thread(extraction_cache.file_sha256, pdf_path)
+        cached = await asyncio.to_thread(extraction_cache.load, pdf_sha256)
+        if cached:
+            cached_data, cached_usage = cached
+            logger.info(f"=== Extraction cache hit for {pdf_path.name} (sha256 {pdf_sha256[:12]}, "
+                  f"originally {cached_usage.get('total_token_count', '?')} tokens). Skipping Gemini call.")
+            # The cached extraction names the file and date of the original run; report this upload's instead
+            weekly_ad = cached_data.weekly_ad.model_copy(update={"filename": pdf_path.name, "date_processed": date.today()})
+            cached_data = cached_data.model_copy(update={"weekly_ad": weekly_ad})
+            return await self._save_output(cached_data, output_json_path, pdf_path)
+
+        page_count = await asyncio.to_thread(_count_pages, pdf_path) if PDF_CHUNK_PAGES and PdfReader else 0
+        chunked = page_count > PDF_CHUNK_PAGES
+        try:
+            if chunked: # Caches the merged extraction itself, and only when every chunk succeeded
+                extraction = await self._extract_chunked(pdf_path, page_count, pdf_sha256)
+            else:
+                extraction = await self._extract_from_file(pdf_path, pdf_path.name, pdf_sha256)
+        finally:
+            if final_attempt: # No retry will reuse what is still uploaded (the file or failed chunks)
+                await self.upload_registry.release_prefix(pdf_sha256)
+        if not extraction:
             return None
+        validated_data, usage = extraction
 
-        uploaded_file = None # To keep track for potential deletion
         try:
-            # 1. Upload PDF using Files API
-            print(f"Uploading {pdf_path.name} to Gemini Files API...")
-            uploaded_file = await asyncio.to_thread(
-                genai.upload_file, path=pdf_path, display_name=pdf_path.name
-            )
-            print(f"File uploaded successfully: {uploaded_file.name} ({uploaded_file.uri})")
+            if not chunked:
+                await asyncio.to_thread(extraction_cache.save, pdf_sha256, validated_data, usage, pdf_path.name)
+            return await self._save_output(validated_data, output_json_path, pdf_path)
+        except Exception as e:
+            logger.error(f"Error saving JSON file {output_json_path}: {e}")
+            return None
+
+    async def _extract_from_file(self, file_path: Path, source_name: str, upload_key: str) -> Optional[Tuple[ExtractedPDFData, Dict[str, int]]]:
+        """
+        Uploads one PDF (a whole circular or a page chunk of it), asks Gemini for the extraction and validates it.
+        The upload is reused from the upload registry when a live one exists for `upload_key`, and released
+        (deleted in the background) once the extraction validates; process_pdf_to_json releases the uploads
+        of failed extractions after the final attempt.
+        Args:
+            file_path: The PDF to upload.
+            source_name: Original PDF filename, used in the prompt and logs.
+            upload_key: Content key for the upload registry (PDF SHA-256, plus page range for chunks).
+        Returns:
+            (validated data, token usage) if successful, otherwise None.
+        Raises:
+            google_exceptions.GoogleAPIError: on Gemini API errors.
+        """
+        try:
+            # 1. Upload PDF using Files API (or reuse a live upload of the same content)
+            logger.info(f"Uploading {file_path.name} to Gemini Files API...")
+            async with model_clients.limit("file_upload"):
+                uploaded_file = await self.upload_registry.acquire(upload_key, file_path, file_path.name)
+            logger.info(f"File ready: {uploaded_file.name} ({uploaded_file.uri})")
 
             # 2. Generate content using the uploaded file
             categories_str = ", ".join([f'"{cat}"' for cat in PRODUCT_CATEGORIES])
@@ -85,77 +144,187 @@ class GroceryAdProcessor:
             current_processing_date = date.today().strftime("%Y-%m-%d")
 
             prompt = GENERAL_PROMPT_TEMPLATE.format(
-                file_display_name=pdf_path.name,
+                file_display_name=source_name,
                 categories_list_str=categories_str,
                 retailers_list_str=retailers_str,
                 units_list_str=units_str,
                 current_date_for_processing=current_processing_date
             )
 
-            print(f"=========== Generated Prompt:\n{prompt}")
+            logger.debug("Generated prompt:\n%s", prompt)
 
-            print(f"Sending request to Gemini model '{GEMINI_MODEL}'...")
-            response = await self.model.generate_content_async(
-                [prompt, uploaded_file],
-                generation_config=genai.types.GenerationConfig(
-                    response_mime_type="application/json"
-                )
-            )
+            logger.info(f"Sending request to the '{self.provider.name}' provider...")
+            response = await model_clients.generate_async("pdf_extraction", [prompt, uploaded_file], json_output=True)
 
             # Log token usage
+            usage = {}
             if hasattr(response, 'usage_metadata') and response.usage_metadata:
-                print(f"""Token usage for {pdf_path.name}: 
-                      Prompt tokens: {response.usage_metadata.prompt_token_count}, 
-                      Candidates tokens: {response.usage_metadata.candidates_token_count}, 
-                      Total tokens: {response.usage_metadata.total_token_count}""")
+                record_tokens("pdf_extraction", response.usage_metadata)
+                usage = {
+                    "prompt_token_count": response.usage_metadata.prompt_token_count,
+                    "candidates_token_count": response.usage_metadata.candidates_token_count,
+                    "total_token_count": response.usage_metadata.total_token_count,
+                }
+                logger.info(
+                    "Token usage for %s: prompt=%s candidates=%s total=%s",
+                    file_path.name,
+                    response.usage_metadata.prompt_token_count,
+                    response.usage_metadata.candidates_token_count,
+                    response.usage_metadata.total_token_count,
+                )
             else:
-                print(f"Token usage data not available for {pdf_path.name}.")
+                logger.warning(f"Token usage data not available for {file_path.name}.")
 
             # Check for blocked prompts or safety issues
             if not response.candidates:
                  block_reason = response.prompt_feedback.block_reason if response.prompt_feedback else "Unknown"
-                 print(f"Request blocked or failed. Reason: {block_reason}. PDF: {pdf_path.name}")
+                 logger.error(f"Request blocked or failed. Reason: {block_reason}. PDF: {file_path.name}")
                  return None
 
             # Clean the response text: Gemini might still add markdown ```json ... ```
             # Access text safely, check if parts exist
             if not response.candidates[0].content.parts:
-                print(f"Gemini response has no parts. PDF: {pdf_path.name}")
+                logger.warning(f"Gemini response has no parts. PDF: {file_path.name}")
                 return None
             raw_results = response.candidates[0].content.parts[0].text
             cleaned_results = raw_results.strip().removeprefix('```json').removesuffix('```').strip()
-            print(f"Received response from Gemini for {pdf_path.name}.")
+            logger.info(f"Received response from Gemini for {file_path.name}.")
 
         except google_exceptions.GoogleAPIError as e:
-            print(f"Gemini API Error processing {pdf_path.name}: {e}")
-            return None
+            logger.error(f"Gemini API Error processing {file_path.name}: {e}")
+            raise
         except Exception as e:
-            print(f"Unexpected error during Gemini interaction for {pdf_path.name}: {e}")
+            logger.error(f"Unexpected error during Gemini interaction for {file_path.name}: {e}")
             return None
 
-        # 3. Parse, Validate, and Save JSON
+        # 3. Parse and Validate JSON
         try:
-            # print(f"Validating response for {pdf_path.name}...")
+            # print(f"Validating response for {file_path.name}...")
             validated_data = ExtractedPDFData.model_validate_json(cleaned_results)
-            print(f"Validation successful for {pdf_path.name}.")
-
-            # print(f"Saving extracted data to {output_json_path}...")
-            async with aiofiles.open(output_json_path, mode='w', encoding='utf-8') as f:
-                await f.write(validated_data.model_dump_json(indent=2))
-            print(f"Successfully saved JSON for {pdf_path.name}.")
-            return str(output_json_path)
+            logger.info(f"Validation successful for {file_path.name}.")
+            # Extraction done, the remote copy is no longer needed (failed attempts keep it for reuse)
+            await self.upload_registry.release(upload_key)
+            return validated_data, usage
 
         except ValidationError as e:
-            print(f"Validation Error for {pdf_path.name}: {e}")
-            print(f"Invalid Raw Data: {cleaned_results}")
+            logger.error(f"Validation Error for {file_path.name}: {e}")
+            logger.debug("Invalid raw data: %s", cleaned_results)
             return None
         
         except json.JSONDecodeError as e:
-            print(f"JSON Decode Error for {pdf_path.name}: {e}")
-            print(f"Raw Data causing decode error: {cleaned_results}")
-            # Optionally save error file as above
+            logger.error(f"JSON Decode Error for {file_path.name}: {e}")
+            logger.debug("Raw data causing decode error: %s", cleaned_results)
             return None
-        
-        except Exception as e:
-            print(f"Error saving JSON file {output_json_path}: {e}")
-            return None
\ No newline at end of file
+
+    async def _extract_chunked(self, pdf_path: Path, page_count: int, pdf_sha256: str) -> Optional[Tuple[ExtractedPDFData, Dict[str, int]]]:
+        """
+        Splits the PDF into PDF_CHUNK_PAGES-page files, extracts up to PDF_CHUNK_WORKERS chunks concurrently
+        and merges the validated chunks. Failed chunks are logged and left out of the merge, and a merge with
+        missing chunks is not cached under the PDF hash (the next run retries those chunks).
+        Each validated chunk is cached on its own, and a GoogleAPIError on any chunk is raised once the others
+        finish: chunks are not retried here, the extraction job's retry then re-extracts only the failed chunks.
+        """
+        page_ranges = [(start, min(start + PDF_CHUNK_PAGES, page_count)) for start in range(0, page_count, PDF_CHUNK_PAGES)]
+        chunk_keys = [f"{pdf_sha256}-p{start + 1}-{end}" for start, end in page_ranges]
+        results = [await asyncio.to_thread(extraction_cache.load, chunk_key) for chunk_key in chunk_keys]
+        missing = [index for index, result in enumerate(results) if result is None]
+        logger.info(f"Splitting {pdf_path.name} ({page_count} pages) into {len(page_ranges)} chunks of up to {PDF_CHUNK_PAGES} pages "
+                    f"({len(page_ranges) - len(missing)} already cached).")
+        chunk_paths = await asyncio.to_thread(_split_pdf, pdf_path, [page_ranges[index] for index in missing])
+        chunk_limit = asyncio.Semaphore(PDF_CHUNK_WORKERS)
+
+        async def extract_chunk(chunk_path: Path, chunk_key: str):
+            async with chunk_limit:
+                try:
+                    result = await self._extract_from_file(chunk_path, pdf_path.name, chunk_key)
+                except google_exceptions.GoogleAPIError as e:
+                    return e
+            if result:
+                await asyncio.to_thread(extraction_cache.save, chunk_key, result[0], result[1], pdf_path.name)
+            return result
+
+        try:
+            extracted = await asyncio.gather(*(
+                extract_chunk(chunk_path, chunk_keys[index]) for chunk_path, index in zip(chunk_paths, missing)
+            ))
+        finally:
+            for chunk_path in chunk_paths:
+                chunk_path.unlink(missing_ok=True)
+        for index, result in zip(missing, extracted):
+            results[index] = result
+
+        chunk_results = []
+        api_error = None
+        for (start, end), result in zip(page_ranges, results):
+            if isinstance(result, google_exceptions.GoogleAPIError):
+                api_error = result
+                logger.warning(f"Chunk pages {start + 1}-{end} of {pdf_path.name} failed on the Gemini API: {result}")
+            elif result is None:
+                logger.warning(f"Chunk pages {start + 1}-{end} of {pdf_path.name} failed extraction/validation. Skipping it.")
+            else:
+                chunk_results.append((start, result))
+
+        if api_error:
+            raise api_error
+        if not chunk_results:
+            return None
+        logger.info(f"Extracted {len(chunk_results)}/{len(page_ranges)} chunks of {pdf_path.name}.")
+        merged = _merge_chunks(chunk_results)
+        if len(chunk_results) == len(page_ranges):
+            await asyncio.to_thread(extraction_cache.save, pdf_sha256, merged[0], merged[1], pdf_path.name)
+        return merged
+
+    async def _save_output(self, data: ExtractedPDFData, output_json_path: Path, pdf_path: Path) -> str:
+        """Writes the validated extraction to EXTRACTIONS_DIR and returns its path."""
+        # print(f"Saving extracted data to {output_json_path}...")
+        async with aiofiles.open(output_json_path, mode='w', encoding='utf-8') as f:
+            await f.write(data.model_dump_json(indent=2))
+        logger.info(f"Successfully saved JSON for {pdf_path.name}.")
+        return str(output_json_path)
+
+
+def _count_pages(pdf_path: Path) -> int:
+    return len(PdfReader(str(pdf_path)).pages)
+
+
+def _split_pdf(pdf_path: Path, page_ranges: List[Tuple[int, int]]) -> List[Path]:
+    """Writes each [start, end) page range of the PDF to its own uniquely named file in TEMP_DIR,
+    so concurrent extractions of same-named PDFs never overwrite each other's chunks."""
+    TEMP_DIR.mkdir(parents=True, exist_ok=True)
+    reader = PdfReader(str(pdf_path))
+    chunk_paths = []
+    for start, end in page_ranges:
+        writer = PdfWriter()
+        for page_index in range(start, end):
+            writer.add_page(reader.pages[page_index])
+        with tempfile.NamedTemporaryFile(dir=TEMP_DIR, prefix=f"{pdf_path.stem}-p{start + 1}-{end}-", suffix=".pdf", delete=False) as f:
+            writer.write(f)
+        chunk_paths.append(Path(f.name))
+    return chunk_paths
+
+
+def _merge_chunks(chunk_results: List[Tuple[int, Tuple[ExtractedPDFData, Dict[str, int]]]]) -> Tuple[ExtractedPDFData, Dict[str, int]]:
+    """
+    Merges per-chunk extractions (ordered by first page) into one ExtractedPDFData.
+    Retailer and weekly ad dates come from the earliest chunk. Only the chunk starting at page 1 can
+    contain front page products, so is_frontpage is cleared for every other chunk.
+    Products repeated across chunks (same name, price and promotion) are kept once. Token usage is summed.
+    """
+    chunk_results = sorted(chunk_results, key=lambda item: item[0])
+    first_data = chunk_results[0][1][0]
+    merged_products = []
+    seen = set()
+    usage: Dict[str, int] = {}
+    for start_page, (data, chunk_usage) in chunk_results:
+        for key, value in chunk_usage.items():
+            usage[key] = usage.get(key, 0) + (value or 0)
+        for product in data.products:
+            dedupe_key = (product.name.strip().lower(), product.price, (product.promotion_details or "").strip().lower())
+            if dedupe_key in seen:
+                continue
+            seen.add(dedupe_key)
+            if start_page != 0:
+                product = product.model_copy(update={"is_frontpage": False})
+            merged_products.append(product)
+    merged = first_data.model_copy(update={"products": merged_products})
+    return merged, usage
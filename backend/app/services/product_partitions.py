@@ -0,0 +1,192 @@
+import logging
+import os
+import re
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .. import database
+from ..models import Product as ProductModel
+from .catalog_cache import catalog_cache
+
+logger = logging.getLogger(__name__)
+
+'''
+Weekly range partitions of the products table. The partition key, products.ad_week, is the Monday of the
+weekly ad's valid_from week, and each week lives in its own partition (products_wYYYYMMDD).
+- The loader calls ensure_week_partition before inserting an ad's products; maintain_partitions also creates
+  the upcoming weeks ahead of time, so ingestion rarely runs DDL. The check reads the catalog on every call
+  (once per ad, not per row), so a week another process detached meanwhile is re-attached, never assumed live.
+- Period queries add ad_week_filter(db, ad_period): the weeks holding that period's ads (usually one) are
+  looked up from weekly_ads and cached by catalog version, and Postgres prunes every other partition.
+- maintain_partitions detaches weeks older than PARTITION_RETENTION_WEEKS (DETACH ... CONCURRENTLY, PostgreSQL 14+),
+  then drops them or moves them to ARCHIVE_TABLESPACE. Only weeks whose ads are all 'cold' (exported by
+  archive_service.archive_ads) are detached: rows of 'archived' ads must stay readable until they are exported. Archival is a catalog change instead of row updates, and
+  index builds and vacuum only cover live weeks. attach_week_partition brings a detached week back.
+'''
+
+PARTITION_RETENTION_WEEKS = int(os.getenv("PARTITION_RETENTION_WEEKS", "12"))
+PARTITION_PRECREATE_WEEKS = int(os.getenv("PARTITION_PRECREATE_WEEKS", "2"))
+PARTITION_DDL_LOCK_TIMEOUT = os.getenv("PARTITION_DDL_LOCK_TIMEOUT", "5s")
+ARCHIVE_TABLESPACE = os.getenv("ARCHIVE_TABLESPACE") # Detached weeks are moved here when set (e.g. cheaper or compressed storage)
+
+_PARTITION_NAME = re.compile(r"^products_w(\d{8})$")
+
+_PARTITIONS_SQL = text("""
+    SELECT c.relname AS name
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'products'::regclass
+""")
+
+# Weeks still holding rows that are needed in products: ads not yet exported to cold storage (archive_service)
+_UNEXPORTED_WEEKS_SQL = text("""
+    SELECT DISTINCT valid_from, ad_period = 'archived' AS awaiting_archive FROM weekly_ads WHERE ad_period <> 'cold'
+""")
+
+_PARTITION_STATE_SQL = text("""
+    SELECT to_regclass(:name) IS NOT NULL AS present,
+           EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(:name) AND inhparent = 'products'::regclass) AS attached
+""")
+
+
+def ad_week(valid_from: date) -> date:
+    """Partition key for an ad: the Monday of its valid_from week."""
+    return valid_from - timedelta(days=valid_from.weekday())
+
+
+def partition_name(week: date) -> str:
+    return f"products_w{week:%Y%m%d}"
+
+
+def _partition_week(name: str) -> Optional[date]:
+    match = _PARTITION_NAME.match(name)
+    if not match:
+        return None
+    value = match.group(1)
+    return date(int(value[:4]), int(value[4:6]), int(value[6:]))
+
+
+def _week_bounds_sql(week: date) -> str:
+    return f"FOR VALUES FROM ('{week.isoformat()}') TO ('{(week + timedelta(days=7)).isoformat()}')"
+
+
+def _create_partition_sql(week: date) -> str:
+    return f"CREATE TABLE IF NOT EXISTS {partition_name(week)} PARTITION OF products {_week_bounds_sql(week)}"
+
+
+def _attach_partition_sql(week: date) -> str:
+    return f"ALTER TABLE products ATTACH PARTITION {partition_name(week)} {_week_bounds_sql(week)}"
+
+
+def ensure_week_partition(week: date) -> str:
+    """
+    Creates the partition for `week` if needed, or re-attaches it if it was detached, in its own short
+    autocommit transaction. Returns its name.
+    Call it before the caller's session writes (or has read products) in its current transaction.
+    """
+    name = partition_name(week)
+    with database.get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        state = conn.execute(_PARTITION_STATE_SQL, {"name": name}).first()
+        if state.attached:
+            return name
+        # Partition DDL locks products and the tables it references; fail fast instead of queueing
+        # behind (or deadlocking with) open transactions, e.g. the caller's own session
+        conn.execute(text(f"SET lock_timeout = '{PARTITION_DDL_LOCK_TIMEOUT}'"))
+        if state.present:
+            conn.execute(text(_attach_partition_sql(week)))
+            catalog_cache.invalidate()
+            logger.info(f"Re-attached detached partition {name}")
+        else:
+            conn.execute(text(_create_partition_sql(week)))
+            logger.info(f"Created partition {name}")
+    return name
+
+
+def is_week_attached(db: Session, week: date) -> bool:
+    """True when `week`'s partition exists and is attached to products (not detached by maintain_partitions)."""
+    return bool(db.execute(_PARTITION_STATE_SQL, {"name": partition_name(week)}).first().attached)
+
+
+def period_weeks(db: Session, ad_period: str) -> Tuple[date, ...]:
+    """ad_week values holding the ad period's ads, cached until the catalog version changes."""
+    def build(version: str) -> Tuple[date, ...]:
+        rows = db.execute(text("SELECT DISTINCT valid_from FROM weekly_ads WHERE ad_period = :ad_period"),
+                          {"ad_period": ad_period}).fetchall()
+        return tuple(sorted({ad_week(row.valid_from) for row in rows}))
+    return catalog_cache.get_or_build(db, "ad_weeks", ad_period, build)
+
+
+def ad_week_filter(db: Session, ad_period: str):
+    """ORM filter restricting products to the ad period's partitions, so the planner prunes the rest."""
+    return ProductModel.ad_week.in_(period_weeks(db, ad_period))
+
+
+def list_partitions() -> List[Dict[str, str]]:
+    with database.get_engine().connect() as conn:
+        names = [row.name for row in conn.execute(_PARTITIONS_SQL)]
+    weeks = [(week, name) for name in names if (week := _partition_week(name))]
+    return [{"name": name, "week": week.isoformat()} for week, name in sorted(weeks)]
+
+
+def maintain_partitions(retention_weeks: int = PARTITION_RETENTION_WEEKS, drop: bool = False) -> Dict[str, List[str]]:
+    """
+    Creates the partitions for the next PARTITION_PRECREATE_WEEKS weeks and detaches weeks older than
+    `retention_weeks` whose ads have all been exported to cold storage. Detached weeks are dropped when `drop` is
+    set, otherwise kept as standalone tables (in ARCHIVE_TABLESPACE when configured). Weeks kept only because
+    their 'archived' ads are not exported yet are reported under "awaiting_archive" (run archive_ads first).
+    """
+    report: Dict[str, List[str]] = {"created": [], "detached": [], "dropped": [], "awaiting_archive": []}
+    this_week = ad_week(date.today())
+    cutoff = this_week - timedelta(weeks=retention_weeks)
+    engine = database.get_engine()
+    # DETACH ... CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"SET lock_timeout = '{PARTITION_DDL_LOCK_TIMEOUT}'"))
+        existing = {row.name for row in conn.execute(_PARTITIONS_SQL)}
+        kept_weeks: Dict[date, bool] = {} # week -> holds 'archived' ads not exported yet
+        for row in conn.execute(_UNEXPORTED_WEEKS_SQL):
+            week = ad_week(row.valid_from)
+            kept_weeks[week] = kept_weeks.get(week, False) or row.awaiting_archive
+
+        for offset in range(PARTITION_PRECREATE_WEEKS + 1):
+            week = this_week + timedelta(weeks=offset)
+            if partition_name(week) not in existing:
+                conn.execute(text(_create_partition_sql(week)))
+                report["created"].append(partition_name(week))
+
+        for name in sorted(existing):
+            week = _partition_week(name)
+            if week is None or week >= cutoff:
+                continue
+            if week in kept_weeks:
+                if kept_weeks[week]: # Never detach (let alone drop) rows that exist nowhere else yet
+                    report["awaiting_archive"].append(name)
+                continue
+            conn.execute(text(f"ALTER TABLE products DETACH PARTITION {name} CONCURRENTLY"))
+            report["detached"].append(name)
+            if drop:
+                conn.execute(text(f"DROP TABLE {name}"))
+                report["dropped"].append(name)
+            elif ARCHIVE_TABLESPACE:
+                conn.execute(text(f"ALTER TABLE {name} SET TABLESPACE {ARCHIVE_TABLESPACE}"))
+
+    if report["detached"]:
+        catalog_cache.invalidate()
+    if report["awaiting_archive"]:
+        logger.warning(f"Partitions past retention kept until their archived ads are exported: {report['awaiting_archive']}")
+    logger.info(f"Partition maintenance: created {report['created']}, detached {report['detached']}, dropped {report['dropped']}")
+    return report
+
+
+def attach_week_partition(week: date) -> str:
+    """Re-attaches a previously detached week (e.g. to query an archived ad again). Returns the partition name."""
+    week = ad_week(week)
+    name = partition_name(week)
+    with database.get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(_attach_partition_sql(week)))
+    catalog_cache.invalidate()
+    logger.info(f"Attached partition {name}")
+    return name
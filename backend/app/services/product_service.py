@@ -1,9 +1,45 @@
+import logging
+import os
+from sqlalchemy import text, bindparam
 from sqlalchemy.orm import Session, joinedload
-from typing import List
+from typing import List, Optional
 from fastapi import HTTPException
 
 from ..models import Product as ProductModel, WeeklyAd as WeeklyAdModel, Retailer as RetailerModel
-from ..schemas.data_schemas import ProductWithDetails
+from ..schemas.data_schemas import ProductWithDetails, ProductFacets, FacetCount, CategoryFacet, RetailerFacet
+from ..utils.metrics import stage_timer, record_results
+from .. import database
+from .catalog_cache import catalog_cache
+from .product_partitions import ad_week_filter, period_weeks
+from ..utils.single_flight import SingleFlight, normalise_text
+
+logger = logging.getLogger(__name__)
+
+# Identical concurrent searches share one query; results are reused for this long afterwards
+SEARCH_RESULT_TTL_SECONDS = float(os.getenv("SEARCH_RESULT_TTL_SECONDS", "5"))
+search_flight = SingleFlight("search_products", SEARCH_RESULT_TTL_SECONDS)
+
+# sort= values accepted by filter and search. Each matches a composite (ad_week, ...) index on products, so within
+# a week's partition the top N are read in index order. Unit prices are only comparable within one basis ($/lb,
+# $/gal, $/each), so unit_price groups by unit_price_basis and sorts within each group; filter by unit_basis
+# for a single basis.
+PRODUCT_SORTS = {
+    "price": (ProductModel.price.asc().nullslast(),),
+    "unit_price": (ProductModel.unit_price_basis.asc().nullslast(), ProductModel.unit_price.asc().nullslast()),
+    "discount": (ProductModel.discount_pct.desc().nullslast(),),
+}
+
+
+def _apply_sort(query, sort: Optional[str], unit_basis: Optional[str] = None):
+    if unit_basis:
+        query = query.filter(ProductModel.unit_price_basis == unit_basis)
+    if not sort:
+        return query
+    if sort not in PRODUCT_SORTS:
+        raise HTTPException(
+            status_code=400, detail=f"Invalid sort '{sort}'. Use one of: {', '.join(PRODUCT_SORTS)}.")
+    # id as tie-breaker keeps offset pagination stable
+    return query.order_by(*PRODUCT_SORTS[sort], ProductModel.id)
 
 
 async def get_products_by_retailer_and_ad_period(
@@ -18,6 +54,7 @@ async def get_products_by_retailer_and_ad_period(
         .join(WeeklyAdModel, ProductModel.weekly_ad_id == WeeklyAdModel.id)
         .filter(ProductModel.retailer_id == retailer_id)
         .filter(WeeklyAdModel.ad_period == ad_period)
+        .filter(ad_week_filter(db, ad_period))
         .options(
             # Ensure retailer data is loaded
             joinedload(ProductModel.retailer),
@@ -53,42 +90,76 @@ async def get_products_by_retailer_and_ad_period(
             weekly_ad_valid_from=p_orm.weekly_ad.valid_from if p_orm.weekly_ad else None,
             weekly_ad_valid_to=p_orm.weekly_ad.valid_to if p_orm.weekly_ad else None,
             weekly_ad_ad_period=p_orm.weekly_ad.ad_period if p_orm.weekly_ad else None,
+            unit_price=p_orm.unit_price,
+            unit_price_basis=p_orm.unit_price_basis,
+            discount_pct=p_orm.discount_pct,
         )
         products_with_details.append(details)
     return products_with_details
 
 
 async def search_products(
-    db: Session,
     q: str,
     ad_period: str = "current",
     limit: int = 100,
-    offset: int = 0
+    offset: int = 0,
+    sort: Optional[str] = None,
+    unit_basis: Optional[str] = None
 ) -> List[ProductWithDetails]:
     '''
     Searches for products using Full-Text Search (FTS) based on the query string.
     Includes joined loading for retailer and weekly ad details.
+    sort orders the matches by one of PRODUCT_SORTS (price, unit_price, discount); unit_basis keeps only
+    products priced per that basis.
+    Identical concurrent searches (same normalised query and parameters) are coalesced into one database query,
+    run in its own read session: a caller's request-scoped session may be closed while the shared query still runs.
     Returns a list of Pydantic ProductWithDetails models.
     '''
     if not q or not q.strip():
         raise HTTPException(
             status_code=400, detail="Search query 'q' cannot be empty.")
 
+    key = (normalise_text(q), ad_period, limit, offset, sort, unit_basis)
+    return await search_flight.do(key, lambda: _search_products_in_read_session(q, ad_period, limit, offset, sort, unit_basis))
+
+
+async def _search_products_in_read_session(*args) -> List[ProductWithDetails]:
+    db = database.open_read_session()
     try:
-        query_results_orm = (
+        return await _search_products(db, *args)
+    finally:
+        db.close()
+
+
+async def _search_products(
+    db: Session,
+    q: str,
+    ad_period: str,
+    limit: int,
+    offset: int,
+    sort: Optional[str],
+    unit_basis: Optional[str]
+) -> List[ProductWithDetails]:
+    try:
+        query = (
             db.query(ProductModel)
             .join(WeeklyAdModel, ProductModel.weekly_ad_id == WeeklyAdModel.id)
             .join(RetailerModel, ProductModel.retailer_id == RetailerModel.id)
             .filter(ProductModel.fts_vector.match(q, postgresql_regconfig='english'))
             .filter(WeeklyAdModel.ad_period == ad_period)
-            .options(
-                joinedload(ProductModel.retailer),
-                joinedload(ProductModel.weekly_ad)
-            )
-            .offset(offset)
-            .limit(limit)
-            .all()
+            .filter(ad_week_filter(db, ad_period))
         )
+        with stage_timer("db_query"):
+            query_results_orm = (
+                _apply_sort(query, sort, unit_basis)
+                .options(
+                    joinedload(ProductModel.retailer),
+                    joinedload(ProductModel.weekly_ad)
+                )
+                .offset(offset)
+                .limit(limit)
+                .all()
+            )
 
         products_with_details: List[ProductWithDetails] = []
         for p_orm in query_results_orm:
@@ -114,12 +185,18 @@ async def search_products(
                 weekly_ad_valid_from=p_orm.weekly_ad.valid_from if p_orm.weekly_ad else None,
                 weekly_ad_valid_to=p_orm.weekly_ad.valid_to if p_orm.weekly_ad else None,
                 weekly_ad_ad_period=p_orm.weekly_ad.ad_period if p_orm.weekly_ad else None,
+                unit_price=p_orm.unit_price,
+                unit_price_basis=p_orm.unit_price_basis,
+                discount_pct=p_orm.discount_pct,
             )
             products_with_details.append(details)
 
+        record_results("fts_search", len(products_with_details))
         return products_with_details
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error during product search service: {e}")
+        logger.error("Error during product search service: %s", e)
         raise HTTPException(
             status_code=500, detail=f"Internal server error during product search: {str(e)}")
 
@@ -131,7 +208,9 @@ async def get_products_by_filter(
     ad_period: str = "current",
     is_frontpage_only: bool = False,
     limit: int = 100,
-    offset: int = 0
+    offset: int = 0,
+    sort: Optional[str] = None,
+    unit_basis: Optional[str] = None
 ) -> List[ProductWithDetails]:
     if not store_ids and not categories:
         # If no filters are provided, perhaps return empty or raise error, depending on desired behavior
@@ -160,17 +239,18 @@ async def get_products_by_filter(
             query = query.filter(ProductModel.category.in_(categories))
     
     # Apply the ad_period filter (always applies)
-    query = query.filter(WeeklyAdModel.ad_period == ad_period) 
+    query = query.filter(WeeklyAdModel.ad_period == ad_period, ad_week_filter(db, ad_period))
 
-    products_orm = (
-        query.options(
-            joinedload(ProductModel.retailer),
-            joinedload(ProductModel.weekly_ad)
+    with stage_timer("db_query"):
+        products_orm = (
+            _apply_sort(query, sort, unit_basis).options(
+                joinedload(ProductModel.retailer),
+                joinedload(ProductModel.weekly_ad)
+            )
+            .offset(offset)
+            .limit(limit)
+            .all()
         )
-        .offset(offset)
-        .limit(limit)
-        .all()
-    )
 
     products_with_details: List[ProductWithDetails] = []
     for p_orm in products_orm:
@@ -194,7 +274,85 @@ async def get_products_by_filter(
             weekly_ad_valid_from=p_orm.weekly_ad.valid_from if p_orm.weekly_ad else None,
             weekly_ad_valid_to=p_orm.weekly_ad.valid_to if p_orm.weekly_ad else None,
             weekly_ad_ad_period=p_orm.weekly_ad.ad_period if p_orm.weekly_ad else None,
+            unit_price=p_orm.unit_price,
+            unit_price_basis=p_orm.unit_price_basis,
+            discount_pct=p_orm.discount_pct,
         )
         products_with_details.append(details)
 
+    record_results("filter", len(products_with_details))
     return products_with_details
+
+
+# One pass over the ad period's products: per-category rows, per-retailer rows and the grand total
+# come back from a single GROUPING SETS aggregate instead of one query per filter combination.
+_FACETS_SQL = """
+    SELECT p.category, p.retailer_id, r.name AS retailer_name,
+           GROUPING(p.category) AS category_grouped,
+           GROUPING(p.retailer_id, r.name) AS retailer_grouped,
+           count(*) AS count,
+           count(*) FILTER (WHERE p.is_frontpage) AS frontpage_count,
+           min(p.price) AS min_price,
+           max(p.price) AS max_price
+    FROM products p
+    JOIN weekly_ads wa ON p.weekly_ad_id = wa.id
+    JOIN retailers r ON p.retailer_id = r.id
+    WHERE wa.ad_period = :ad_period AND p.ad_week = ANY(:ad_weeks) {store_filter}
+    GROUP BY GROUPING SETS ((p.category), (p.retailer_id, r.name), ())
+"""
+
+
+def _facet_counts(row) -> dict:
+    return {
+        "count": row.count,
+        "frontpage_count": row.frontpage_count,
+        "min_price": float(row.min_price) if row.min_price is not None else None,
+        "max_price": float(row.max_price) if row.max_price is not None else None,
+    }
+
+
+def _query_facets(db: Session, ad_period: str, store_ids: List[int], version: str) -> ProductFacets:
+    params = {"ad_period": ad_period, "ad_weeks": list(period_weeks(db, ad_period))}
+    sql = text(_FACETS_SQL.format(store_filter="AND p.retailer_id IN :store_ids" if store_ids else ""))
+    if store_ids:
+        sql = sql.bindparams(bindparam("store_ids", expanding=True))
+        params["store_ids"] = store_ids
+    with stage_timer("db_query"):
+        rows = db.execute(sql, params).fetchall()
+
+    total = FacetCount(count=0, frontpage_count=0)
+    categories: List[CategoryFacet] = []
+    retailers: List[RetailerFacet] = []
+    for row in rows:
+        if not row.category_grouped:
+            categories.append(CategoryFacet(category=row.category, **_facet_counts(row)))
+        elif not row.retailer_grouped:
+            retailers.append(RetailerFacet(retailer_id=row.retailer_id, retailer_name=row.retailer_name, **_facet_counts(row)))
+        else:
+            total = FacetCount(**_facet_counts(row))
+    categories.sort(key=lambda facet: (-facet.count, facet.category or ""))
+    retailers.sort(key=lambda facet: facet.retailer_name)
+    return ProductFacets(ad_period=ad_period, catalog_version=version, total=total, categories=categories, retailers=retailers)
+
+
+async def get_product_facets(
+    db: Session,
+    ad_period: str = "current",
+    store_ids: List[str] = None
+) -> ProductFacets:
+    '''
+    Per-category and per-retailer product counts, frontpage counts and price ranges for an ad period,
+    optionally limited to some stores. Served from the catalog cache until the catalog version changes.
+    '''
+    try:
+        int_store_ids = sorted({int(id_str) for id_str in store_ids}) if store_ids else []
+    except ValueError:
+        raise HTTPException(
+            status_code=400, detail="Invalid store ID format. Store IDs must be integers.")
+
+    facets = catalog_cache.get_or_build(
+        db, "facets", (ad_period, tuple(int_store_ids)),
+        lambda version: _query_facets(db, ad_period, int_store_ids, version)
+    )
+    record_results("facets", len(facets.categories) + len(facets.retailers))
+    return facets
@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..models import COMPACT_EMBEDDING_DIM, EMBEDDING_STORAGE_MODE
+from ..schemas.data_schemas import ShoppingListResponse, ShoppingListItem, ShoppingListMatch, StoreBasket
+from ..utils.utils import truncate_embedding
+from ..utils.metrics import stage_timer, record_results
+from .model_clients import model_clients
+from .product_partitions import period_weeks
+
+logger = logging.getLogger(__name__)
+
+'''
+Shopping-list optimiser: resolves a whole list in one pass instead of one search per item.
+1. All items are embedded in a single batched call.
+2. One SQL statement unnests the items and, per item (LATERAL), unions the nearest products by embedding
+   with full-text matches on the item name.
+3. Each item keeps only its best-quality candidates: products that match the item name in full-text search and
+   are semantically close, else full-text matches, else semantically close products (_match_tier). A weak match
+   is never chosen over a better one just because it is cheaper.
+4. The candidates become an items x retailers price matrix in NumPy, from which the cheapest retailer per item
+   and every retailer's single-store basket are read off.
+'''
+
+MAX_SHOPPING_LIST_ITEMS = int(os.getenv("MAX_SHOPPING_LIST_ITEMS", "100"))
+CANDIDATES_PER_ITEM = int(os.getenv("SHOPPING_LIST_CANDIDATES_PER_ITEM", "40"))
+SHOPPING_LIST_SIMILARITY_THRESHOLD = float(os.getenv("SHOPPING_LIST_SIMILARITY_THRESHOLD", "0.6"))
+
+_CANDIDATES_SQL = """
+    SELECT q.item_idx, c.*
+    FROM unnest(CAST(:item_idx AS int[]), CAST(:terms AS text[]), CAST(:vectors AS text[])) AS q(item_idx, term, vec)
+    CROSS JOIN LATERAL (
+        (
+            SELECT p.id, p.name, p.price, p.unit, p.unit_price, p.unit_price_basis, p.retailer_id, r.name AS retailer_name,
+                   1 - (p.{column} <=> q.vec::vector) AS similarity,
+                   p.fts_vector @@ plainto_tsquery('english', q.term) AS fts_match
+            FROM products p
+            JOIN weekly_ads wa ON p.weekly_ad_id = wa.id
+            JOIN retailers r ON p.retailer_id = r.id
+            WHERE wa.ad_period = :ad_period AND p.ad_week = ANY(:ad_weeks) AND p.price IS NOT NULL AND p.{column} IS NOT NULL {store_filter}
+            ORDER BY p.{column} <=> q.vec::vector
+            LIMIT :k
+        )
+        UNION
+        (
+            SELECT p.id, p.name, p.price, p.unit, p.unit_price, p.unit_price_basis, p.retailer_id, r.name AS retailer_name,
+                   1 - (p.{column} <=> q.vec::vector) AS similarity,
+                   p.fts_vector @@ plainto_tsquery('english', q.term) AS fts_match
+            FROM products p
+            JOIN weekly_ads wa ON p.weekly_ad_id = wa.id
+            JOIN retailers r ON p.retailer_id = r.id
+            WHERE wa.ad_period = :ad_period AND p.ad_week = ANY(:ad_weeks) AND p.price IS NOT NULL {store_filter}
+              AND p.fts_vector @@ plainto_tsquery('english', q.term)
+            ORDER BY p.price
+            LIMIT :k
+        )
+    ) c
+"""
+
+
+def _vector_literal(embedding: List[float]) -> str:
+    return '[' + ','.join(map(str, embedding)) + ']'
+
+
+def _fetch_candidates(db: Session, items: List[str], embeddings: List[List[float]], ad_period: str, store_ids: Optional[List[int]]):
+    if EMBEDDING_STORAGE_MODE == "compact":
+        column = "embedding_compact"
+        embeddings = [truncate_embedding(e, COMPACT_EMBEDDING_DIM) for e in embeddings]
+    else:
+        column = "embedding"
+    params = {
+        "item_idx": list(range(len(items))),
+        "terms": items,
+        "vectors": [_vector_literal(e) for e in embeddings],
+        "ad_period": ad_period,
+        "ad_weeks": list(period_weeks(db, ad_period)),
+        "k": CANDIDATES_PER_ITEM,
+    }
+    store_filter = ""
+    if store_ids:
+        store_filter = "AND p.retailer_id = ANY(CAST(:store_ids AS bigint[]))"
+        params["store_ids"] = store_ids
+    sql = text(_CANDIDATES_SQL.format(column=column, store_filter=store_filter))
+    return db.execute(sql, params).fetchall()
+
+
+def _match(row) -> ShoppingListMatch:
+    return ShoppingListMatch(
+        product_id=row.id,
+        name=row.name,
+        price=float(row.price),
+        unit=row.unit,
+        unit_price=float(row.unit_price) if row.unit_price is not None else None,
+        unit_price_basis=row.unit_price_basis,
+        retailer_id=row.retailer_id,
+        retailer_name=row.retailer_name,
+        similarity=round(float(row.similarity), 4) if row.similarity is not None else None,
+    )
+
+
+def _match_tier(row) -> Optional[int]:
+    """Match quality of a candidate, best first: 0 full-text and semantic match, 1 full-text only,
+    2 semantic only (similarity at or above the threshold). None for candidates that match neither way."""
+    similar = row.similarity is not None and row.similarity >= SHOPPING_LIST_SIMILARITY_THRESHOLD
+    if row.fts_match:
+        return 0 if similar else 1
+    return 2 if similar else None
+
+
+def _best_matches(rows):
+    """Keeps, for each item, only the candidates of its best match tier."""
+    tiers = [_match_tier(row) for row in rows]
+    best_tier: Dict[int, int] = {}
+    for row, tier in zip(rows, tiers):
+        if tier is not None and tier < best_tier.get(row.item_idx, 3):
+            best_tier[row.item_idx] = tier
+    return [row for row, tier in zip(rows, tiers) if tier is not None and tier == best_tier[row.item_idx]]
+
+
+def _solve(items: List[str], rows, ad_period: str) -> ShoppingListResponse:
+    """Builds the items x retailers matrix of cheapest best-quality matches and reads the answers off it."""
+    rows = _best_matches(rows)
+    retailer_ids = sorted({row.retailer_id for row in rows})
+    retailer_names = {row.retailer_id: row.retailer_name for row in rows}
+    n_items, n_retailers = len(items), len(retailer_ids)
+    cost = np.full((n_items, n_retailers), np.inf)
+    choice = np.full((n_items, n_retailers), -1, dtype=np.int64)
+
+    if rows:
+        item_idx = np.fromiter((row.item_idx for row in rows), dtype=np.int64, count=len(rows))
+        column_of = {retailer_id: col for col, retailer_id in enumerate(retailer_ids)}
+        retailer_col = np.fromiter((column_of[row.retailer_id] for row in rows), dtype=np.int64, count=len(rows))
+        prices = np.fromiter((float(row.price) for row in rows), dtype=np.float64, count=len(rows))
+        # Cheapest candidate per (item, retailer) cell: sort by price, keep each cell's first row
+        order = np.argsort(prices, kind="stable")
+        cells = item_idx[order] * n_retailers + retailer_col[order]
+        _, first = np.unique(cells, return_index=True)
+        best_rows = order[first]
+        cost[item_idx[best_rows], retailer_col[best_rows]] = prices[best_rows]
+        choice[item_idx[best_rows], retailer_col[best_rows]] = best_rows
+
+    found = np.isfinite(cost)
+    # Cheapest retailer per item, shopping across stores
+    cheapest_col = np.argmin(cost, axis=1) if n_retailers else np.zeros(n_items, dtype=np.int64)
+    item_results = []
+    for i, item in enumerate(items):
+        match = None
+        if n_retailers and found[i, cheapest_col[i]]:
+            match = _match(rows[choice[i, cheapest_col[i]]])
+        item_results.append(ShoppingListItem(item=item, cheapest=match))
+    cheapest_price = cost.min(axis=1, initial=np.inf)
+    split_total = float(cheapest_price[np.isfinite(cheapest_price)].sum())
+
+    # Single-store baskets: items covered and their total per retailer
+    coverage = found.sum(axis=0)
+    totals = np.where(found, cost, 0.0).sum(axis=0)
+    stores = []
+    for col in np.lexsort((totals, -coverage)):
+        retailer_id = retailer_ids[col]
+        stores.append(StoreBasket(
+            retailer_id=retailer_id,
+            retailer_name=retailer_names[retailer_id],
+            total=round(float(totals[col]), 2),
+            items_found=int(coverage[col]),
+            missing_items=[items[i] for i in np.flatnonzero(~found[:, col])],
+            products=[_match(rows[choice[i, col]]) for i in np.flatnonzero(found[:, col])],
+        ))
+    return ShoppingListResponse(
+        ad_period=ad_period,
+        items=item_results,
+        split_total=round(split_total, 2),
+        best_single_store=stores[0] if stores else None,
+        stores=stores,
+    )
+
+
+async def optimise_shopping_list(
+    db: Session,
+    items: List[str],
+    ad_period: str = "current",
+    store_ids: Optional[List[int]] = None
+) -> ShoppingListResponse:
+    '''
+    Finds the cheapest matching product per item across retailers and the cheapest single-store basket
+    for a whole shopping list, with one embedding call and one database round trip.
+    '''
+    items = [item.strip() for item in items if item and item.strip()]
+    if not items:
+        raise HTTPException(status_code=400, detail="The shopping list is empty.")
+    if len(items) > MAX_SHOPPING_LIST_ITEMS:
+        raise HTTPException(
+            status_code=400, detail=f"The shopping list has {len(items)} items; the maximum is {MAX_SHOPPING_LIST_ITEMS}.")
+
+    with stage_timer("embed"):
+        embeddings = await asyncio.to_thread(model_clients.embed, "query_embedding", items, "RETRIEVAL_QUERY")
+    if not embeddings or any(not embedding for embedding in embeddings):
+        raise HTTPException(status_code=503, detail="Could not generate embeddings for the shopping list.")
+
+    with stage_timer("db_query"):
+        rows = _fetch_candidates(db, items, embeddings, ad_period, store_ids)
+    with stage_timer("solve"):
+        result = _solve(items, rows, ad_period)
+
+    logger.info("Shopping list of %s items: %s candidates, %s retailers, split total %s", len(items), len(rows), len(result.stores), result.split_total)
+    record_results("shopping_list", sum(1 for item in result.items if item.cheapest))
+    return result
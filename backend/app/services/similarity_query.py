@@ -1,56 +1,47 @@
+import asyncio
 import logging
 import os
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import text, func
+from sqlalchemy import text, func, select
 from typing import List, Optional
-import google.generativeai as genai
-from dotenv import load_dotenv
 # from pgvector.sqlalchemy import Vector
 
-from ..models import Product as ProductModel, WeeklyAd as WeeklyAdModel, Retailer as RetailerModel
+from ..models import Product as ProductModel, WeeklyAd as WeeklyAdModel, Retailer as RetailerModel, COMPACT_EMBEDDING_DIM, EMBEDDING_STORAGE_MODE
 from ..schemas.data_schemas import ProductWithDetails
+from ..utils.utils import truncate_embedding
+from ..utils.metrics import stage_timer, record_tokens, record_results
+from ..utils.logging_config import debug_sampled
+from .. import database
+from .model_providers import get_provider
+from .model_clients import model_clients
+from .product_partitions import ad_week_filter, period_weeks
+from ..utils.single_flight import SingleFlight, normalise_text, text_digest
 
 '''
 Similarity Query Service: Uses vector embeddings to find products similar to a natural language query.
 1. Expands the query using an LLM to get a more comprehensive list of items for semantic search.
 2. Generates an embedding for the user's query and finds the most similar products 
 using cosine similarity with the stored product embeddings.
+3. When compact embeddings are stored, search is two-stage: coarse candidates come from the
+compact (truncated) vector index, then get reranked on the full-precision embedding.
+4. Identical concurrent searches (same normalised query, chat history and parameters) share one
+expansion, embedding and query, and the result is reused for SIMILARITY_RESULT_TTL_SECONDS.
 '''
 
-load_dotenv()
-
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-GEMINI_EMBEDDINGS_MODEL = os.getenv("GEMINI_EMBEDDINGS_MODEL")
-GEMINI_GENERATIVE_MODEL_NAME = os.getenv("GEMINI_MODEL")
-
-# --- Top-level initializations ---
-generative_model = None
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-    try:
-        generative_model = genai.GenerativeModel(GEMINI_GENERATIVE_MODEL_NAME)
-    except Exception as e:
-        logger.error(
-            f"Failed to initialize GenerativeModel ('{GEMINI_GENERATIVE_MODEL_NAME}'): {e}"
-        )
-else:
-    logger.warning(
-        "GEMINI_API_KEY not found in environment variables."
-    )
-
-
-if not GEMINI_EMBEDDINGS_MODEL:
-    logger.warning("GEMINI_EMBEDDINGS_MODEL not found in environment variables. Similarity search will fail.")
-
 useExpandedQuery = True
 
 # Default search parameters - adjust these to control search behavior
 DEFAULT_SEARCH_LIMIT = 50
 DEFAULT_SIMILARITY_THRESHOLD = 0.5
 
+# Two-stage search: how many compact-vector candidates to fetch per requested result before reranking
+RERANK_CANDIDATE_MULTIPLIER = int(os.getenv("RERANK_CANDIDATE_MULTIPLIER", "4"))
+
+SIMILARITY_RESULT_TTL_SECONDS = float(os.getenv("SIMILARITY_RESULT_TTL_SECONDS", "30"))
+similarity_flight = SingleFlight("similarity_search", SIMILARITY_RESULT_TTL_SECONDS)
+
 def _expand_query_with_llm(query_text: str, chat_history: Optional[str] = None) -> str:
     """
     Expands a user query using an LLM to get a more comprehensive list of items for semantic search,
@@ -60,7 +51,7 @@ def _expand_query_with_llm(query_text: str, chat_history: Optional[str] = None)
         logger.warning("Empty query text provided for expansion.")
         return ""
 
-    if not generative_model:
+    if not get_provider().can_generate():
         logger.error("Generative model not available. Cannot expand query.")
         return f"CHAT_RESPONSE: Sorry, the AI model is not available right now."
 
@@ -122,7 +113,8 @@ CURRENT USER QUERY:
 - Query: "{query_text}"
 - Response:
 """
-        response = generative_model.generate_content(prompt)
+        response = model_clients.generate("query_expansion", prompt)
+        record_tokens("query_expansion", getattr(response, "usage_metadata", None))
 
         if response.parts:
             llm_response = "".join(part.text for part in response.parts).strip()
@@ -130,54 +122,44 @@ CURRENT USER QUERY:
                 llm_response = llm_response[1:-1].strip()
 
             if ("MESSAGE:" in llm_response and "TERMS:" in llm_response) or "CHAT_RESPONSE:" in llm_response:
-                logger.info(
-                    f"LLM Response for '{query_text}': '{llm_response}'"
-                )
+                logger.debug("LLM Response for '%s': '%s'", query_text, llm_response)
                 return llm_response
             else:
                 # If LLM fails to follow instructions, fallback to treating as search
-                logger.warning(f"LLM did not provide a prefixed response. Treating as search. Response: {llm_response}")
+                logger.warning("LLM did not provide a prefixed response. Treating as search. Response: %s", llm_response)
                 return f'MESSAGE: I found some relevant products for you!\nTERMS: {llm_response}'
         else:
-            logger.warning(
-                f"LLM did not return a response for query: '{query_text}'. Treating as standard search."
-            )
+            logger.warning("LLM did not return a response for query: '%s'. Treating as standard search.", query_text)
             return f'MESSAGE: I found some relevant products for you!\nTERMS: {query_text}'
 
     except Exception as e:
-        logger.error(f"Error during query expansion for '{query_text}': {e}")
+        logger.error("Error during query expansion for '%s': %s", query_text, e)
         # Fallback to a chat response in case of an error
         return "CHAT_RESPONSE: I'm sorry, I encountered an error. Please try again."
 
 
 def _generate_query_embedding(query_text: str) -> Optional[List[float]]:
     """
-    Generates/returns an embedding for the user's query text using Gemini API.
+    Generates/returns an embedding for the user's query text using the configured embedding provider.
     """
     if not query_text.strip():
         logger.warning("Empty query text provided for embedding generation.")
         return None
         
     try:
-        result = genai.embed_content(
-            model=GEMINI_EMBEDDINGS_MODEL,
-            content=[query_text],  # API expects a list
-            task_type="RETRIEVAL_QUERY"
-        )
-        embeddings = result.get('embedding', [])
-        logger.info(f"======== query embeddings: {embeddings[0][:5]} ...")
-        if embeddings:
+        embeddings = model_clients.embed("query_embedding", [query_text], task_type="RETRIEVAL_QUERY")
+        if embeddings and embeddings[0]:
+            logger.debug("Query embedding prefix: %s ...", embeddings[0][:5])
             return embeddings[0]  # Return the first (and only) embedding
         else:
-            logger.error("No embeddings returned from Gemini API.")
+            logger.error("No embeddings returned by the embedding provider.")
             return None
     except Exception as e:
-        logger.error(f"Error generating query embedding: {e}")
+        logger.error("Error generating query embedding: %s", e)
         return None
 
 
 async def similarity_search_products(
-    db: Session,
     query: str,
     chat_history: Optional[str] = None,
     ad_period: str = "current",
@@ -187,8 +169,10 @@ async def similarity_search_products(
     """
     Performs similarity search on products using vector embeddings.
     
+    Identical concurrent searches are coalesced into one run, which opens its own read session (a caller's
+    request-scoped session may be closed while the shared run still uses it).
+
     Args:
-        db: Database session
         query: Natural language query (e.g., "high protein sales")
         chat_history: Previous chat messages for context (optional)
         ad_period: Which ad period to search (default: "current")
@@ -198,9 +182,32 @@ async def similarity_search_products(
     Returns:
         Dictionary with keys: query_type, llm_message, query, results_count, products
     """
-    logger.info(f"Starting similarity search for query: '{query}' with limit: {limit}")
+    key = (normalise_text(query), text_digest(chat_history), ad_period, limit, similarity_threshold)
+    return await similarity_flight.do(
+        key, lambda: _similarity_search_in_read_session(query, chat_history, ad_period, limit, similarity_threshold))
+
+
+async def _similarity_search_in_read_session(*args) -> dict:
+    db = database.open_read_session()
+    try:
+        return await _similarity_search_products(db, *args)
+    finally:
+        db.close()
+
+
+async def _similarity_search_products(
+    db: Session,
+    query: str,
+    chat_history: Optional[str],
+    ad_period: str,
+    limit: int,
+    similarity_threshold: float
+) -> dict:
+    logger.info("Starting similarity search for query: '%s' with limit: %s", query, limit)
 
-    llm_response_text = _expand_query_with_llm(query, chat_history)
+    with stage_timer("llm_expand"):
+        # Model calls run in a worker thread so the event loop keeps serving (and coalescing) other requests
+        llm_response_text = await asyncio.to_thread(_expand_query_with_llm, query, chat_history)
 
     if llm_response_text.startswith("CHAT_RESPONSE:"):
         chat_message = llm_response_text.replace("CHAT_RESPONSE:", "").strip()
@@ -239,17 +246,18 @@ async def similarity_search_products(
             elif line.startswith("TERMS:"):
                 expanded_query_terms = line.replace("TERMS:", "").strip()
         
-        logger.info(f"Extracted LLM message: '{llm_message_content}', terms: '{expanded_query_terms}'")
+        logger.info("Extracted LLM message: '%s', terms: '%s'", llm_message_content, expanded_query_terms)
     else:
         # Fallback for malformed responses
         llm_message_content = "I found some relevant products for you!"
         expanded_query_terms = query
-        logger.info(f"Using fallback LLM message: '{llm_message_content}', terms: '{expanded_query_terms}'")
+        logger.info("Using fallback LLM message: '%s', terms: '%s'", llm_message_content, expanded_query_terms)
     
     # Use expanded query for embedding if available, otherwise use original
     expanded_query = expanded_query_terms if useExpandedQuery and expanded_query_terms else query
     
-    query_embedding = _generate_query_embedding(expanded_query)
+    with stage_timer("embed"):
+        query_embedding = await asyncio.to_thread(_generate_query_embedding, expanded_query)
     if not query_embedding:
         logger.error("Failed to generate embedding for query. Returning empty results.")
         return {
@@ -262,9 +270,16 @@ async def similarity_search_products(
     
     try:
         # Option 1: Using SQLAlchemy ORM with pgvector operators
-        similarity_expr = 1 - ProductModel.embedding.cosine_distance(query_embedding)
+        if EMBEDDING_STORAGE_MODE == "compact":
+            # Only the compact vector is stored, so it is used for both ranking and the threshold
+            embedding_column = ProductModel.embedding_compact
+            distance_expr = embedding_column.cosine_distance(truncate_embedding(query_embedding, COMPACT_EMBEDDING_DIM))
+        else:
+            embedding_column = ProductModel.embedding
+            distance_expr = embedding_column.cosine_distance(query_embedding)
+        similarity_expr = 1 - distance_expr
         
-        query_results_orm = (
+        query_orm = (
             db.query(
                 ProductModel,
                 RetailerModel.name.label('retailer_name'),
@@ -275,43 +290,54 @@ async def similarity_search_products(
             )
             .join(WeeklyAdModel, ProductModel.weekly_ad_id == WeeklyAdModel.id)
             .join(RetailerModel, ProductModel.retailer_id == RetailerModel.id)
-            .filter(ProductModel.embedding.isnot(None))
-            .filter(WeeklyAdModel.ad_period == ad_period)
+            .filter(embedding_column.isnot(None))
+            .filter(WeeklyAdModel.ad_period == ad_period, ad_week_filter(db, ad_period))
             .filter(similarity_expr >= similarity_threshold)
-            .order_by(ProductModel.embedding.cosine_distance(query_embedding))
-            .limit(limit)
-            .all()
         )
+        if EMBEDDING_STORAGE_MODE == "both":
+            # Stage 1: coarse candidates from the compact HNSW index. Stage 2 (below) reranks them on the full vector.
+            query_orm = query_orm.filter(ProductModel.id.in_(_compact_candidate_ids(db, query_embedding, ad_period, limit)))
+        with stage_timer("db_query"):
+            query_results_orm = (
+                query_orm
+                .order_by(distance_expr)
+                .limit(limit)
+                .all()
+            )
         
         # Convert results to ProductWithDetails objects
-        products_with_details: List[ProductWithDetails] = []
-        for row in query_results_orm:
-            product, retailer_name, valid_from, valid_to, ad_period, similarity_score = row
-            details = ProductWithDetails(
-                id=product.id,
-                name=product.name,
-                price=product.price,
-                original_price=product.original_price,
-                unit=product.unit,
-                description=product.description,
-                category=product.category,
-                promotion_details=product.promotion_details,
-                promotion_from=product.promotion_from,
-                promotion_to=product.promotion_to,
-                is_frontpage=product.is_frontpage,
-                emoji=product.emoji,
-                retailer=retailer_name,
-                retailer_id=product.retailer_id,
-                weekly_ad_id=product.weekly_ad_id,
-                retailer_name=retailer_name,
-                weekly_ad_valid_from=valid_from,
-                weekly_ad_valid_to=valid_to,
-                weekly_ad_ad_period=ad_period,
-            )
-            logger.info(f"+++ Product ID: {product.id}, Name: '{product.name}', Similarity Score: {similarity_score:.4f}")
-            products_with_details.append(details)
-            
-        logger.info(f">>>>>>> ORM method:Successfully converted {len(products_with_details)} results to ProductWithDetails")
+        with stage_timer("serialize"):
+            products_with_details: List[ProductWithDetails] = []
+            for row in query_results_orm:
+                product, retailer_name, valid_from, valid_to, ad_period, similarity_score = row
+                details = ProductWithDetails(
+                    id=product.id,
+                    name=product.name,
+                    price=product.price,
+                    original_price=product.original_price,
+                    unit=product.unit,
+                    description=product.description,
+                    category=product.category,
+                    promotion_details=product.promotion_details,
+                    promotion_from=product.promotion_from,
+                    promotion_to=product.promotion_to,
+                    is_frontpage=product.is_frontpage,
+                    emoji=product.emoji,
+                    retailer=retailer_name,
+                    retailer_id=product.retailer_id,
+                    weekly_ad_id=product.weekly_ad_id,
+                    retailer_name=retailer_name,
+                    weekly_ad_valid_from=valid_from,
+                    weekly_ad_valid_to=valid_to,
+                    weekly_ad_ad_period=ad_period,
+                    unit_price=product.unit_price,
+                    unit_price_basis=product.unit_price_basis,
+                    discount_pct=product.discount_pct,
+                )
+                debug_sampled(logger, "+++ Product ID: %s, Name: '%s', Similarity Score: %.4f", product.id, product.name, similarity_score)
+                products_with_details.append(details)
+
+        logger.debug("ORM method: successfully converted %s results to ProductWithDetails", len(products_with_details))
         result_dict = {
             "query_type": "SEARCH_RESULT",
             "llm_message": llm_message_content,
@@ -319,11 +345,12 @@ async def similarity_search_products(
             "results_count": len(products_with_details),
             "products": products_with_details
         }
-        logger.info(f"Returning search result with message: '{llm_message_content}'")
+        record_results("similarity_search", len(products_with_details))
+        logger.info("Returning search result with message: '%s'", llm_message_content)
         return result_dict
         
     except Exception as e:
-        logger.error(f"Error during similarity search: {e}")
+        logger.error("Error during similarity search: %s", e)
         # Fallback to the parameter binding approach if ORM approach fails
         fallback_products = await _similarity_search_fallback(db, query_embedding, ad_period, limit, similarity_threshold)
         return {
@@ -335,6 +362,24 @@ async def similarity_search_products(
         }
 
 
+def _compact_candidate_ids(db: Session, query_embedding: List[float], ad_period: str, limit: int):
+    """
+    Builds the stage-1 subquery: ids of the nearest products by compact embedding,
+    over-fetched by RERANK_CANDIDATE_MULTIPLIER so the full-precision rerank has room to reorder.
+    """
+    compact_query_embedding = truncate_embedding(query_embedding, COMPACT_EMBEDDING_DIM)
+    candidates = (
+        db.query(ProductModel.id)
+        .join(WeeklyAdModel, ProductModel.weekly_ad_id == WeeklyAdModel.id)
+        .filter(ProductModel.embedding_compact.isnot(None))
+        .filter(WeeklyAdModel.ad_period == ad_period, ad_week_filter(db, ad_period))
+        .order_by(ProductModel.embedding_compact.cosine_distance(compact_query_embedding))
+        .limit(limit * RERANK_CANDIDATE_MULTIPLIER)
+        .subquery()
+    )
+    return select(candidates.c.id)
+
+
 async def _similarity_search_fallback(
     db: Session,
     query_embedding: List[float],
@@ -348,29 +393,36 @@ async def _similarity_search_fallback(
     try:
         logger.info("Using fallback SQL approach for similarity search")
         
+        if EMBEDDING_STORAGE_MODE == "compact":
+            embedding_column = "embedding_compact"
+            query_embedding = truncate_embedding(query_embedding, COMPACT_EMBEDDING_DIM)
+        else:
+            embedding_column = "embedding"
         vector_str = '[' + ','.join(map(str, query_embedding)) + ']'
         
         sql_query = text(f"""
             SELECT p.*, r.name as retailer_name, wa.valid_from, wa.valid_to, wa.ad_period,
-                   (1 - (p.embedding <=> '{vector_str}'::vector)) as similarity_score
+                   (1 - (p.{embedding_column} <=> '{vector_str}'::vector)) as similarity_score
             FROM products p
             JOIN weekly_ads wa ON p.weekly_ad_id = wa.id
             JOIN retailers r ON p.retailer_id = r.id
-            WHERE p.embedding IS NOT NULL 
+            WHERE p.{embedding_column} IS NOT NULL 
             AND wa.ad_period = :ad_period
-            AND (1 - (p.embedding <=> '{vector_str}'::vector)) >= :similarity_threshold
-            ORDER BY p.embedding <=> '{vector_str}'::vector
+            AND p.ad_week = ANY(:ad_weeks)
+            AND (1 - (p.{embedding_column} <=> '{vector_str}'::vector)) >= :similarity_threshold
+            ORDER BY p.{embedding_column} <=> '{vector_str}'::vector
             LIMIT :limit
         """)
         
         result = db.execute(sql_query, {
             "ad_period": ad_period,
+            "ad_weeks": list(period_weeks(db, ad_period)),
             "similarity_threshold": similarity_threshold,
             "limit": limit
         })
         
         rows = result.fetchall()
-        logger.info(f"Fallback found {len(rows)} products matching similarity search")
+        logger.info("Fallback found %s products matching similarity search", len(rows))
         
         # Convert results to ProductWithDetails objects
         products_with_details: List[ProductWithDetails] = []
@@ -395,11 +447,14 @@ async def _similarity_search_fallback(
                 weekly_ad_valid_from=row.valid_from,
                 weekly_ad_valid_to=row.valid_to,
                 weekly_ad_ad_period=row.ad_period,
+                unit_price=row.unit_price,
+                unit_price_basis=row.unit_price_basis,
+                discount_pct=row.discount_pct,
             )
             products_with_details.append(details)
             
         return products_with_details
         
     except Exception as e:
-        logger.error(f"Error during fallback similarity search: {e}")
+        logger.error("Error during fallback similarity search: %s", e)
         return [] 
\ No newline at end of file
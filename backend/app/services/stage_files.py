@@ -0,0 +1,120 @@
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .job_queue import JOB_RETENTION_DAYS
+
+logger = logging.getLogger(__name__)
+
+'''
+Input and output files of the ingestion stages (the uploaded PDF, its extraction and enhanced JSON), kept in the
+Postgres stage_files table so an ad's next stage can run on any worker. Worker dynos have their own short-lived
+disks: a file written by one worker is not on the disk of the worker that claims the next stage.
+Stages still read and write their usual local paths under backend/pdf: save() copies a local file into the table
+and fetch() writes the stored copy back to the same path on whichever dyno needs it.
+Files are stored under "<directory>/<filename>" (e.g. "uploads/ad.pdf"), with the source file's modification time,
+so fetch() keeps a local copy that is already current. A pipeline run deletes its files once the ad is loaded;
+prune removes the files of abandoned runs after JOB_RETENTION_DAYS, like finished jobs.
+The standalone jobs over a whole directory (enhance or load "all") work the same way: fetch_directory brings every
+stored file of the directory to the local disk first, and save_directory stores the outputs they wrote.
+'''
+
+_SAVE_SQL = text("""
+    INSERT INTO stage_files (name, content, modified_at, updated_at)
+    VALUES (:name, :content, to_timestamp(:modified_at), now())
+    ON CONFLICT (name) DO UPDATE SET content = EXCLUDED.content, modified_at = EXCLUDED.modified_at, updated_at = now()
+""")
+
+_MODIFIED_SQL = text("SELECT extract(epoch FROM modified_at) AS modified_at FROM stage_files WHERE name = :name")
+
+_CONTENT_SQL = text("SELECT content, extract(epoch FROM modified_at) AS modified_at FROM stage_files WHERE name = :name")
+
+_DIRECTORY_SQL = text("""
+    SELECT name, extract(epoch FROM modified_at) AS modified_at FROM stage_files WHERE name LIKE :prefix ORDER BY name
+""")
+
+_DELETE_SQL = text("DELETE FROM stage_files WHERE name = ANY(:names)")
+
+_PRUNE_SQL = text("DELETE FROM stage_files WHERE updated_at < now() - make_interval(secs => :older_than_seconds)")
+
+
+def file_name(path: Path) -> str:
+    """Name a local stage file is stored under: its directory and filename."""
+    return f"{path.parent.name}/{path.name}"
+
+
+def save(db: Session, path: Path) -> None:
+    """Stores (or replaces) the local file at `path` and commits."""
+    db.execute(_SAVE_SQL, {"name": file_name(path), "content": path.read_bytes(), "modified_at": path.stat().st_mtime})
+    db.commit()
+
+
+def fetch(db: Session, path: Path) -> bool:
+    """
+    Makes the stored copy of `path` available at that local path, unless the local file is already as recent.
+    Returns whether the file now exists locally (a file that was never stored counts only if it is on this disk).
+    """
+    name = file_name(path)
+    stored = db.execute(_MODIFIED_SQL, {"name": name}).first()
+    db.commit()
+    if stored is None:
+        return path.exists()
+    modified_at = float(stored.modified_at)
+    if path.exists() and path.stat().st_mtime >= modified_at:
+        return True
+
+    row = db.execute(_CONTENT_SQL, {"name": name}).first()
+    db.commit()
+    if row is None: # Deleted meanwhile
+        return path.exists()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(bytes(row.content))
+    os.replace(tmp_path, path)
+    # Keep the stored modification time, so stages comparing file ages (enhance) see the same order on every dyno
+    os.utime(path, (float(row.modified_at), float(row.modified_at)))
+    logger.info(f"Fetched stage file {name} from the database.")
+    return True
+
+
+def _stored_in(db: Session, directory: Path) -> Dict[str, float]:
+    """{filename: stored modification time} of the files stored for `directory`."""
+    rows = db.execute(_DIRECTORY_SQL, {"prefix": f"{directory.name}/%"}).fetchall()
+    db.commit()
+    return {row.name.split("/", 1)[1]: float(row.modified_at) for row in rows}
+
+
+def fetch_directory(db: Session, directory: Path) -> List[Path]:
+    """Fetches every file stored for `directory` (e.g. EXTRACTIONS_DIR) to it. Returns the local paths."""
+    return [directory / filename for filename in _stored_in(db, directory) if fetch(db, directory / filename)]
+
+
+def save_directory(db: Session, directory: Path, pattern: str = "*") -> List[Path]:
+    """Stores the files of `directory` matching `pattern` that are newer than their stored copy. Returns them."""
+    stored = _stored_in(db, directory)
+    saved = []
+    for path in sorted(directory.glob(pattern)):
+        if path.is_file() and path.stat().st_mtime > stored.get(path.name, float("-inf")):
+            save(db, path)
+            saved.append(path)
+    return saved
+
+
+def delete(db: Session, paths: Sequence[Path]) -> None:
+    """Removes the stored copies of `paths` (local files are kept) and commits."""
+    if paths:
+        db.execute(_DELETE_SQL, {"names": [file_name(path) for path in paths]})
+        db.commit()
+
+
+def prune(db: Session, older_than_days: float = JOB_RETENTION_DAYS) -> int:
+    """Deletes stage files stored more than older_than_days ago. Returns the number deleted."""
+    deleted = db.execute(_PRUNE_SQL, {"older_than_seconds": older_than_days * 86400}).rowcount
+    db.commit()
+    if deleted:
+        logger.info(f"Pruned {deleted} stage files older than {older_than_days:g} days.")
+    return deleted
@@ -0,0 +1,175 @@
+import heapq
+import logging
+import os
+import re
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..models import Product as ProductModel, WeeklyAd as WeeklyAdModel
+from ..schemas.data_schemas import Suggestion, SuggestResponse
+from ..utils.metrics import record_cache, record_results
+from .catalog_cache import catalog_cache
+from .product_partitions import ad_week_filter, period_weeks
+
+logger = logging.getLogger(__name__)
+
+'''
+Typeahead suggestions for the search box, answered from memory so keystrokes do not reach Postgres.
+- The index is a sorted array of normalised keys (product names, categories and gen_terms, each also keyed from
+  every word start, so "bre" finds "chicken breast") searched with bisect. Prefixes of up to SHORT_PREFIX_LENGTH
+  characters, which match too many keys to rank per request, have their top suggestions precomputed; longer
+  prefixes rank every key in their range by count, so a popular suggestion late in the range is never missed.
+- One index per ad period is kept in the catalog cache and rebuilt when the catalog version changes.
+- Prefixes with no match (typos) fall back to a pg_trgm similarity query; its answers (but not its failures) are
+  memoised on the index, so a repeated miss is also served from memory.
+'''
+
+SUGGEST_MAX_LIMIT = 20
+SHORT_PREFIX_LENGTH = int(os.getenv("SUGGEST_SHORT_PREFIX_LENGTH", "4")) # Prefixes up to this length are answered from precomputed top lists
+TRIGRAM_MIN_LENGTH = 3
+TRIGRAM_CACHE_SIZE = int(os.getenv("SUGGEST_TRIGRAM_CACHE_SIZE", "2048"))
+
+_NON_WORD = re.compile(r"[^a-z0-9&']+")
+_KIND_ORDER = {"category": 0, "term": 1, "product": 2}
+
+_TRIGRAM_SQL = text("""
+    SELECT p.name, count(*) AS count, max(similarity(p.name, :q)) AS score
+    FROM products p
+    JOIN weekly_ads wa ON p.weekly_ad_id = wa.id
+    WHERE wa.ad_period = :ad_period AND p.ad_week = ANY(:ad_weeks) AND p.name % :q
+    GROUP BY p.name
+    ORDER BY score DESC, count DESC
+    LIMIT :limit
+""")
+
+
+def _normalise(value: str) -> str:
+    return " ".join(_NON_WORD.sub(" ", (value or "").lower()).split())
+
+
+class SuggestIndex:
+    def __init__(self, entries: Dict[Tuple[str, str], Tuple[str, int]]):
+        """entries: {(normalised text, kind): (display text, product count)}"""
+        self.suggestions: List[Suggestion] = []
+        pairs: List[Tuple[str, int]] = []
+        for (key, kind), (display, count) in entries.items():
+            suggestion_id = len(self.suggestions)
+            self.suggestions.append(Suggestion(text=display, kind=kind, count=count))
+            words = key.split(" ")
+            for start in range(len(words)):
+                pairs.append((" ".join(words[start:]), suggestion_id))
+        pairs.sort()
+        self._keys = [key for key, _ in pairs]
+        self._ids = [suggestion_id for _, suggestion_id in pairs]
+
+        short: Dict[str, set] = {}
+        for key, suggestion_id in pairs:
+            for length in range(1, min(SHORT_PREFIX_LENGTH, len(key)) + 1):
+                short.setdefault(key[:length], set()).add(suggestion_id)
+        self._short_top = {prefix: self._top(ids, SUGGEST_MAX_LIMIT) for prefix, ids in short.items()}
+
+        self._trigram_cache: "OrderedDict[Tuple[str, int], List[Suggestion]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.suggestions)
+
+    def _rank_key(self, i: int):
+        suggestion = self.suggestions[i]
+        return (-suggestion.count, _KIND_ORDER[suggestion.kind], len(suggestion.text), suggestion.text)
+
+    def _top(self, ids, limit: int) -> List[int]:
+        return heapq.nsmallest(limit, ids, key=self._rank_key)
+
+    def lookup(self, prefix: str, limit: int) -> List[Suggestion]:
+        prefix = _normalise(prefix)
+        if not prefix:
+            return []
+        if len(prefix) <= SHORT_PREFIX_LENGTH:
+            ranked = self._short_top.get(prefix, [])
+        else:
+            lo = bisect_left(self._keys, prefix)
+            hi = bisect_left(self._keys, prefix + "\uffff", lo)
+            ranked = self._top(set(self._ids[lo:hi]), limit)
+        return [self.suggestions[i] for i in ranked[:limit]]
+
+    def trigram_cached(self, key: Tuple[str, int]):
+        with self._lock:
+            if key in self._trigram_cache:
+                self._trigram_cache.move_to_end(key)
+                return self._trigram_cache[key]
+            return None
+
+    def remember_trigram(self, key: Tuple[str, int], suggestions: List[Suggestion]):
+        with self._lock:
+            self._trigram_cache[key] = suggestions
+            if len(self._trigram_cache) > TRIGRAM_CACHE_SIZE:
+                self._trigram_cache.popitem(last=False)
+
+
+def build_suggest_index(db: Session, ad_period: str) -> SuggestIndex:
+    """Reads the ad period's product names, categories and gen_terms and builds the prefix index."""
+    rows = (
+        db.query(ProductModel.name, ProductModel.category, ProductModel.gen_terms)
+        .join(WeeklyAdModel, ProductModel.weekly_ad_id == WeeklyAdModel.id)
+        .filter(WeeklyAdModel.ad_period == ad_period, ad_week_filter(db, ad_period))
+        .all()
+    )
+    entries: Dict[Tuple[str, str], Tuple[str, int]] = {}
+
+    def add(value: str, kind: str):
+        key = _normalise(value)
+        if key:
+            display, count = entries.get((key, kind), (value.strip(), 0))
+            entries[(key, kind)] = (display, count + 1)
+
+    for name, category, gen_terms in rows:
+        add(name, "product")
+        if category:
+            add(category, "category")
+        # gen_terms is a comma-separated keyword list; count each term once per product
+        for term in {term.strip() for term in (gen_terms or "").split(",") if term.strip()}:
+            add(term, "term")
+
+    index = SuggestIndex(entries)
+    logger.info("Built suggest index for '%s': %s suggestions from %s products.", ad_period, len(index), len(rows))
+    return index
+
+
+def get_suggest_index(db: Session, ad_period: str = "current") -> SuggestIndex:
+    return catalog_cache.get_or_build(db, "suggest", ad_period, lambda version: build_suggest_index(db, ad_period))
+
+
+async def suggest(db: Session, q: str, ad_period: str = "current", limit: int = 10) -> SuggestResponse:
+    '''
+    Returns up to `limit` suggestions for the typed prefix from the in-memory index,
+    falling back to pg_trgm similarity (memoised per catalog version) when nothing matches.
+    '''
+    limit = min(limit, SUGGEST_MAX_LIMIT)
+    index = get_suggest_index(db, ad_period)
+    suggestions = index.lookup(q, limit)
+    if suggestions or len(_normalise(q)) < TRIGRAM_MIN_LENGTH:
+        record_results("suggest", len(suggestions))
+        return SuggestResponse(query=q, source="index", suggestions=suggestions)
+
+    key = (_normalise(q), limit)
+    suggestions = index.trigram_cached(key)
+    record_cache("suggest_trigram", suggestions is not None)
+    if suggestions is None:
+        try:
+            rows = db.execute(_TRIGRAM_SQL, {"q": key[0], "ad_period": ad_period, "ad_weeks": list(period_weeks(db, ad_period)), "limit": limit}).fetchall()
+            suggestions = [Suggestion(text=row.name, kind="product", count=row.count) for row in rows]
+        except Exception as e:
+            # pg_trgm missing or the query failed; typeahead degrades to no suggestions, and the next request retries
+            logger.warning("Trigram suggest fallback failed for '%s': %s", q, e)
+            db.rollback()
+            record_results("suggest", 0)
+            return SuggestResponse(query=q, source="trigram", suggestions=[])
+        index.remember_trigram(key, suggestions)
+    record_results("suggest", len(suggestions))
+    return SuggestResponse(query=q, source="trigram", suggestions=suggestions)
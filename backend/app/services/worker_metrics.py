@@ -0,0 +1,51 @@
+import json
+import logging
+import os
+from typing import Any, Dict
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..utils import metrics
+
+logger = logging.getLogger(__name__)
+
+'''
+Metrics of worker processes, published to Postgres. Extraction, enhancement and embedding run in workers, so their
+token counts, cache hit rates and model slot waits live in those processes, which serve no HTTP (Heroku routes
+no traffic to worker dynos). Each worker upserts its metrics.snapshot() into worker_metrics with every heartbeat,
+and GET /metrics on the web process renders the snapshots of workers seen in the last WORKER_METRICS_MAX_AGE_SECONDS
+next to its own, with a worker label. Rows of workers gone for longer are deleted by prune.
+'''
+
+WORKER_METRICS_MAX_AGE_SECONDS = float(os.getenv("WORKER_METRICS_MAX_AGE_SECONDS", "600"))
+
+_PUBLISH_SQL = text("""
+    INSERT INTO worker_metrics (worker_id, snapshot, updated_at)
+    VALUES (:worker_id, CAST(:snapshot AS jsonb), now())
+    ON CONFLICT (worker_id) DO UPDATE SET snapshot = EXCLUDED.snapshot, updated_at = now()
+""")
+
+_RECENT_SQL = text("""
+    SELECT worker_id, snapshot FROM worker_metrics WHERE updated_at >= now() - make_interval(secs => :max_age)
+""")
+
+_PRUNE_SQL = text("DELETE FROM worker_metrics WHERE updated_at < now() - make_interval(secs => :max_age)")
+
+
+def publish(db: Session, worker_id: str) -> None:
+    """Stores this process's current metrics under `worker_id` and commits."""
+    db.execute(_PUBLISH_SQL, {"worker_id": worker_id, "snapshot": json.dumps(metrics.snapshot())})
+    db.commit()
+
+
+def recent(db: Session, max_age_seconds: float = WORKER_METRICS_MAX_AGE_SECONDS) -> Dict[str, Dict[str, Any]]:
+    """{worker id: metrics snapshot} of the workers that published within max_age_seconds."""
+    return {row.worker_id: row.snapshot for row in db.execute(_RECENT_SQL, {"max_age": max_age_seconds})}
+
+
+def prune(db: Session, max_age_seconds: float = WORKER_METRICS_MAX_AGE_SECONDS) -> int:
+    """Deletes the metrics of workers that stopped publishing. Returns the number deleted."""
+    deleted = db.execute(_PRUNE_SQL, {"max_age": max_age_seconds}).rowcount
+    db.commit()
+    return deleted
@@ -0,0 +1,93 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from typing import Optional
+
+'''
+Structured, non-blocking logging for the API and ingestion services.
+- Log records go through a QueueHandler; a QueueListener thread does the actual (blocking) stdout I/O,
+  so logging never stalls the event loop.
+- LOG_FORMAT=json emits one JSON object per line; LOG_FORMAT=text keeps a human-readable format.
+- LOG_LEVEL sets the root level; LOG_LEVELS sets per-module levels, e.g.
+  "app.services.similarity_query=DEBUG,sqlalchemy.engine=WARNING".
+- Every record carries the request id of the request that produced it (set by the middleware in main.py).
+- debug_sampled() logs only a LOG_SAMPLE_RATE fraction of high-volume per-row debug lines.
+'''
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging():
+    """Installs the queue-based root handler and per-module levels. Safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # Filter on the producer side, where the request id context var is still set
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+
+    for item in filter(None, (part.strip() for part in LOG_LEVELS.split(","))):
+        module, _, level = item.partition("=")
+        logging.getLogger(module.strip()).setLevel(level.strip().upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Flushes queued records and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def debug_sampled(logger: logging.Logger, msg: str, *args, rate: float = LOG_SAMPLE_RATE):
+    """Debug-logs only a `rate` fraction of calls, for per-row lines on hot paths."""
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < rate:
+        logger.debug(msg, *args)
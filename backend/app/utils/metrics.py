@@ -0,0 +1,151 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+'''
+Lightweight in-process metrics and request stage timing.
+- stage_timer("embed") measures a block, records it in a Prometheus-style histogram and, when called
+  inside a request, adds it to that request's Server-Timing header (see the middleware in main.py).
+- record_tokens / record_cache / record_results count LLM tokens, cache hits/misses and result sizes.
+- render_prometheus() returns everything in the Prometheus text exposition format for GET /metrics.
+- snapshot() exports this process's metrics as JSON. Worker processes publish theirs to Postgres
+  (services/worker_metrics.py), and GET /metrics renders them next to the web process's own, labelled by worker.
+'''
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 200, 500)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: Dict[str, Dict[LabelKey, float]] = {}
+_histograms: Dict[str, Dict[LabelKey, List[float]]] = {}  # per label set: bucket counts..., sum, count
+_histogram_buckets: Dict[str, Tuple[float, ...]] = {}
+_help: Dict[str, str] = {}
+
+# (stage, milliseconds) entries for the current request, read by the Server-Timing middleware
+request_timings: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar("request_timings", default=None)
+
+
+def _labels(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc_counter(name: str, value: float = 1, help_text: str = "", **labels):
+    with _lock:
+        _help.setdefault(name, help_text)
+        series = _counters.setdefault(name, {})
+        key = _labels(labels)
+        series[key] = series.get(key, 0) + value
+
+
+def observe(name: str, value: float, buckets: Tuple[float, ...] = DURATION_BUCKETS, help_text: str = "", **labels):
+    with _lock:
+        _help.setdefault(name, help_text)
+        _histogram_buckets.setdefault(name, buckets)
+        series = _histograms.setdefault(name, {})
+        key = _labels(labels)
+        state = series.get(key)
+        if state is None:
+            state = series[key] = [0.0] * (len(buckets) + 2)
+        for i, bound in enumerate(_histogram_buckets[name]):
+            if value <= bound:
+                state[i] += 1
+        state[-2] += value
+        state[-1] += 1
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Times a block as `stage`: histogram app_stage_duration_seconds{stage} + Server-Timing entry."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("app_stage_duration_seconds", elapsed, help_text="Duration of named processing stages.", stage=stage)
+        timings = request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed * 1000))
+
+
+def record_tokens(purpose: str, usage_metadata) -> None:
+    """Counts prompt/candidate tokens from a Gemini response's usage_metadata (no-op if missing)."""
+    if not usage_metadata:
+        return
+    help_text = "LLM tokens used, by purpose and kind."
+    inc_counter("app_llm_tokens_total", getattr(usage_metadata, "prompt_token_count", 0) or 0, help_text, purpose=purpose, kind="prompt")
+    inc_counter("app_llm_tokens_total", getattr(usage_metadata, "candidates_token_count", 0) or 0, help_text, purpose=purpose, kind="candidates")
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    inc_counter("app_cache_requests_total", 1, "Cache lookups by cache and result.", cache=cache, result="hit" if hit else "miss")
+
+
+def record_results(operation: str, count: int) -> None:
+    observe("app_result_count", count, COUNT_BUCKETS, "Number of results returned, by operation.", operation=operation)
+
+
+def server_timing_header(timings: List[Tuple[str, float]]) -> str:
+    return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in timings)
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+def snapshot() -> Dict[str, Any]:
+    """This process's counters and histograms as JSON-serialisable data (see render_prometheus)."""
+    with _lock:
+        return {
+            "help": dict(_help),
+            "counters": {name: [[list(map(list, key)), value] for key, value in series.items()]
+                         for name, series in _counters.items()},
+            "histograms": {name: {"buckets": list(_histogram_buckets[name]),
+                                  "series": [[list(map(list, key)), list(state)] for key, state in series.items()]}
+                           for name, series in _histograms.items()},
+        }
+
+
+def render_prometheus(remote: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+    """
+    Everything in the Prometheus text format: this process's metrics, plus the snapshot() of each process in
+    `remote` ({worker id: snapshot}) with a worker label added to its series.
+    """
+    sources = [((), snapshot())] + [((("worker", worker),), data) for worker, data in sorted((remote or {}).items())]
+    help_texts: Dict[str, str] = {}
+    counters: Dict[str, List[Tuple[LabelKey, float]]] = {}
+    histograms: Dict[str, List[Tuple[LabelKey, List[float]]]] = {}
+    buckets_by_name: Dict[str, List[float]] = {}
+    for extra, data in sources:
+        for name, text in data.get("help", {}).items():
+            help_texts.setdefault(name, text)
+        for name, series in data.get("counters", {}).items():
+            counters.setdefault(name, []).extend((tuple(map(tuple, key)) + extra, value) for key, value in series)
+        for name, histogram in data.get("histograms", {}).items():
+            if buckets_by_name.setdefault(name, histogram["buckets"]) != histogram["buckets"]:
+                continue # Bucket layout changed between versions; the series would not be comparable
+            histograms.setdefault(name, []).extend((tuple(map(tuple, key)) + extra, state) for key, state in histogram["series"])
+
+    lines: List[str] = []
+    for name, series in sorted(counters.items()):
+        lines.append(f"# HELP {name} {help_texts.get(name, '')}")
+        lines.append(f"# TYPE {name} counter")
+        for key, value in series:
+            lines.append(f"{name}{_format_labels(key)} {value}")
+    for name, series in sorted(histograms.items()):
+        buckets = buckets_by_name[name]
+        lines.append(f"# HELP {name} {help_texts.get(name, '')}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, state in series:
+            for i, bound in enumerate(buckets):
+                lines.append(f"{name}_bucket{_format_labels(key, ('le', str(bound)))} {state[i]}")
+            lines.append(f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {state[-1]}")
+            lines.append(f"{name}_sum{_format_labels(key)} {state[-2]}")
+            lines.append(f"{name}_count{_format_labels(key)} {state[-1]}")
+    return "\n".join(lines) + "\n"
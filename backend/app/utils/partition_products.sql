@@ -0,0 +1,63 @@
+-- One-off migration: converts an existing unpartitioned products table into weekly range partitions on ad_week.
+-- Run once in a maintenance window (psql -f), after schema.sql's column additions, on PostgreSQL 14+.
+-- New databases created from schema.sql are already partitioned.
+
+BEGIN;
+
+ALTER TABLE products RENAME TO products_unpartitioned;
+DROP TRIGGER IF EXISTS product_fts_update_trigger ON products_unpartitioned;
+DROP INDEX IF EXISTS idx_products_weekly_ad_id, idx_products_name, idx_products_category, idx_products_embedding,
+    idx_products_embedding_compact, idx_products_fts, idx_products_price, idx_products_unit_price,
+    idx_products_discount_pct, idx_products_name_trgm;
+
+CREATE TABLE products (
+    LIKE products_unpartitioned INCLUDING DEFAULTS,
+    ad_week DATE NOT NULL,
+    PRIMARY KEY (id, ad_week),
+    FOREIGN KEY (weekly_ad_id) REFERENCES weekly_ads(id) ON DELETE CASCADE,
+    FOREIGN KEY (retailer_id) REFERENCES retailers(id) ON DELETE CASCADE
+) PARTITION BY RANGE (ad_week);
+
+-- The id sequence now belongs to the new table, so dropping the old one keeps it
+ALTER SEQUENCE products_id_seq OWNED BY products.id;
+
+DO $$
+DECLARE
+    week DATE;
+BEGIN
+    FOR week IN
+        SELECT DISTINCT date_trunc('week', valid_from)::date FROM weekly_ads
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF products FOR VALUES FROM (%L) TO (%L)',
+            'products_w' || to_char(week, 'YYYYMMDD'), week, week + 7
+        );
+    END LOOP;
+END $$;
+
+INSERT INTO products
+SELECT p.*, date_trunc('week', wa.valid_from)::date
+FROM products_unpartitioned p
+JOIN weekly_ads wa ON wa.id = p.weekly_ad_id;
+
+DROP TABLE products_unpartitioned;
+
+COMMIT;
+
+-- Indexes and the full-text trigger are created on the parent and cascade to every partition
+CREATE INDEX IF NOT EXISTS idx_products_weekly_ad_id ON products(weekly_ad_id);
+CREATE INDEX IF NOT EXISTS idx_products_name ON products(name);
+CREATE INDEX IF NOT EXISTS idx_products_category ON products(category);
+CREATE INDEX IF NOT EXISTS idx_products_embedding ON products USING hnsw (embedding vector_l2_ops);
+CREATE INDEX IF NOT EXISTS idx_products_embedding_compact ON products USING hnsw (embedding_compact vector_cosine_ops);
+CREATE INDEX IF NOT EXISTS idx_products_fts ON products USING GIN(fts_vector);
+CREATE INDEX IF NOT EXISTS idx_products_week_price ON products(ad_week, price);
+CREATE INDEX IF NOT EXISTS idx_products_week_unit_price ON products(ad_week, unit_price_basis, unit_price);
+CREATE INDEX IF NOT EXISTS idx_products_week_discount_pct ON products(ad_week, discount_pct DESC NULLS LAST);
+CREATE INDEX IF NOT EXISTS idx_products_name_trgm ON products USING gin (name gin_trgm_ops);
+
+CREATE TRIGGER product_fts_update_trigger
+BEFORE INSERT OR UPDATE ON products
+FOR EACH ROW EXECUTE FUNCTION update_product_fts_vector();
+
+ANALYZE products;
@@ -29,8 +29,10 @@ CREATE INDEX IF NOT EXISTS idx_weekly_ads_retailer_id ON weekly_ads(retailer_id)
 CREATE INDEX IF NOT EXISTS idx_weekly_ads_valid_to ON weekly_ads(valid_to);
 
 -- Table: products
+-- Range-partitioned by ad_week (Monday of the ad's valid_from week), one partition per week, created by
+-- services/product_partitions.py. Existing unpartitioned databases: run utils/partition_products.sql once.
 CREATE TABLE IF NOT EXISTS products (
-    id BIGSERIAL PRIMARY KEY,
+    id BIGSERIAL,
     weekly_ad_id BIGINT NOT NULL REFERENCES weekly_ads(id) ON DELETE CASCADE,
     retailer_id BIGINT NOT NULL REFERENCES retailers(id) ON DELETE CASCADE,
     name VARCHAR(255) NOT NULL,
@@ -46,8 +48,11 @@ CREATE TABLE IF NOT EXISTS products (
     created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
     is_frontpage BOOLEAN DEFAULT FALSE,
     emoji VARCHAR(10),
-    embedding VECTOR(768) NULL
-);
+    embedding VECTOR(768) NULL,
+    embedding_compact VECTOR(256) NULL, -- First 256 dims of embedding, re-normalised (Matryoshka truncation)
+    ad_week DATE NOT NULL, -- Partition key
+    PRIMARY KEY (id, ad_week)
+) PARTITION BY RANGE (ad_week);
 
 -- Indexes for products
 CREATE INDEX IF NOT EXISTS idx_products_weekly_ad_id ON products(weekly_ad_id);
@@ -55,6 +60,10 @@ CREATE INDEX IF NOT EXISTS idx_products_name ON products(name);
 CREATE INDEX IF NOT EXISTS idx_products_category ON products(category);
 CREATE INDEX IF NOT EXISTS idx_products_embedding ON products USING hnsw (embedding vector_l2_ops); -- Example for HNSW
 
+-- Compact vector used for the coarse candidate pass of similarity search (~3x smaller than the full index)
+ALTER TABLE products ADD COLUMN IF NOT EXISTS embedding_compact VECTOR(256);
+CREATE INDEX IF NOT EXISTS idx_products_embedding_compact ON products USING hnsw (embedding_compact vector_cosine_ops);
+
 -- Add tsvector columns and triggers for full-text search (optional but recommended)
 ALTER TABLE products ADD COLUMN IF NOT EXISTS fts_vector tsvector;
 
@@ -77,3 +86,118 @@ FOR EACH ROW EXECUTE FUNCTION update_product_fts_vector();
 
 -- Index for full-text search
 CREATE INDEX IF NOT EXISTS idx_products_fts ON products USING GIN(fts_vector);
+
+-- Precomputed sort columns (set by json_to_db_service at load), so "best deals" sorts are index-ordered top-N scans
+ALTER TABLE products ADD COLUMN IF NOT EXISTS unit_price NUMERIC(12, 4);
+ALTER TABLE products ADD COLUMN IF NOT EXISTS unit_price_basis VARCHAR(20);
+ALTER TABLE products ADD COLUMN IF NOT EXISTS discount_pct NUMERIC(5, 2);
+CREATE INDEX IF NOT EXISTS idx_products_week_price ON products(ad_week, price);
+CREATE INDEX IF NOT EXISTS idx_products_week_unit_price ON products(ad_week, unit_price_basis, unit_price);
+CREATE INDEX IF NOT EXISTS idx_products_week_discount_pct ON products(ad_week, discount_pct DESC NULLS LAST);
+-- Replaced by the (ad_week, ...) indexes above
+DROP INDEX IF EXISTS idx_products_price, idx_products_unit_price, idx_products_discount_pct;
+
+-- Trigram index for the typeahead fallback (/products/suggest/) on misspelled prefixes
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_products_name_trgm ON products USING gin (name gin_trgm_ops);
+
+-- Canonical product identity: weekly product rows of the same item (across weeks and retailers) share one canonical product
+CREATE TABLE IF NOT EXISTS canonical_products (
+    id BIGSERIAL PRIMARY KEY,
+    normalised_name VARCHAR(255) NOT NULL UNIQUE, -- Lowercased name without sizes/punctuation
+    display_name VARCHAR(255) NOT NULL,
+    category VARCHAR(100),
+    embedding VECTOR(256) NULL, -- Compact embedding of the first product linked
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_canonical_products_embedding ON canonical_products USING hnsw (embedding vector_cosine_ops);
+
+ALTER TABLE products ADD COLUMN IF NOT EXISTS canonical_product_id BIGINT REFERENCES canonical_products(id) ON DELETE SET NULL;
+CREATE INDEX IF NOT EXISTS idx_products_uncanonical ON products(id) WHERE canonical_product_id IS NULL;
+
+-- Per-canonical-product price series, appended at ingest; kept when products rows are archived
+CREATE TABLE IF NOT EXISTS product_prices (
+    id BIGSERIAL PRIMARY KEY,
+    canonical_product_id BIGINT NOT NULL REFERENCES canonical_products(id) ON DELETE CASCADE,
+    product_id BIGINT NOT NULL UNIQUE,
+    retailer_id BIGINT NOT NULL REFERENCES retailers(id) ON DELETE CASCADE,
+    weekly_ad_id BIGINT NOT NULL REFERENCES weekly_ads(id) ON DELETE CASCADE,
+    valid_from DATE NOT NULL,
+    valid_to DATE NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    price NUMERIC(10, 2) NOT NULL,
+    original_price NUMERIC(10, 2),
+    unit VARCHAR(50),
+    unit_price NUMERIC(12, 4),
+    unit_price_basis VARCHAR(20)
+);
+CREATE INDEX IF NOT EXISTS idx_product_prices_canonical_valid_from ON product_prices(canonical_product_id, valid_from);
+
+-- Background jobs (PDF extraction, enhancement, DB load, embedding), claimed by worker processes
+-- (python -m app.worker) with SELECT ... FOR UPDATE SKIP LOCKED; see services/job_queue.py
+CREATE TABLE IF NOT EXISTS jobs (
+    id BIGSERIAL PRIMARY KEY,
+    kind VARCHAR(50) NOT NULL,
+    key VARCHAR(255) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued', -- queued, running, succeeded, failed
+    payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+    result JSONB,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    run_after TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP, -- Not claimed before this (retry backoff)
+    locked_by VARCHAR(100), -- Worker holding the job while running
+    locked_at TIMESTAMPTZ, -- Last heartbeat of that worker
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_queued ON jobs(run_after, id) WHERE status = 'queued';
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_key ON jobs(kind, key) WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS idx_jobs_kind_created_at ON jobs(kind, created_at);
+
+-- Latest metrics snapshot per worker process, rendered by the web process's /metrics; see services/worker_metrics.py
+CREATE TABLE IF NOT EXISTS worker_metrics (
+    worker_id VARCHAR(100) PRIMARY KEY,
+    snapshot JSONB NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Ingestion stage files (uploaded PDFs, extraction and enhanced JSON), so any worker can run an ad's next stage;
+-- see services/stage_files.py
+CREATE TABLE IF NOT EXISTS stage_files (
+    name VARCHAR(255) PRIMARY KEY, -- "<directory>/<filename>", e.g. "uploads/ad.pdf"
+    content BYTEA NOT NULL,
+    modified_at TIMESTAMPTZ NOT NULL, -- Modification time of the source file
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- PDF extractions keyed by content hash and prompt version, shared by all workers; see services/extraction_cache.py
+CREATE TABLE IF NOT EXISTS extraction_cache (
+    content_key VARCHAR(100) NOT NULL, -- PDF SHA-256, or "<sha256>-p1-10" for a page chunk
+    prompt_version VARCHAR(16) NOT NULL,
+    source_filename VARCHAR(255),
+    usage JSONB NOT NULL, -- Token usage of the original Gemini call
+    data JSONB NOT NULL, -- Validated ExtractedPDFData
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (content_key, prompt_version)
+);
+
+-- Files uploaded to the Gemini Files API, keyed by content hash and reused by any worker until they expire;
+-- see services/gemini_upload_registry.py
+CREATE TABLE IF NOT EXISTS gemini_uploads (
+    upload_key VARCHAR(100) PRIMARY KEY, -- PDF SHA-256, or "<sha256>-p1-10" for a page chunk
+    name VARCHAR(255) NOT NULL, -- Remote file name, e.g. "files/abc123"
+    uri TEXT,
+    display_name VARCHAR(255),
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+-- Generated gen_terms and emoji of recurring products, by enhancement prompt version; see services/gen_terms_cache.py
+CREATE TABLE IF NOT EXISTS gen_terms_cache (
+    fingerprint VARCHAR(40) NOT NULL, -- SHA-1 of the normalised name, category and promotion details
+    prompt_version VARCHAR(16) NOT NULL,
+    gen_terms TEXT NOT NULL,
+    emoji TEXT,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (fingerprint, prompt_version)
+);
@@ -0,0 +1,82 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from .metrics import inc_counter
+
+logger = logging.getLogger(__name__)
+
+'''
+Single-flight request coalescing. Concurrent calls with the same key share one in-flight computation, and
+its result is kept for a short TTL, so a burst of identical requests (a promo link, a popular chat query)
+reaches the LLM, embedding provider and database once.
+- Errors are not cached: every waiter of the failed flight gets the error, and the next call retries.
+- The computation runs as its own task and waiters are shielded from each other, so a client disconnecting
+  does not cancel the work the other requests are waiting on.
+- Results are shared between callers and must be treated as read-only.
+'''
+
+
+def normalise_text(value: Optional[str]) -> str:
+    """Case- and whitespace-insensitive form of free text for use in keys."""
+    return " ".join((value or "").lower().split())
+
+
+def text_digest(value: Optional[str]) -> str:
+    """Short stable digest for long text key parts (e.g. chat history)."""
+    return hashlib.sha1(normalise_text(value).encode('utf-8')).hexdigest()[:16]
+
+
+class SingleFlight:
+    def __init__(self, name: str, ttl_seconds: float, max_entries: int = 1024):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._results: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    def _record(self, outcome: str):
+        inc_counter("app_single_flight_total", 1, "Single-flight lookups by flight and outcome (leader, coalesced, cached).",
+                    flight=self.name, outcome=outcome)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Returns func()'s result for `key`, sharing it with concurrent and recent (within the TTL) callers."""
+        with self._lock:
+            entry = self._results.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._results.move_to_end(key)
+                outcome = "cached"
+            else:
+                entry = None
+                task = self._inflight.get(key)
+                outcome = "coalesced" if task else "leader"
+                if not task:
+                    task = asyncio.ensure_future(self._run(key, func))
+                    self._inflight[key] = task
+        self._record(outcome)
+        if entry:
+            return entry[1]
+        return await asyncio.shield(task)
+
+    async def _run(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            result = await func()
+            if self.ttl_seconds > 0:
+                with self._lock:
+                    self._results[key] = (time.monotonic() + self.ttl_seconds, result)
+                    self._results.move_to_end(key)
+                    while len(self._results) > self.max_entries:
+                        self._results.popitem(last=False)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
@@ -1,5 +1,9 @@
 from pathlib import Path
+import asyncio
+import math
 import os
+import random
+from typing import Any, Awaitable, Callable, List, Optional, Sequence, Tuple, Type
 
 def find_project_root() -> Path:
     """
@@ -21,4 +25,43 @@ def find_project_root() -> Path:
     raise FileNotFoundError(
         f"Project root not found. Could not locate a directory containing "
         f"a 'backend' sub-directory by searching upwards from {current_file}"
-    )
\ No newline at end of file
+    )
+
+
+def truncate_embedding(embedding: Sequence[float], dim: int) -> List[float]:
+    """
+    Matryoshka-style truncation: keeps the first `dim` values of an embedding
+    and re-normalises them to unit length so cosine distance stays meaningful.
+    """
+    head = [float(v) for v in embedding[:dim]]
+    norm = math.sqrt(sum(v * v for v in head))
+    if not norm:
+        return head
+    return [v / norm for v in head]
+
+
+async def retry_async(
+    func: Callable[..., Awaitable[Any]],
+    *args,
+    retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+    max_attempts: int = 3,
+    base_delay: float = 1.0,
+    max_delay: float = 30.0,
+    on_retry: Optional[Callable[[int, BaseException, float], None]] = None,
+    **kwargs
+) -> Any:
+    """
+    Awaits func(*args, **kwargs), retrying on `retry_on` exceptions with full-jitter exponential backoff
+    (a random delay between 0 and base_delay * 2^(attempt-1), capped at max_delay).
+    on_retry(attempt, error, delay) is called before each sleep. The last error is re-raised.
+    """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return await func(*args, **kwargs)
+        except retry_on as e:
+            if attempt >= max_attempts:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+            if on_retry:
+                on_retry(attempt, e, delay)
+            await asyncio.sleep(delay)
@@ -0,0 +1,63 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict
+
+from .. import database
+from ..services.model_providers import get_provider, get_embedding_provider
+from ..services.suggest_service import get_suggest_index
+
+logger = logging.getLogger(__name__)
+
+'''
+Startup warm-up, run from the app lifespan before the process reports ready, so the first request does
+not pay for it: opens the DB pools' connections (primary and read replica), builds the model provider clients and the
+typeahead index. Every step is best effort; a failure is logged and reported, not raised.
+'''
+
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+WARMUP_DB_CONNECTIONS = int(os.getenv("WARMUP_DB_CONNECTIONS", str(database.DB_POOL_SIZE)))
+
+
+def _warm_providers() -> str:
+    provider, embedding_provider = get_provider(), get_embedding_provider()
+    provider.warm_up()
+    if embedding_provider is not provider:
+        embedding_provider.warm_up()
+    return f"{provider.name}/{embedding_provider.name}"
+
+
+def _warm_read_pool() -> int:
+    if not database.DATABASE_READ_URL:
+        return 0
+    return database.warm_pool(WARMUP_DB_CONNECTIONS, database.get_read_engine())
+
+
+def _warm_suggest_index() -> int:
+    db = database.open_read_session()
+    try:
+        return len(get_suggest_index(db, "current"))
+    finally:
+        db.close()
+
+
+async def warm_up() -> Dict[str, Any]:
+    """Runs the warm-up steps in worker threads. Returns {step: {"ok", "ms", "result" or "error"}}."""
+    steps = {
+        "db_pool": lambda: database.warm_pool(WARMUP_DB_CONNECTIONS),
+        "db_read_pool": _warm_read_pool,
+        "model_providers": _warm_providers,
+        "suggest_index": _warm_suggest_index,
+    }
+    report: Dict[str, Any] = {}
+    for name, step in steps.items():
+        start = time.perf_counter()
+        try:
+            result = await asyncio.to_thread(step)
+            report[name] = {"ok": True, "ms": round((time.perf_counter() - start) * 1000, 1), "result": result}
+        except Exception as e:
+            logger.error(f"Warm-up step '{name}' failed: {e}")
+            report[name] = {"ok": False, "ms": round((time.perf_counter() - start) * 1000, 1), "error": str(e)}
+    logger.info("Warm-up finished: %s", ", ".join(f"{name} {step['ms']} ms{'' if step['ok'] else ' (failed)'}" for name, step in report.items()))
+    return report
@@ -0,0 +1,248 @@
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from .database import SessionLocal
+from .services import job_queue, stage_files, worker_metrics, gemini_upload_registry
+from .services.ingestion_pipeline import HANDLERS, is_retryable
+from .utils.metrics import observe, inc_counter
+from .utils.logging_config import setup_logging, shutdown_logging, request_id_var
+
+logger = logging.getLogger(__name__)
+
+'''
+Background worker process: runs the jobs the API enqueues in the Postgres jobs table (PDF extraction,
+JSON enhancement, DB loads, embedding), so ingestion never competes with web requests for the event loop,
+the DB pool or the model call limits of the web process.
+Start one or more with the Procfile's worker type, or locally from the backend directory:
+    python -m app.worker
+    python -m app.worker --kinds pdf_extraction,json_enhancement --concurrency 4
+    python -m app.worker --burst   # exit once the queue is empty (e.g. from cron)
+Each worker runs up to WORKER_CONCURRENCY jobs at once. Workers claim jobs with FOR UPDATE SKIP LOCKED, so
+throughput scales by adding worker processes. SIGTERM stops claiming, lets running jobs finish for
+WORKER_SHUTDOWN_GRACE_SECONDS and hands unfinished ones back to the queue.
+On startup a worker re-queues the jobs left running by earlier, exited processes on the same host (a restarted
+dyno or a crashed process) and stale jobs of any host; it also prunes finished jobs and stage files older than
+JOB_RETENTION_DAYS every JOB_PRUNE_INTERVAL_SECONDS.
+Worker dynos serve no HTTP, so each worker publishes its metrics to Postgres with every heartbeat and the web
+process's GET /metrics includes them (services/worker_metrics.py).
+Setting RUN_WORKER_IN_WEB=true also runs a worker inside the API process (single-process local setups); its
+metrics are the web process's own and are not published.
+'''
+
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "2"))
+WORKER_SHUTDOWN_GRACE_SECONDS = float(os.getenv("WORKER_SHUTDOWN_GRACE_SECONDS", "25"))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "300")) # Running jobs without a heartbeat for this long are re-queued
+JOB_PRUNE_INTERVAL_SECONDS = float(os.getenv("JOB_PRUNE_INTERVAL_SECONDS", "3600"))
+RUN_WORKER_IN_WEB = os.getenv("RUN_WORKER_IN_WEB", "false").lower() in ("1", "true", "yes")
+
+
+def _db_call(func: Callable, *args) -> Any:
+    """Runs func(db, *args) in a short-lived session."""
+    db = SessionLocal()
+    try:
+        return func(db, *args)
+    finally:
+        db.close()
+
+
+def _prune(db) -> None:
+    job_queue.prune(db)
+    stage_files.prune(db)
+    worker_metrics.prune(db)
+    gemini_upload_registry.prune(db)
+
+
+def _process_exited(worker_id: str) -> bool:
+    """True when the process behind a worker id on this host is gone. A worker id with our own pid is an earlier
+    process (e.g. before a dyno restart): the live one with that pid is us."""
+    try:
+        pid = int(worker_id.split(":")[1])
+    except (IndexError, ValueError):
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError: # Alive, owned by another user
+        return False
+    return False
+
+
+class Worker:
+    def __init__(self, kinds: Optional[Sequence[str]] = None, concurrency: int = WORKER_CONCURRENCY, publish_metrics: bool = True):
+        unknown = set(kinds or ()) - set(HANDLERS)
+        if unknown:
+            raise ValueError(f"Unknown job kinds: {', '.join(sorted(unknown))}. Known: {', '.join(HANDLERS)}.")
+        self.kinds = list(kinds) if kinds else list(HANDLERS)
+        self.concurrency = concurrency
+        self.publish_metrics = publish_metrics
+        self.host = os.getenv("DYNO", socket.gethostname())
+        self.worker_id = f"{self.host}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._stopping: Optional[asyncio.Event] = None
+
+    def stop(self):
+        """Stops claiming new jobs; run() returns once running jobs finish or the grace period ends."""
+        if self._stopping and not self._stopping.is_set():
+            logger.info(f"Worker {self.worker_id} stopping.")
+            self._stopping.set()
+
+    async def run(self, burst: bool = False):
+        """Claims and runs jobs until stop() (or, with burst, until no job is due)."""
+        self._stopping = asyncio.Event()
+        slots = asyncio.Semaphore(self.concurrency)
+        await self._recover()
+        heartbeat = asyncio.create_task(self._heartbeat_loop(), name="worker-heartbeat")
+        logger.info(f"Worker {self.worker_id} started: kinds {', '.join(self.kinds)}, concurrency {self.concurrency}.")
+        try:
+            while not self._stopping.is_set():
+                await slots.acquire()
+                if self._stopping.is_set():
+                    slots.release()
+                    break
+                try:
+                    job = await asyncio.to_thread(_db_call, job_queue.claim, self.worker_id, self.kinds)
+                except Exception as e:
+                    logger.error(f"Worker {self.worker_id} could not claim a job: {e}")
+                    job = None
+                if job is None:
+                    slots.release()
+                    if burst and not self._tasks:
+                        break
+                    await self._sleep(WORKER_POLL_SECONDS)
+                    continue
+                task = asyncio.create_task(self._run_job(job), name=f"job-{job['id']}")
+                self._tasks[job["id"]] = task
+                task.add_done_callback(lambda _, job_id=job["id"]: (self._tasks.pop(job_id, None), slots.release()))
+        finally:
+            await self._drain()
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+            await self._publish_metrics()
+            logger.info(f"Worker {self.worker_id} stopped.")
+
+    async def _sleep(self, seconds: float):
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _drain(self):
+        """Waits for running jobs for the grace period, then cancels the rest (they are handed back to the queue)."""
+        tasks: List[asyncio.Task] = list(self._tasks.values())
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=WORKER_SHUTDOWN_GRACE_SECONDS)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _recover(self):
+        """Re-queues the jobs interrupted by exited workers on this host and stale jobs anywhere, and prunes old jobs and stage files."""
+        try:
+            for worker_id in await asyncio.to_thread(_db_call, job_queue.running_workers, self.host):
+                if worker_id != self.worker_id and _process_exited(worker_id):
+                    await asyncio.to_thread(_db_call, job_queue.requeue_worker, worker_id)
+            await asyncio.to_thread(_db_call, job_queue.requeue_stale, JOB_STALE_SECONDS)
+            await asyncio.to_thread(_db_call, _prune)
+        except Exception as e:
+            logger.error(f"Worker {self.worker_id} could not recover interrupted jobs: {e}")
+
+    async def _heartbeat_loop(self):
+        last_prune = time.monotonic()
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                await asyncio.to_thread(_db_call, job_queue.heartbeat, self.worker_id, list(self._tasks))
+                await asyncio.to_thread(_db_call, job_queue.requeue_stale, JOB_STALE_SECONDS)
+                await self._publish_metrics()
+                if time.monotonic() - last_prune >= JOB_PRUNE_INTERVAL_SECONDS:
+                    last_prune = time.monotonic()
+                    await asyncio.to_thread(_db_call, _prune)
+            except Exception as e:
+                logger.error(f"Worker {self.worker_id} heartbeat failed: {e}")
+
+    async def _publish_metrics(self):
+        if not self.publish_metrics:
+            return
+        try:
+            await asyncio.to_thread(_db_call, worker_metrics.publish, self.worker_id)
+        except Exception as e:
+            logger.warning(f"Worker {self.worker_id} could not publish its metrics: {e}")
+
+    async def _run_job(self, job: Dict[str, Any]):
+        job_id, kind = job["id"], job["kind"]
+        token = request_id_var.set(f"job-{job_id}") # Tags the job's log records
+        started, outcome = time.perf_counter(), "error"
+
+        def progress(result: Any):
+            try:
+                _db_call(job_queue.set_progress, job_id, self.worker_id, result)
+            except Exception as e:
+                logger.warning(f"Could not record progress of job {job_id}: {e}")
+
+        logger.info(f"Running job {job_id} ({kind} {job['key']}), attempt {job['attempts']}/{job['max_attempts']}.")
+        try:
+            result = await HANDLERS[kind](job, progress)
+            await asyncio.to_thread(_db_call, job_queue.complete, job_id, self.worker_id, result)
+            outcome = "succeeded"
+            logger.info(f"Job {job_id} ({kind} {job['key']}) succeeded in {time.perf_counter() - started:.1f}s.")
+        except asyncio.CancelledError:
+            outcome = "released"
+            _db_call(job_queue.release, job_id, self.worker_id)
+            logger.warning(f"Job {job_id} ({kind} {job['key']}) interrupted by shutdown; returned to the queue.")
+            raise
+        except Exception as e:
+            try:
+                retry = is_retryable(e)
+                status = await asyncio.to_thread(_db_call, job_queue.fail, job_id, self.worker_id, f"{type(e).__name__}: {e}", retry)
+            except Exception as db_error:
+                status = None
+                logger.error(f"Could not record the failure of job {job_id}: {db_error}")
+            outcome = "retrying" if status == job_queue.QUEUED else "failed"
+            logger.error(f"Job {job_id} ({kind} {job['key']}) failed ({outcome}): {e}")
+        finally:
+            observe("app_job_duration_seconds", time.perf_counter() - started,
+                    help_text="Background job run time, by kind and outcome.", kind=kind, outcome=outcome)
+            inc_counter("app_jobs_total", 1, "Background job runs, by kind and outcome.", kind=kind, outcome=outcome)
+            request_id_var.reset(token)
+
+
+async def _run_until_signalled(worker: Worker, burst: bool):
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, worker.stop)
+        except NotImplementedError: # Windows
+            pass
+    await worker.run(burst=burst)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run background jobs from the Postgres job queue.")
+    parser.add_argument("--kinds", default="", help=f"Comma-separated job kinds to run (default: all of {', '.join(HANDLERS)}).")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="Jobs run at once by this process.")
+    parser.add_argument("--burst", action="store_true", help="Exit when no job is due instead of polling.")
+    args = parser.parse_args()
+
+    setup_logging()
+    try:
+        worker = Worker([kind for kind in args.kinds.split(",") if kind], args.concurrency)
+        asyncio.run(_run_until_signalled(worker, args.burst))
+    finally:
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import argparse
+import time
+import numpy as np
+
+'''
+Benchmark for compact (Matryoshka-truncated) embedding storage.
+Compares exact full-precision search against compact-only and two-stage (compact candidates + full rerank)
+search, reporting bytes per vector, recall@k against the exact result and brute-force latency.
+
+Only --from-db (real stored embeddings) gives recall numbers worth quoting. Synthetic vectors have their
+dimensions shuffled by default, so truncation gets no help from how they were generated; --leading-signal
+keeps the signal in the leading dimensions (a best case for truncation, useful only as an upper bound).
+
+Run from the backend directory:
+    python -m benchmarks.embedding_compact_benchmark --from-db   (uses real embeddings via DATABASE_URL)
+    python -m benchmarks.embedding_compact_benchmark --products 20000 --queries 200
+'''
+
+FULL_DIM = 768
+
+
+def _normalise(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def synthetic_embeddings(n_products: int, n_queries: int, seed: int = 42, leading_signal: bool = False):
+    """
+    Generates catalog/query vectors around shared topic centroids (so that neighbourhoods exist) with a
+    decaying per-dimension variance. Unless leading_signal is set, the dimensions are then shuffled, so the
+    strongest dimensions are spread over the vector instead of sitting in the part truncation keeps.
+    """
+    rng = np.random.default_rng(seed)
+    scale = (1.0 / np.sqrt(np.arange(1, FULL_DIM + 1))).astype(np.float32)
+    n_topics = max(n_products // 50, 1)
+    centroids = rng.standard_normal((n_topics, FULL_DIM)).astype(np.float32) * scale
+    topics = rng.integers(0, n_topics, n_products)
+    products = centroids[topics] + 0.5 * rng.standard_normal((n_products, FULL_DIM)).astype(np.float32) * scale
+    query_topics = rng.integers(0, n_topics, n_queries)
+    queries = centroids[query_topics] + 0.5 * rng.standard_normal((n_queries, FULL_DIM)).astype(np.float32) * scale
+    if not leading_signal:
+        permutation = rng.permutation(FULL_DIM)
+        products, queries = products[:, permutation], queries[:, permutation]
+    return _normalise(products), _normalise(queries)
+
+
+def db_embeddings(n_queries: int, seed: int = 42):
+    """
+    Loads stored product embeddings from the database and uses a random sample of them as queries.
+    """
+    from app.database import SessionLocal
+    from app.models import Product
+
+    db = SessionLocal()
+    try:
+        rows = db.query(Product.embedding).filter(Product.embedding != None).all()
+    finally:
+        db.close()
+    if not rows:
+        raise SystemExit("No stored embeddings found in the database.")
+    products = _normalise(np.array([np.asarray(r[0], dtype=np.float32) for r in rows]))
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(products), size=min(n_queries, len(products)), replace=False)
+    return products, products[sample]
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    idx = np.argpartition(-scores, k, axis=1)[:, :k]
+    order = np.take_along_axis(scores, idx, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(idx, order, axis=1)
+
+
+def _recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def run(products: np.ndarray, queries: np.ndarray, compact_dim: int, k: int, multiplier: int):
+    compact_products = _normalise(products[:, :compact_dim].copy())
+    compact_queries = _normalise(queries[:, :compact_dim].copy())
+
+    start = time.perf_counter()
+    truth = _top_k(queries @ products.T, k)
+    full_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    start = time.perf_counter()
+    compact_only = _top_k(compact_queries @ compact_products.T, k)
+    compact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    start = time.perf_counter()
+    candidates = _top_k(compact_queries @ compact_products.T, k * multiplier)
+    reranked = []
+    for q, cand in zip(queries, candidates):
+        scores = products[cand] @ q
+        reranked.append(cand[np.argsort(-scores)[:k]])
+    two_stage = np.array(reranked)
+    two_stage_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    n = len(products)
+    full_bytes = FULL_DIM * 4
+    print(f"Products: {n}, queries: {len(queries)}, k={k}, compact_dim={compact_dim}, rerank multiplier={multiplier}")
+    print("--- Storage per vector (pgvector payload, excluding index overhead) ---")
+    print(f"full vector({FULL_DIM}) float32 : {full_bytes:>6} B  total {n * full_bytes / 1e6:8.2f} MB")
+    print(f"vector({compact_dim}) float32       : {compact_dim * 4:>6} B  total {n * compact_dim * 4 / 1e6:8.2f} MB  ({full_bytes / (compact_dim * 4):.1f}x smaller)")
+    print(f"halfvec({compact_dim}) float16      : {compact_dim * 2:>6} B  total {n * compact_dim * 2 / 1e6:8.2f} MB  ({full_bytes / (compact_dim * 2):.1f}x smaller)")
+    print("--- Recall@k vs exact full-precision search / brute-force latency per query ---")
+    print(f"exact full          : recall 1.000  {full_ms:7.3f} ms")
+    print(f"compact only        : recall {_recall(compact_only, truth):.3f}  {compact_ms:7.3f} ms")
+    print(f"two-stage (rerank)  : recall {_recall(two_stage, truth):.3f}  {two_stage_ms:7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compact embedding storage and two-stage search.")
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--compact-dim", type=int, default=256)
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--multiplier", type=int, default=4)
+    parser.add_argument("--from-db", action="store_true", help="Use stored product embeddings instead of synthetic ones.")
+    parser.add_argument("--leading-signal", action="store_true",
+                        help="Synthetic only: keep the signal in the leading dimensions (best case for truncation).")
+    args = parser.parse_args()
+
+    if args.from_db:
+        products, queries = db_embeddings(args.queries)
+    else:
+        products, queries = synthetic_embeddings(args.products, args.queries, leading_signal=args.leading_signal)
+        print(f"Synthetic embeddings ({'leading signal, best case' if args.leading_signal else 'shuffled dimensions'}); "
+              "use --from-db for recall numbers on real embeddings.")
+    run(products, queries, args.compact_dim, args.k, args.multiplier)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+'''
+Import-time budget check for the API process: imports app.main in a fresh interpreter under
+`python -X importtime`, prints the slowest imports and exits non-zero when the total import time
+exceeds the budget, so changes that bring work back to import time are caught before deploying.
+
+Run from the backend directory:
+    python -m benchmarks.import_time_budget
+    python -m benchmarks.import_time_budget --budget-ms 1500 --top 20
+'''
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "2500"))
+
+
+def measure(module: str):
+    """Returns (wall ms, [(cumulative us, self us, module name)]) for importing `module` in a new interpreter."""
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+    if completed.returncode != 0:
+        raise SystemExit(f"Importing {module} failed:\n{completed.stderr[-2000:]}")
+    entries = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        # Keep the name's indentation (nesting depth in the import tree); drop the separator space
+        entries.append((int(cumulative_us), int(self_us), name[1:].rstrip()))
+    return wall_ms, entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the API's import time against a budget.")
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_TIME_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imports to list.")
+    args = parser.parse_args()
+
+    wall_ms, entries = measure(args.module)
+    # The module and its parent packages are top-level entries of the importtime tree (no indentation);
+    # their cumulative times add up to the cost of the import, excluding interpreter startup
+    parts = args.module.split(".")
+    targets = {".".join(parts[:i]) for i in range(1, len(parts) + 1)}
+    import_ms = sum(cumulative for cumulative, _, name in entries if name in targets) / 1000
+
+    print(f"{args.module}: imports {import_ms:.0f} ms (interpreter wall time {wall_ms:.0f} ms), budget {args.budget_ms:.0f} ms")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative, self_us, name in sorted(entries, key=lambda entry: entry[0], reverse=True)[:args.top]:
+        print(f"{cumulative / 1000:14.1f} {self_us / 1000:9.1f}  {name.strip()}")
+
+    if import_ms > args.budget_ms:
+        print(f"FAIL: import time {import_ms:.0f} ms is over the {args.budget_ms:.0f} ms budget.")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
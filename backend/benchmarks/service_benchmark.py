@@ -0,0 +1,318 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app import models
+from app.database import SessionLocal, open_read_session
+from app.services import product_service, similarity_query, json_to_db_service, batch_embedding_service, product_partitions
+from app.services.pdf_prompts import PRODUCT_UNITS
+from app.services.model_providers import LocalProvider, hash_embedding, set_provider
+
+'''
+Latency/throughput benchmark for the API's service calls against a synthetic catalog, with Gemini replaced
+by the offline LocalProvider from model_providers.py (hashed embeddings, canned query expansion and
+configurable simulated latency; no network, no API key).
+
+Measured: the service functions search_products and get_products_by_filter (behind GET /products/search/ and
+GET /products/filter/), similarity_search_products, process_json_extractions and batch_embed_products, called
+directly without the HTTP layer, so results are labelled by service function rather than endpoint.
+Reports calls, throughput and p50/p95/p99/max latency; --output saves the results and --baseline compares
+a run against saved results, so performance changes can be judged against the same workload.
+
+The catalog (retailers x weeks x products, with hashed 768-dim embeddings) is written to the database at
+DATABASE_URL. Use a disposable database: rows are created under "bench-" retailers, which are deleted
+before the run and, unless --keep is given, after it. With DATABASE_READ_URL set, the query workloads read
+from there (a replica of the benchmark database), like the API's read endpoints.
+
+Run from the backend directory:
+    python -m benchmarks.service_benchmark --retailers 5 --weeks 4 --products 300 --iterations 200
+    python -m benchmarks.service_benchmark --embed-latency-ms 80 --llm-latency-ms 600 --concurrency 4 --output base.json
+'''
+
+BENCH_RETAILER_PREFIX = "bench-"
+
+ITEMS = {
+    "Produce": ["tomatoes", "lettuce", "broccoli", "carrots", "avocados", "potatoes"],
+    "Fruits": ["apples", "bananas", "strawberries", "grapes", "oranges", "blueberries"],
+    "Dairy": ["milk", "cheddar cheese", "greek yogurt", "butter", "cream cheese"],
+    "Meats": ["chicken breast", "ground beef", "pork chops", "bacon", "ribeye steak"],
+    "Seafood": ["salmon fillet", "shrimp", "tilapia", "cod"],
+    "Bakery": ["sourdough bread", "bagels", "croissants", "burger buns"],
+    "Beverages": ["orange juice", "coffee", "sparkling water", "cola"],
+    "Frozen": ["ice cream", "frozen pizza", "frozen vegetables", "waffles"],
+    "Snacks": ["potato chips", "pretzels", "granola bars", "popcorn"],
+    "Dry Goods": ["pasta", "rice", "cereal", "oatmeal", "flour"],
+}
+BRANDS = ["Fresh Farms", "Valley", "Golden", "Organic Select", "Family Pack", "Store Brand", "Kirkland", "Signature"]
+SEARCH_TERMS = [item for items in ITEMS.values() for item in items]
+CHAT_QUERIES = ["high protein snacks", "bbq this weekend", "healthy breakfast", "cheap dinner ideas", "fresh fruit deals"]
+
+
+def _product_row(rng: random.Random, category: str) -> Dict[str, Any]:
+    item = rng.choice(ITEMS[category])
+    price = round(rng.uniform(0.99, 24.99), 2)
+    return {
+        "name": f"{rng.choice(BRANDS)} {item}",
+        "price": price,
+        "original_price": round(price * rng.uniform(1.1, 1.6), 2) if rng.random() < 0.5 else None,
+        "unit": rng.choice(PRODUCT_UNITS),
+        "description": f"{item} {rng.choice(['value size', 'family size', 'fresh', 'premium', ''])}".strip(),
+        "category": category,
+        "promotion_details": rng.choice([None, "Buy 1 Get 1 Free", "2 for $5", "Save $2", "Digital coupon"]),
+        "is_frontpage": rng.random() < 0.05,
+        "gen_terms": f"{item}, {category.lower()}",
+    }
+
+
+def reset_catalog(db) -> None:
+    """Deletes every bench- retailer; weekly ads and products go with them (ON DELETE CASCADE)."""
+    db.query(models.Retailer).filter(models.Retailer.name.like(f"{BENCH_RETAILER_PREFIX}%")).delete(synchronize_session=False)
+    db.commit()
+
+
+def build_catalog(db, n_retailers: int, n_weeks: int, products_per_ad: int, seed: int = 42) -> List[int]:
+    """
+    Inserts n_retailers x n_weeks weekly ads with products_per_ad embedded products each.
+    The newest week of every retailer is 'current', the one before 'previous', older ones 'archived'.
+    Returns the retailer ids.
+    """
+    rng = random.Random(seed)
+    categories = list(ITEMS)
+    today = date.today()
+    # Partition DDL locks the tables products references, so it runs before this session writes anything
+    for week in range(n_weeks):
+        product_partitions.ensure_week_partition(product_partitions.ad_week(today - timedelta(days=7 * week)))
+    retailers = [models.Retailer(name=f"{BENCH_RETAILER_PREFIX}retailer-{i:02d}") for i in range(n_retailers)]
+    db.add_all(retailers)
+    db.flush()
+
+    product_table = models.Product.__table__
+    for week in range(n_weeks):
+        valid_from = today - timedelta(days=7 * week)
+        ad_period = "current" if week == 0 else "previous" if week == 1 else "archived"
+        for retailer in retailers:
+            weekly_ad = models.WeeklyAd(
+                retailer_id=retailer.id,
+                date_processed=valid_from,
+                valid_from=valid_from,
+                valid_to=valid_from + timedelta(days=6),
+                filename=f"{retailer.name}-week-{week}.pdf",
+                ad_period=ad_period,
+            )
+            db.add(weekly_ad)
+            db.flush()
+            rows = []
+            for _ in range(products_per_ad):
+                row = _product_row(rng, rng.choice(categories))
+                row.update(weekly_ad_id=weekly_ad.id, retailer_id=retailer.id, promotion_from=weekly_ad.valid_from, promotion_to=weekly_ad.valid_to,
+                           ad_week=product_partitions.ad_week(weekly_ad.valid_from))
+                row.update(json_to_db_service.product_pricing_values(row["price"], row["original_price"], row["unit"], row["promotion_details"]))
+                text = f"{row['name']} {row['category']} {row['gen_terms']}"
+                row.update(batch_embedding_service._embedding_update_values(hash_embedding(text)))
+                rows.append(row)
+            db.execute(product_table.insert(), rows)
+        db.commit()
+    return [retailer.id for retailer in retailers]
+
+
+def write_extraction_files(directory: Path, retailer_names: List[str], products_per_ad: int, round_no: int, seed: int = 7) -> None:
+    """Writes one enhanced-extraction JSON file per retailer for a new ad week, as process_json_extractions expects."""
+    rng = random.Random(seed + round_no)
+    valid_from = date.today() + timedelta(days=7 * (round_no + 1))
+    for name in retailer_names:
+        products = []
+        for _ in range(products_per_ad):
+            row = _product_row(rng, rng.choice(list(ITEMS)))
+            row["retailer"] = name
+            products.append(row)
+        data = {
+            "retailer": name,
+            "weekly_ad": {
+                "valid_from": valid_from.isoformat(),
+                "valid_to": (valid_from + timedelta(days=6)).isoformat(),
+                "date_processed": date.today().isoformat(),
+                "filename": f"{name}-ingest-{round_no}.pdf",
+            },
+            "products": products,
+        }
+        (directory / f"{name}-ingest-{round_no}.json").write_text(json.dumps(data), encoding="utf-8")
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(name: str, latencies: List[float], wall_seconds: float, items: Optional[int] = None) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    result = {
+        "name": name,
+        "calls": len(ordered),
+        "throughput_per_s": len(ordered) / wall_seconds if wall_seconds else 0.0,
+        "p50_ms": percentile(ordered, 50) * 1000,
+        "p95_ms": percentile(ordered, 95) * 1000,
+        "p99_ms": percentile(ordered, 99) * 1000,
+        "max_ms": (ordered[-1] if ordered else 0.0) * 1000,
+    }
+    if items is not None:
+        result["items_per_s"] = items / wall_seconds if wall_seconds else 0.0
+    return result
+
+
+def measure(name: str, call: Callable[[Any, random.Random], Awaitable[Any]], iterations: int, concurrency: int, seed: int = 1) -> Dict[str, Any]:
+    """
+    Runs `call(db, rng)` `iterations` times spread over `concurrency` threads, each with its own session and
+    event loop (the services use sync sessions, so threads are what gives real concurrency here).
+    Sessions are routed like the read endpoints' (to DATABASE_READ_URL when it is set and fresh enough).
+    """
+    def worker(worker_no: int, count: int) -> List[float]:
+        rng = random.Random(seed * 1000 + worker_no)
+        db = open_read_session()
+        latencies = []
+
+        async def run():
+            for _ in range(count):
+                start = time.perf_counter()
+                await call(db, rng)
+                latencies.append(time.perf_counter() - start)
+        try:
+            asyncio.run(run())
+        finally:
+            db.close()
+        return latencies
+
+    shares = [iterations // concurrency + (1 if i < iterations % concurrency else 0) for i in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, range(concurrency), shares))
+    wall = time.perf_counter() - start
+    return summarize(name, [latency for worker_latencies in results for latency in worker_latencies], wall)
+
+
+def measure_ingestion(retailer_names: List[str], products_per_ad: int, rounds: int) -> List[Dict[str, Any]]:
+    """Times process_json_extractions and the following batch_embed_products over `rounds` new ad weeks."""
+    load_latencies, embed_latencies = [], []
+    loaded = embedded = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        source_dir = Path(tmp)
+        json_to_db_service.SOURCE_JSON_DIR = source_dir
+        db = SessionLocal()
+        try:
+            for round_no in range(rounds):
+                for old_file in source_dir.glob("*.json"):
+                    old_file.unlink()
+                write_extraction_files(source_dir, retailer_names, products_per_ad, round_no)
+
+                start = time.perf_counter()
+                json_to_db_service.process_json_extractions(db)
+                load_latencies.append(time.perf_counter() - start)
+                loaded += len(retailer_names) * products_per_ad
+
+                missing = db.query(models.Product).filter(batch_embedding_service._missing_embedding_filter()).count()
+                start = time.perf_counter()
+                batch_embedding_service.batch_embed_products(db)
+                embed_latencies.append(time.perf_counter() - start)
+                embedded += missing - db.query(models.Product).filter(batch_embedding_service._missing_embedding_filter()).count()
+        finally:
+            db.close()
+    return [
+        summarize("process_json_extractions", load_latencies, sum(load_latencies), items=loaded),
+        summarize("batch_embed_products", embed_latencies, sum(embed_latencies), items=embedded),
+    ]
+
+
+def print_results(results: List[Dict[str, Any]], baseline: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+    header = f"{'operation':<28} {'calls':>6} {'ops/s':>8} {'items/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    if baseline:
+        header += f" {'p95 vs base':>12}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        items = f"{r['items_per_s']:8.1f}" if "items_per_s" in r else f"{'-':>8}"
+        line = (f"{r['name']:<28} {r['calls']:>6} {r['throughput_per_s']:8.1f} {items} "
+                f"{r['p50_ms']:9.1f} {r['p95_ms']:9.1f} {r['p99_ms']:9.1f} {r['max_ms']:9.1f}")
+        base = (baseline or {}).get(r["name"])
+        if base and base["p95_ms"]:
+            line += f" {(r['p95_ms'] / base['p95_ms'] - 1) * 100:+11.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark service latency against a synthetic catalog with a local Gemini stand-in.")
+    parser.add_argument("--retailers", type=int, default=5)
+    parser.add_argument("--weeks", type=int, default=4)
+    parser.add_argument("--products", type=int, default=300, help="Products per weekly ad.")
+    parser.add_argument("--iterations", type=int, default=200, help="Calls per query workload.")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--ingest-rounds", type=int, default=3)
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="Simulated latency of each embed call.")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Simulated latency of each generate call.")
+    parser.add_argument("--output", type=Path, help="Save results as JSON.")
+    parser.add_argument("--baseline", type=Path, help="Compare p95 against results saved with --output.")
+    parser.add_argument("--keep", action="store_true", help="Keep the synthetic catalog after the run.")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper())
+    set_provider(LocalProvider(args.embed_latency_ms, args.llm_latency_ms))
+
+    db = SessionLocal()
+    try:
+        reset_catalog(db)
+        start = time.perf_counter()
+        retailer_ids = build_catalog(db, args.retailers, args.weeks, args.products)
+        retailer_names = [name for (name,) in db.query(models.Retailer.name).filter(models.Retailer.id.in_(retailer_ids))]
+        print(f"Built catalog: {args.retailers} retailers x {args.weeks} weeks x {args.products} products "
+              f"in {time.perf_counter() - start:.1f}s")
+    finally:
+        db.close()
+
+    categories = list(ITEMS)
+
+    async def search(db, rng):
+        return await product_service.search_products(q=rng.choice(SEARCH_TERMS))
+
+    async def filter_products(db, rng):
+        return await product_service.get_products_by_filter(
+            db, store_ids=[str(rng.choice(retailer_ids))], categories=rng.sample(categories, 2))
+
+    async def similarity(db, rng):
+        return await similarity_query.similarity_search_products(query=rng.choice(SEARCH_TERMS + CHAT_QUERIES))
+
+    try:
+        results = [
+            measure("search_products", search, args.iterations, args.concurrency),
+            measure("get_products_by_filter", filter_products, args.iterations, args.concurrency),
+            measure("similarity_search_products", similarity, args.iterations, args.concurrency),
+        ]
+        if args.ingest_rounds:
+            results += measure_ingestion(retailer_names, args.products, args.ingest_rounds)
+    finally:
+        if not args.keep:
+            db = SessionLocal()
+            try:
+                reset_catalog(db)
+            finally:
+                db.close()
+
+    print(f"Simulated model latency: {args.embed_latency_ms:.0f} ms per embed call, {args.llm_latency_ms:.0f} ms per generate call")
+    baseline = None
+    if args.baseline:
+        baseline = {r["name"]: r for r in json.loads(args.baseline.read_text())["results"]}
+    print_results(results, baseline)
+    if args.output:
+        args.output.write_text(json.dumps({"args": {k: str(v) for k, v in vars(args).items()}, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+sqlalchemy = pytest.importorskip("sqlalchemy")
+pytest.importorskip("pgvector")
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from google.api_core import exceptions as google_exceptions # type: ignore
+
+from app import models
+from app.services import gemini_upload_registry
+from app.services.gemini_upload_registry import UploadRegistry
+
+'''
+Upload registry against a real Postgres: TEST_DATABASE_URL (see test_read_replica_fallback.py). The gemini_uploads
+table is created if missing and emptied around each test. Skipped when the server is not set or not reachable.
+'''
+
+DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+class FakeFilesApi:
+    """In-memory stand-in for the Gemini Files API."""
+
+    def __init__(self, live=None, on_upload=None):
+        self.live = {} if live is None else live # Remote files, shareable between "processes"
+        self.uploads = 0
+        self.deleted = []
+        self.on_upload = on_upload
+
+    def upload_file(self, path, display_name):
+        self.uploads += 1
+        handle = SimpleNamespace(name=f"files/{display_name}-{self.uploads}-{id(self)}", uri="", expiration_time=None)
+        self.live[handle.name] = handle
+        if self.on_upload:
+            self.on_upload(handle)
+        return handle
+
+    def get_file(self, name):
+        if name not in self.live:
+            raise google_exceptions.NotFound(name)
+        return self.live[name]
+
+    def delete_file(self, name):
+        self.deleted.append(name)
+        self.live.pop(name, None)
+
+
+@pytest.fixture
+def sessions():
+    """Session factory on the test database, with an empty gemini_uploads table."""
+    if not DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL must point at a reachable Postgres database.")
+    engine = create_engine(DATABASE_URL, connect_args={"connect_timeout": 3})
+    try:
+        models.GeminiUpload.__table__.create(engine, checkfirst=True)
+    except sqlalchemy.exc.OperationalError:
+        engine.dispose()
+        pytest.skip("TEST_DATABASE_URL must point at a reachable Postgres database.")
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM gemini_uploads"))
+    yield sessionmaker(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM gemini_uploads"))
+    engine.dispose()
+
+
+async def _drain(registry):
+    await asyncio.gather(*registry._background_tasks)
+
+
+def test_acquire_reuses_live_upload(sessions, tmp_path):
+    files_api = FakeFilesApi()
+    registry = UploadRegistry(files_api, sessions)
+
+    async def run():
+        first = await registry.acquire("sha", tmp_path / "a.pdf", "a.pdf")
+        second = await registry.acquire("sha", tmp_path / "a.pdf", "a.pdf")
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first is second
+    assert files_api.uploads == 1
+    assert registry._key_locks == {}
+
+
+def test_release_deletes_remote_file_and_entry(sessions, tmp_path):
+    files_api = FakeFilesApi()
+    registry = UploadRegistry(files_api, sessions)
+
+    async def run():
+        handle = await registry.acquire("sha", tmp_path / "a.pdf", "a.pdf")
+        await registry.release("sha")
+        await _drain(registry)
+        return handle
+
+    handle = asyncio.run(run())
+    assert files_api.deleted == [handle.name]
+    assert registry.entries() == {}
+
+
+def test_release_prefix_covers_file_and_chunks(sessions, tmp_path):
+    files_api = FakeFilesApi()
+    registry = UploadRegistry(files_api, sessions)
+
+    async def run():
+        for key in ("sha", "sha-p1-10", "sha-p11-20", "other"):
+            await registry.acquire(key, tmp_path / "a.pdf", key)
+        await registry.release_prefix("sha")
+        await _drain(registry)
+
+    asyncio.run(run())
+    assert len(files_api.deleted) == 3
+    assert list(registry.entries()) == ["other"]
+
+
+def test_workers_sharing_the_table_keep_each_others_entries(sessions, tmp_path):
+    first = UploadRegistry(FakeFilesApi(), sessions)
+    second = UploadRegistry(FakeFilesApi(), sessions)
+
+    async def run():
+        await first.acquire("a", tmp_path / "a.pdf", "a.pdf")
+        await second.acquire("b", tmp_path / "b.pdf", "b.pdf")
+        await second.acquire("a", tmp_path / "a.pdf", "a.pdf")
+
+    asyncio.run(run())
+    assert sorted(first.entries()) == ["a", "b"]
+
+
+def test_concurrent_upload_of_same_key_keeps_the_first(sessions, tmp_path):
+    remote = {}
+    first_api = FakeFilesApi(remote)
+    first = UploadRegistry(first_api, sessions)
+    winner = first_api.upload_file(tmp_path / "a.pdf", "a.pdf")
+
+    def first_registers_meanwhile(handle):
+        expires_at = datetime.now(timezone.utc) + timedelta(hours=47)
+        first._register("sha", {"name": winner.name, "uri": "", "display_name": "a.pdf", "expires_at": expires_at})
+
+    second_api = FakeFilesApi(remote, on_upload=first_registers_meanwhile)
+    second = UploadRegistry(second_api, sessions)
+
+    async def run():
+        handle = await second.acquire("sha", tmp_path / "a.pdf", "a.pdf")
+        await _drain(second)
+        return handle
+
+    handle = asyncio.run(run())
+    assert handle.name == winner.name
+    assert second_api.uploads == 1
+    assert len(second_api.deleted) == 1 and second_api.deleted[0] != winner.name
+    assert second.entries()["sha"]["name"] == winner.name
+
+
+def test_prune_deletes_expired_entries(sessions):
+    registry = UploadRegistry(FakeFilesApi(), sessions)
+    now = datetime.now(timezone.utc)
+    registry._register("old", {"name": "files/old", "uri": "", "display_name": "old.pdf", "expires_at": now - timedelta(minutes=1)})
+    registry._register("new", {"name": "files/new", "uri": "", "display_name": "new.pdf", "expires_at": now + timedelta(hours=47)})
+
+    with sessions() as db:
+        assert gemini_upload_registry.prune(db) == 1
+    assert list(registry.entries()) == ["new"]
@@ -0,0 +1,185 @@
+import os
+
+import pytest
+
+sqlalchemy = pytest.importorskip("sqlalchemy")
+pytest.importorskip("pgvector")
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.services import job_queue
+
+'''
+Job queue SQL against a real Postgres: TEST_DATABASE_URL (see test_read_replica_fallback.py). The jobs table is
+created if missing. The tests only touch jobs of their own kind, deleted around each test, and are skipped when
+the server is not set or not reachable.
+'''
+
+DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+KIND = "test_job_queue"
+WORKER = "test-host:1:aaaaaa"
+
+
+@pytest.fixture
+def sessions():
+    """Session factory on the test database, with no jobs of KIND."""
+    if not DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL must point at a reachable Postgres database.")
+    engine = create_engine(DATABASE_URL, connect_args={"connect_timeout": 3})
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE SEQUENCE IF NOT EXISTS jobs_id_seq"))
+        models.Job.__table__.create(engine, checkfirst=True)
+    except sqlalchemy.exc.OperationalError:
+        engine.dispose()
+        pytest.skip("TEST_DATABASE_URL must point at a reachable Postgres database.")
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM jobs WHERE kind = :kind"), {"kind": KIND})
+    yield sessionmaker(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM jobs WHERE kind = :kind"), {"kind": KIND})
+    engine.dispose()
+
+
+@pytest.fixture
+def db(sessions):
+    with sessions() as session:
+        yield session
+
+
+@pytest.fixture
+def retry_delays(monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_RETRY_BASE_SECONDS", 100)
+    monkeypatch.setattr(job_queue, "JOB_RETRY_MAX_SECONDS", 1800)
+
+
+def _claim(db, worker_id=WORKER):
+    return job_queue.claim(db, worker_id, [KIND])
+
+
+def _retry_delay(db, job_id) -> float:
+    """Seconds between the failed attempt and the job's next run."""
+    return float(db.execute(text("SELECT extract(epoch FROM run_after - updated_at) FROM jobs WHERE id = :job_id"),
+                            {"job_id": job_id}).scalar())
+
+
+def _make_due(db, job_id):
+    db.execute(text("UPDATE jobs SET run_after = now() WHERE id = :job_id"), {"job_id": job_id})
+    db.commit()
+
+
+def test_enqueue_returns_the_active_job_for_a_key(db):
+    first = job_queue.enqueue(db, KIND, "a.pdf", {"n": 1})
+    again = job_queue.enqueue(db, KIND, "a.pdf", {"n": 2})
+    other = job_queue.enqueue(db, KIND, "b.pdf")
+    assert again["id"] == first["id"] and again["payload"] == {"n": 1}
+    assert other["id"] != first["id"]
+
+    while (job := _claim(db)) is not None:
+        job_queue.complete(db, job["id"], WORKER, {"ok": True})
+    assert job_queue.enqueue(db, KIND, "a.pdf")["id"] != first["id"] # Finished jobs do not block new ones
+
+
+def test_claim_skips_jobs_locked_by_other_workers(sessions, db):
+    first = job_queue.enqueue(db, KIND, "a.pdf")
+    second = job_queue.enqueue(db, KIND, "b.pdf")
+
+    with sessions() as other:
+        # Another worker mid-claim holds the oldest job's row lock
+        other.execute(text("SELECT id FROM jobs WHERE id = :job_id FOR UPDATE"), {"job_id": first["id"]})
+        claimed = _claim(db)
+        other.rollback()
+    assert claimed["id"] == second["id"]
+    assert claimed["status"] == job_queue.RUNNING and claimed["attempts"] == 1 and claimed["locked_by"] == WORKER
+    assert _claim(db)["id"] == first["id"]
+    assert _claim(db) is None
+
+
+def test_failed_attempts_back_off_exponentially_with_jitter(db, retry_delays):
+    job = job_queue.enqueue(db, KIND, "a.pdf", max_attempts=3)
+
+    assert _claim(db)["attempts"] == 1
+    assert job_queue.fail(db, job["id"], WORKER, "rate limited") == job_queue.QUEUED
+    assert 50 <= _retry_delay(db, job["id"]) < 150 # base * 2^0 * [0.5, 1.5)
+    assert _claim(db) is None # Not due yet
+
+    _make_due(db, job["id"])
+    assert _claim(db)["attempts"] == 2
+    assert job_queue.fail(db, job["id"], WORKER, "rate limited") == job_queue.QUEUED
+    assert 100 <= _retry_delay(db, job["id"]) < 300 # base * 2^1 * [0.5, 1.5)
+
+    _make_due(db, job["id"])
+    assert _claim(db)["attempts"] == 3
+    assert job_queue.fail(db, job["id"], WORKER, "rate limited") == job_queue.FAILED # Out of attempts
+    failed = job_queue.get(db, job["id"])
+    assert failed["error"] == "rate limited" and failed["locked_by"] is None
+
+
+def test_jitter_spreads_jobs_that_failed_together(db, retry_delays):
+    jobs = [job_queue.enqueue(db, KIND, f"{n}.pdf") for n in range(20)]
+    for _ in jobs:
+        job = _claim(db)
+        job_queue.fail(db, job["id"], WORKER, "429 Resource exhausted")
+
+    delays = [_retry_delay(db, job["id"]) for job in jobs]
+    assert all(50 <= delay < 150 for delay in delays)
+    assert len({round(delay, 3) for delay in delays}) > 1
+
+
+def test_retry_delay_is_capped(db, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_RETRY_BASE_SECONDS", 200)
+    monkeypatch.setattr(job_queue, "JOB_RETRY_MAX_SECONDS", 60)
+    job = job_queue.enqueue(db, KIND, "a.pdf")
+    _claim(db)
+    job_queue.fail(db, job["id"], WORKER, "error")
+    assert _retry_delay(db, job["id"]) == pytest.approx(60)
+
+
+def test_permanent_failure_and_lost_lock(db):
+    job = job_queue.enqueue(db, KIND, "a.pdf", max_attempts=3)
+    _claim(db)
+    assert job_queue.fail(db, job["id"], "test-host:2:bbbbbb", "not mine") is None # Only the lock holder can fail it
+    assert job_queue.fail(db, job["id"], WORKER, "input is gone", retry=False) == job_queue.FAILED
+    assert job_queue.get(db, job["id"])["attempts"] == 1
+
+
+def test_release_does_not_use_up_an_attempt(db):
+    job = job_queue.enqueue(db, KIND, "a.pdf")
+    _claim(db)
+    job_queue.release(db, job["id"], WORKER)
+
+    released = job_queue.get(db, job["id"])
+    assert released["status"] == job_queue.QUEUED and released["attempts"] == 0 and released["locked_by"] is None
+    assert _claim(db)["id"] == job["id"] # Due at once
+
+
+def test_requeue_stale_recovers_jobs_of_silent_workers(db):
+    stale = job_queue.enqueue(db, KIND, "stale.pdf", max_attempts=3)
+    exhausted = job_queue.enqueue(db, KIND, "exhausted.pdf", max_attempts=1)
+    alive = job_queue.enqueue(db, KIND, "alive.pdf")
+    for _ in range(3):
+        _claim(db)
+    db.execute(text("UPDATE jobs SET locked_at = now() - interval '10 minutes' WHERE id = ANY(:job_ids)"),
+               {"job_ids": [stale["id"], exhausted["id"]]})
+    db.commit()
+    job_queue.heartbeat(db, WORKER, [alive["id"]])
+
+    recovered = {job["id"]: job["status"] for job in job_queue.requeue_stale(db, 60)}
+    assert recovered.get(stale["id"]) == job_queue.QUEUED
+    assert recovered.get(exhausted["id"]) == job_queue.FAILED # Its only attempt is used up
+    assert alive["id"] not in recovered
+    requeued = job_queue.get(db, stale["id"])
+    assert requeued["locked_by"] is None and WORKER in requeued["error"]
+    assert job_queue.get(db, alive["id"])["status"] == job_queue.RUNNING
+
+
+def test_requeue_worker_recovers_jobs_of_an_exited_process(db):
+    job = job_queue.enqueue(db, KIND, "a.pdf")
+    _claim(db, "test-host:2:bbbbbb")
+    assert "test-host:2:bbbbbb" in job_queue.running_workers(db, "test-host")
+    assert job_queue.running_workers(db, "test-hos") == [] # Matches the whole host name only
+
+    assert [recovered["id"] for recovered in job_queue.requeue_worker(db, "test-host:2:bbbbbb")] == [job["id"]]
+    assert job_queue.get(db, job["id"])["status"] == job_queue.QUEUED
+    assert job_queue.running_workers(db, "test-host") == []
@@ -0,0 +1,49 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("pgvector")
+
+from app.services.json_to_db_service import product_pricing_values
+
+
+def _values(unit_price, unit_price_basis, discount_pct=None):
+    return {"unit_price": unit_price, "unit_price_basis": unit_price_basis, "discount_pct": discount_pct}
+
+
+@pytest.mark.parametrize("price, original_price, unit, promotion_details, expected", [
+    # No usable price: nothing is derived, not even the discount
+    (None, 4.99, "lb", None, _values(None, None)),
+    (0, 4.99, "lb", None, _values(None, None)),
+    (-1.5, 4.99, "lb", None, _values(None, None)),
+    # Weights, volumes and counts normalise to $/lb, $/gal and $/each (unit names are case-insensitive)
+    (3.99, None, "lb", None, _values(3.99, "lb")),
+    (2.0, None, "oz", None, _values(32.0, "lb")),
+    (2.20462, None, "kg", None, _values(1.0, "lb")),
+    (1.5, None, "Quart", None, _values(6.0, "gal")),
+    (0.5, None, "fl oz", None, _values(64.0, "gal")),
+    (3.6, None, " Dozen ", None, _values(0.3, "each")),
+    (5, None, "Each", None, _values(5.0, "each")),
+    # Package units use the size in promotion_details
+    (4.0, None, "Pack", "8-oz. Pkg.", _values(8.0, "lb")),
+    (6.0, None, "pack", "1.5 lb bag", _values(4.0, "lb")),
+    (3.0, None, "Box", "64 fl oz", _values(6.0, "gal")),
+    (3.0, None, "box", "64 FL. OZ. bottle", _values(6.0, "gal")),
+    (3.0, None, "each", "6 oz cup", _values(8.0, "lb")),
+    # ...and fall back to the unit itself without a usable size
+    (4.0, None, "pack", "Buy one get one free", _values(4.0, "pack")),
+    (4.0, None, "pack", "0 oz", _values(4.0, "pack")),
+    (4.0, None, "each", None, _values(4.0, "each")),
+    # Sizes are ignored for units that are not packages
+    (2.0, None, "lb", "16 oz", _values(2.0, "lb")),
+    # Unknown units keep the listed price as their own basis; no unit means no unit price
+    (2.5, None, "Bunch", None, _values(2.5, "bunch")),
+    (2.5, None, None, None, _values(None, None)),
+    (2.5, None, "  ", None, _values(None, None)),
+    # discount_pct only when original_price is above the price
+    (3.99, 4.99, "lb", None, _values(3.99, "lb", 20.04)),
+    (5.0, 10.0, None, None, _values(None, None, 50.0)),
+    (4.99, 4.99, "lb", None, _values(4.99, "lb")),
+    (4.99, 3.99, "lb", None, _values(4.99, "lb")),
+])
+def test_product_pricing_values(price, original_price, unit, promotion_details, expected):
+    assert product_pricing_values(price, original_price, unit, promotion_details) == pytest.approx(expected)
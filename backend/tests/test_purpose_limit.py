@@ -0,0 +1,165 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.services.model_clients import PurposeLimit
+
+'''
+PurposeLimit hand-offs between sync callers (threads) and coroutines, with a limit of one slot so every
+waiter queues. Threads are joined with a timeout, so a lost wake-up fails the test instead of hanging it.
+'''
+
+TIMEOUT = 5
+
+
+def _wait_until(predicate):
+    deadline = time.monotonic() + TIMEOUT
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def _start_thread(limit, entered, name):
+    """Starts a thread that takes the slot, records `name` and releases; returns once it is queued."""
+    queued = len(limit._waiters)
+
+    def run():
+        with limit:
+            entered.append(name)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    _wait_until(lambda: len(limit._waiters) > queued)
+    return thread
+
+
+def test_sync_waiters_are_served_in_arrival_order():
+    limit = PurposeLimit("test", 1)
+    entered = []
+    with limit:
+        threads = [_start_thread(limit, entered, n) for n in range(5)]
+        assert entered == []
+    for thread in threads:
+        thread.join(TIMEOUT)
+    assert entered == list(range(5))
+    assert limit._available == 1
+
+
+def test_async_waiters_are_served_in_arrival_order():
+    limit = PurposeLimit("test", 1)
+    entered = []
+
+    async def waiter(n):
+        async with limit:
+            entered.append(n)
+            await asyncio.sleep(0)
+
+    async def run():
+        async with limit:
+            tasks = []
+            for n in range(5):
+                tasks.append(asyncio.create_task(waiter(n)))
+                await asyncio.sleep(0) # Let it queue before the next one
+            assert len(limit._waiters) == 5
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert entered == list(range(5))
+    assert limit._available == 1
+
+
+def test_slot_passes_between_threads_and_coroutines_in_order():
+    limit = PurposeLimit("test", 1)
+    entered = []
+
+    async def waiter(n):
+        async with limit:
+            entered.append(n)
+
+    async def run():
+        async with limit:
+            first = _start_thread(limit, entered, "thread 1")
+            task = asyncio.create_task(waiter("coroutine"))
+            await asyncio.sleep(0)
+            second = _start_thread(limit, entered, "thread 2")
+            assert len(limit._waiters) == 3
+        await asyncio.wait_for(task, TIMEOUT)
+        await asyncio.to_thread(second.join, TIMEOUT)
+        first.join(TIMEOUT)
+
+    asyncio.run(run())
+    assert entered == ["thread 1", "coroutine", "thread 2"]
+    assert limit._available == 1
+
+
+def test_coroutines_on_different_loops_share_the_limit():
+    limit = PurposeLimit("test", 1)
+    entered = []
+    released = threading.Event()
+
+    async def hold():
+        async with limit:
+            entered.append("holder")
+            await asyncio.to_thread(released.wait, TIMEOUT)
+
+    async def wait():
+        async with limit:
+            entered.append("waiter")
+
+    holder = threading.Thread(target=asyncio.run, args=(hold(),), daemon=True)
+    holder.start()
+    _wait_until(lambda: entered == ["holder"])
+    waiter = threading.Thread(target=asyncio.run, args=(wait(),), daemon=True)
+    waiter.start()
+    _wait_until(lambda: len(limit._waiters) == 1)
+    released.set()
+    holder.join(TIMEOUT)
+    waiter.join(TIMEOUT)
+    assert entered == ["holder", "waiter"]
+    assert limit._available == 1
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    limit = PurposeLimit("test", 1)
+
+    async def run():
+        async with limit:
+            task = asyncio.create_task(limit.__aenter__())
+            await asyncio.sleep(0)
+            assert len(limit._waiters) == 1
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert len(limit._waiters) == 0
+        assert limit._available == 1
+
+    asyncio.run(run())
+
+
+def test_waiter_cancelled_after_the_grant_returns_the_slot():
+    limit = PurposeLimit("test", 1)
+    entered = []
+
+    async def waiter(n):
+        async with limit:
+            entered.append(n)
+
+    async def run():
+        await limit.__aenter__()
+        cancelled = asyncio.create_task(waiter("cancelled"))
+        await asyncio.sleep(0)
+        next_waiter = asyncio.create_task(waiter("next"))
+        await asyncio.sleep(0)
+        # Hand the slot to the first waiter and cancel it before it runs: it must pass the slot on
+        await limit.__aexit__(None, None, None)
+        assert len(limit._waiters) == 1 # Only "next" is still queued
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        await asyncio.wait_for(next_waiter, TIMEOUT)
+
+    asyncio.run(run())
+    assert entered == ["next"]
+    assert limit._available == 1
@@ -0,0 +1,131 @@
+import os
+
+import pytest
+
+sqlalchemy = pytest.importorskip("sqlalchemy")
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+
+from app import database
+from app.services.catalog_cache import CatalogCache
+from app.services import catalog_cache as catalog_cache_module
+
+'''
+Read/write split against real servers. TEST_DATABASE_URL is the primary and TEST_DATABASE_READ_URL the replica
+stand-in: any second Postgres (another database on a local server will do), e.g.
+    createdb grocery_replica
+    TEST_DATABASE_URL=postgresql://localhost/grocery TEST_DATABASE_READ_URL=postgresql://localhost/grocery_replica python -m pytest
+The tests are skipped when either server is not set or not reachable. A stand-in is not in recovery, so replica
+lag is simulated by replacing the lag query.
+'''
+
+PRIMARY_URL = os.getenv("TEST_DATABASE_URL")
+REPLICA_URL = os.getenv("TEST_DATABASE_READ_URL")
+
+_SERVER_SQL = text("SELECT current_database() || ':' || coalesce(inet_server_port(), 0)")
+
+
+def _reachable(url) -> bool:
+    if not url:
+        return False
+    engine = create_engine(url, connect_args={"connect_timeout": 3})
+    try:
+        engine.connect().close()
+        return True
+    except Exception:
+        return False
+    finally:
+        engine.dispose()
+
+
+def _server(db) -> str:
+    return db.execute(_SERVER_SQL).scalar()
+
+
+@pytest.fixture
+def split_databases(monkeypatch):
+    """Points app.database at the test primary and replica stand-in, with fresh engines and replica health."""
+    if not (_reachable(PRIMARY_URL) and _reachable(REPLICA_URL)):
+        pytest.skip("TEST_DATABASE_URL and TEST_DATABASE_READ_URL must point at two reachable Postgres databases.")
+
+    def configure(read_url=REPLICA_URL):
+        monkeypatch.setattr(database, "DATABASE_URL", PRIMARY_URL)
+        monkeypatch.setattr(database, "DATABASE_READ_URL", read_url)
+        monkeypatch.setattr(database, "_engine", None)
+        monkeypatch.setattr(database, "_read_engine", None)
+        monkeypatch.setattr(database, "SessionLocal", database._LazySessionFactory())
+        monkeypatch.setattr(database, "ReadSessionLocal", database._LazySessionFactory(database.get_read_engine))
+        monkeypatch.setattr(database, "replica_health", database._ReplicaHealth())
+        monkeypatch.setattr(database, "READ_REPLICA_LAG_CHECK_SECONDS", 0)
+        monkeypatch.setattr(database, "READ_REPLICA_MAX_LAG_SECONDS", 30)
+
+    configure()
+    yield configure
+    for engine in (database._engine, database._read_engine):
+        if engine is not None:
+            engine.dispose()
+
+
+def _set_lag(monkeypatch, seconds: float):
+    monkeypatch.setattr(database, "_REPLICA_LAG_SQL", text(f"SELECT {seconds} AS lag_seconds"))
+
+
+def _read_server() -> str:
+    db = database.open_read_session()
+    try:
+        return _server(db)
+    finally:
+        db.close()
+
+
+def test_lagging_replica_falls_back_to_primary(split_databases, monkeypatch):
+    with database.SessionLocal() as primary, database.ReadSessionLocal() as replica:
+        primary_server, replica_server = _server(primary), _server(replica)
+    assert primary_server != replica_server
+
+    _set_lag(monkeypatch, 0)
+    assert _read_server() == replica_server
+
+    _set_lag(monkeypatch, 120) # Over READ_REPLICA_MAX_LAG_SECONDS
+    assert _read_server() == primary_server
+    assert database.replica_health.lag_seconds == 120
+
+    _set_lag(monkeypatch, 0) # Caught up again
+    assert _read_server() == replica_server
+
+
+def test_unreachable_replica_falls_back_to_primary(split_databases):
+    split_databases(str(make_url(PRIMARY_URL).set(host="127.0.0.1", port=1)))
+    with database.SessionLocal() as primary:
+        primary_server = _server(primary)
+
+    assert _read_server() == primary_server
+    assert database.replica_health.lag_seconds is None
+
+
+def test_catalog_version_is_read_on_primary(split_databases, monkeypatch):
+    # The fingerprint names the server it was read on, so a version read on the replica would differ
+    monkeypatch.setattr(catalog_cache_module, "_VERSION_SQL", text(
+        "SELECT current_database() || ':' || coalesce(inet_server_port(), 0) AS ad_period, 1 AS ads, 0 AS max_id"))
+    _set_lag(monkeypatch, 0)
+    cache = CatalogCache(version_ttl=0)
+    builds = []
+
+    with database.SessionLocal() as primary:
+        primary_version = catalog_cache_module._read_version(primary)
+    replica = database.open_read_session()
+    try:
+        assert replica.get_bind() is database.get_read_engine()
+        for _ in range(2):
+            cache.get_or_build(replica, "view", "key", lambda version: builds.append(version) or version)
+            assert cache.version() == primary_version
+    finally:
+        replica.close()
+
+    # Built on a session that does not see the primary's version: served, but never cached
+    assert builds == [primary_version, primary_version]
+
+    with database.SessionLocal() as primary:
+        cache.get_or_build(primary, "view", "key", lambda version: builds.append(version) or version)
+        cache.get_or_build(primary, "view", "key", lambda version: builds.append(version) or version)
+    assert len(builds) == 3
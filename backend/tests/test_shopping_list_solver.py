@@ -0,0 +1,114 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("fastapi")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("pgvector")
+
+from app.services import shopping_list_service
+from app.services.shopping_list_service import _best_matches, _solve
+
+'''
+The shopping-list matrix logic on synthetic candidate rows, shaped like the rows of _CANDIDATES_SQL.
+'''
+
+RETAILERS = {1: "Aldi", 2: "Bristol Farms", 3: "Costco"}
+
+
+@pytest.fixture(autouse=True)
+def similarity_threshold(monkeypatch):
+    monkeypatch.setattr(shopping_list_service, "SHOPPING_LIST_SIMILARITY_THRESHOLD", 0.6)
+
+
+def _row(item_idx, product_id, retailer_id, price, similarity=0.9, fts_match=True):
+    return SimpleNamespace(
+        item_idx=item_idx, id=product_id, name=f"product {product_id}", price=price, unit="each", unit_price=None,
+        unit_price_basis=None, retailer_id=retailer_id, retailer_name=RETAILERS[retailer_id],
+        similarity=similarity, fts_match=fts_match,
+    )
+
+
+def _ids(matches):
+    return [match.product_id for match in matches]
+
+
+def test_best_matches_keeps_only_each_items_best_tier():
+    rows = [
+        _row(0, 1, 1, 5.0),                                  # full-text and semantic
+        _row(0, 2, 2, 1.0, fts_match=False),                 # semantic only, cheaper
+        _row(0, 3, 1, 2.0, similarity=0.2),                  # full-text only
+        _row(0, 4, 3, 0.5, similarity=0.2, fts_match=False), # neither
+        _row(1, 5, 1, 3.0, similarity=None),                 # full-text only (no embedding)
+        _row(1, 6, 2, 1.0, fts_match=False),                 # semantic only
+        _row(2, 7, 1, 1.0, similarity=0.1, fts_match=False), # neither
+    ]
+    assert [row.id for row in _best_matches(rows)] == [1, 5]
+
+
+def test_solve_picks_cheapest_product_per_cell_and_per_item():
+    items = ["milk", "eggs", "bread"]
+    rows = [
+        _row(0, 101, 1, 3.00),
+        _row(0, 102, 1, 2.50),
+        _row(0, 201, 2, 2.80),
+        _row(1, 202, 2, 1.20),
+        _row(1, 103, 1, 2.00),
+        _row(2, 301, 3, 1.00),
+    ]
+    result = _solve(items, rows, "current")
+
+    assert [item.item for item in result.items] == items
+    assert _ids(item.cheapest for item in result.items) == [102, 202, 301]
+    assert result.split_total == pytest.approx(4.70)
+    baskets = {store.retailer_id: store for store in result.stores}
+    assert _ids(baskets[1].products) == [102, 103] # The cheaper of the two milks
+    assert baskets[1].total == pytest.approx(4.50)
+
+
+def test_solve_orders_stores_by_coverage_then_total():
+    items = ["milk", "eggs", "bread"]
+    rows = [
+        _row(0, 102, 1, 2.50), _row(1, 103, 1, 2.00), # Aldi: 2 items, 4.50
+        _row(0, 201, 2, 2.80), _row(1, 202, 2, 1.20), # Bristol Farms: 2 items, 4.00
+        _row(2, 301, 3, 1.00),                        # Costco: 1 item, 1.00
+    ]
+    result = _solve(items, rows, "current")
+
+    assert [store.retailer_id for store in result.stores] == [2, 1, 3]
+    assert [store.items_found for store in result.stores] == [2, 2, 1]
+    assert result.best_single_store == result.stores[0]
+    assert result.stores[0].retailer_name == "Bristol Farms"
+    assert result.stores[0].missing_items == ["bread"]
+    assert result.stores[2].missing_items == ["milk", "eggs"]
+
+
+def test_solve_reports_items_without_matches():
+    items = ["milk", "caviar"]
+    rows = [_row(0, 101, 1, 3.00), _row(1, 102, 1, 99.0, similarity=0.1, fts_match=False)]
+    result = _solve(items, rows, "previous")
+
+    assert result.ad_period == "previous"
+    assert result.items[0].cheapest.product_id == 101
+    assert result.items[1].cheapest is None
+    assert result.split_total == pytest.approx(3.00)
+    assert result.best_single_store.missing_items == ["caviar"]
+    assert result.best_single_store.total == pytest.approx(3.00)
+
+
+def test_solve_never_trades_match_quality_for_price():
+    rows = [_row(0, 1, 1, 5.0), _row(0, 2, 2, 1.0, fts_match=False)]
+    result = _solve(["apples"], rows, "current")
+
+    assert result.items[0].cheapest.product_id == 1
+    assert [store.retailer_id for store in result.stores] == [1]
+
+
+def test_solve_without_candidates():
+    result = _solve(["milk", "eggs"], [], "current")
+
+    assert [item.cheapest for item in result.items] == [None, None]
+    assert result.split_total == 0
+    assert result.stores == []
+    assert result.best_single_store is None
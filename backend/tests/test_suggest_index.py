@@ -0,0 +1,90 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("pgvector")
+
+from app.services import suggest_service
+from app.services.suggest_service import SuggestIndex
+
+'''
+SuggestIndex built from in-memory entries ({(normalised text, kind): (display text, count)}), as
+build_suggest_index would produce them.
+'''
+
+ENTRIES = {
+    ("chicken breast", "product"): ("Chicken Breast", 12),
+    ("chicken thighs", "product"): ("Chicken Thighs", 12),
+    ("chicken", "term"): ("chicken", 12),
+    ("chicken", "category"): ("Chicken", 5),
+    ("bread", "product"): ("Bread", 3),
+    ("breakfast", "category"): ("Breakfast", 3),
+    ("bread and bread crumbs", "product"): ("Bread and Bread Crumbs", 1),
+    ("brie", "product"): ("Brie", 7),
+}
+
+
+def _texts(suggestions):
+    return [suggestion.text for suggestion in suggestions]
+
+
+def test_ranks_by_count_then_kind_then_length_then_text():
+    index = SuggestIndex(ENTRIES)
+
+    # Equal counts: term before product, then the shorter and alphabetically first text
+    assert _texts(index.lookup("chic", 10)) == ["chicken", "Chicken Breast", "Chicken Thighs", "Chicken"]
+    # Equal counts: category before product
+    assert _texts(index.lookup("brea", 10)) == ["Chicken Breast", "Breakfast", "Bread", "Bread and Bread Crumbs"]
+    assert _texts(index.lookup("br", 10)) == ["Chicken Breast", "Brie", "Breakfast", "Bread", "Bread and Bread Crumbs"]
+
+
+def test_matches_word_starts_once_per_suggestion():
+    index = SuggestIndex(ENTRIES)
+
+    assert _texts(index.lookup("thighs", 10)) == ["Chicken Thighs"]
+    assert _texts(index.lookup("crumbs", 10)) == ["Bread and Bread Crumbs"]
+    # "bread" starts two words of the same product; it is suggested once
+    assert _texts(index.lookup("bread", 10)) == ["Bread", "Bread and Bread Crumbs"]
+    assert _texts(index.lookup("hicken", 10)) == []
+
+
+def test_normalises_the_prefix():
+    index = SuggestIndex(ENTRIES)
+
+    assert _texts(index.lookup("  CHICKEN-Bre", 10)) == ["Chicken Breast"]
+    assert index.lookup("", 10) == []
+    assert index.lookup(" -- ", 10) == []
+
+
+def test_limit_applies_to_short_and_long_prefixes():
+    index = SuggestIndex(ENTRIES)
+
+    assert _texts(index.lookup("ch", 2)) == ["chicken", "Chicken Breast"]
+    assert _texts(index.lookup("chicken", 2)) == ["chicken", "Chicken Breast"]
+
+
+def test_long_prefix_finds_popular_suggestion_late_in_its_range():
+    entries = {(f"apple {name}", "product"): (f"Apple {name}", 1) for name in ("a", "b", "c", "d", "e", "f")}
+    entries[("apple zucchini bread", "product")] = ("Apple Zucchini Bread", 50)
+    index = SuggestIndex(entries)
+
+    assert _texts(index.lookup("apple", 3)) == ["Apple Zucchini Bread", "Apple a", "Apple b"]
+
+
+def _ranked_by_scan(prefix, limit):
+    """Expected lookup: every entry with a word starting with `prefix`, ranked by count, kind, length, text."""
+    kind_order = {"category": 0, "term": 1, "product": 2}
+    matches = [(display, kind, count) for (key, kind), (display, count) in ENTRIES.items()
+               if any(" ".join(key.split(" ")[start:]).startswith(prefix) for start in range(len(key.split(" "))))]
+    matches.sort(key=lambda match: (-match[2], kind_order[match[1]], len(match[0]), match[0]))
+    return [(display, kind, count) for display, kind, count in matches[:limit]]
+
+
+def test_every_prefix_matches_a_full_scan(monkeypatch):
+    monkeypatch.setattr(suggest_service, "SHORT_PREFIX_LENGTH", 4) # Prefixes up to 4 characters are precomputed
+    index = SuggestIndex(ENTRIES)
+
+    prefixes = {key[:length].strip() for (key, _) in ENTRIES for length in range(1, len(key) + 1)}
+    for prefix in sorted(prefixes):
+        for limit in (1, 3, suggest_service.SUGGEST_MAX_LIMIT):
+            found = [(suggestion.text, suggestion.kind, suggestion.count) for suggestion in index.lookup(prefix, limit)]
+            assert found == _ranked_by_scan(prefix, limit), prefix